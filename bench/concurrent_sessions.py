@@ -0,0 +1,70 @@
+"""Нагрузочное сравнение серверов навыка: N параллельных сессий шлют запросы на webhook.
+
+Пример:
+    python src/application.py & python bench/concurrent_sessions.py --url https://localhost:5000/ --sessions 20
+    gunicorn -c src/gunicorn.conf.py & python bench/concurrent_sessions.py --url https://localhost:5000/ --sessions 20
+"""
+import argparse
+import concurrent.futures
+import statistics
+import time
+import uuid
+
+import requests
+import urllib3
+
+COMMANDS = ['', 'напомни команду', 'помощь', 'покажи тикеты гитхаб', 'помощь стендап']
+
+
+def payload(user_id: str, session_id: str, message_id: int, command: str):
+    return {'version': '1.0',
+            'session': {'new': message_id == 0, 'message_id': message_id, 'session_id': session_id,
+                        'user': {'user_id': user_id}},
+            'request': {'command': command, 'original_utterance': command, 'nlu': {'intents': {}}}}
+
+
+def run_session(url: str, turns: int):
+    session = requests.Session()
+    user_id = f'bench-{uuid.uuid4().hex}'
+    session_id = uuid.uuid4().hex
+    latencies = []
+    errors = 0
+    for message_id in range(turns):
+        command = COMMANDS[message_id % len(COMMANDS)]
+        start = time.perf_counter()
+        try:
+            # verify=False в самом запросе: session.verify перекрывается переменной REQUESTS_CA_BUNDLE
+            session.post(url, json=payload(user_id, session_id, message_id, command), timeout=10,
+                         verify=False).raise_for_status()
+        except requests.RequestException:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='https://localhost:5000/')
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--turns', type=int, default=10)
+    args = parser.parse_args()
+    urllib3.disable_warnings()
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        results = list(pool.map(lambda _: run_session(args.url, args.turns), range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for session, _ in results for latency in session]
+    errors = sum(err for _, err in results)
+    print(f'requests: {len(latencies)}, errors: {errors}, throughput: {len(latencies) / elapsed:.1f} req/s')
+    print(f'p50: {percentile(latencies, 50) * 1000:.1f} ms, p95: {percentile(latencies, 95) * 1000:.1f} ms, '
+          f'p99: {percentile(latencies, 99) * 1000:.1f} ms, max: {max(latencies) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
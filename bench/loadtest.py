@@ -0,0 +1,238 @@
+"""Нагрузочный тест полными сессиями стендапа.
+
+Каждая сессия - новый пользователь, который проходит весь сценарий: приветствие, регистрация гитхаба
+и трекера, сбор команды, просмотр тикетов, стендап с темами и "у меня всё" для каждого участника.
+Запросы собираются так же, как их присылает Алиса. Гитхаб и трекер заменены заглушками с задержкой
+--upstream-latency, база - MockStorage из тестов (--backend memory) или Postgres из переменных
+окружения навыка (--backend postgres, лучше отдельная база). С --url запросы отправляются на
+запущенный сервер, тогда заглушки и база - на его стороне.
+
+Печатает пропускную способность и p50/p95/p99 по каждой команде. --save сохраняет результат в JSON,
+--baseline сравнивает с сохранённым и завершается с кодом 1, если p95 какой-то команды или пропускная
+способность хуже базовой больше чем на --tolerance.
+
+    python bench/loadtest.py --sessions 200 --concurrency 8 --members 5
+    python bench/loadtest.py --backend postgres --sessions 50
+    python bench/loadtest.py --baseline bench/loadtest_baseline.json
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'test'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import application  # noqa: E402
+import dialog  # noqa: E402
+from issue_tracker import IssueTracker  # noqa: E402
+from mock_connection import MockStorageConnectionFactory  # noqa: E402
+
+FIRST_NAMES = ['иван', 'мария', 'олег', 'анна', 'пётр', 'елена', 'сергей', 'ольга', 'дмитрий', 'наталья']
+LAST_NAMES = ['петров', 'иванова', 'сидоров', 'кузнецова', 'попов', 'смирнова', 'волков', 'соколова']
+THEMES = ['релиз', 'миграция базы', 'ревью', 'инцидент']
+
+# Ответы, которые значат, что сценарий пошёл не так: считаются ошибками
+UNRECOGNIZED = ('Неизвестная команда', 'Не смогла распознать команду', 'Возникла ошибка', 'Извините, я сейчас перегружена')
+
+Turn = Tuple[str, str, Dict[str, Any]]  # метка для отчёта, команда, интенты
+
+
+class StubTracker(IssueTracker):
+    latency = 0.0
+
+    def __init__(self, *args):
+        pass
+
+    def list_issues(self):
+        time.sleep(self.latency)
+        return [f'{number}. Тикет {number}' for number in range(1, 11)]
+
+    def issue_prefix(self, issue) -> str:
+        return f'{issue}. '
+
+    def close_issue(self, issue):
+        time.sleep(self.latency)
+
+    def team_members(self):
+        time.sleep(self.latency)
+        return [f'{first_name} {last_name}' for first_name, last_name in zip(FIRST_NAMES, LAST_NAMES)]
+
+
+class StubGithubTracker(StubTracker):
+    def __init__(self, *args):
+        super().__init__(*args)
+        time.sleep(self.latency)  # гитхаб при создании клиента получает токен установки
+
+
+def member_intent(first_name: str, last_name: str) -> Dict[str, Any]:
+    return {'team.newmember': {'slots': {'name': {'value': {'first_name': first_name, 'last_name': last_name}}}}}
+
+
+def session_script(members: int, source: str) -> List[Turn]:
+    # source - свой репозиторий и очередь у каждой сессии, чтобы первый список тикетов не брался из кэша
+    team = [(FIRST_NAMES[idx % len(FIRST_NAMES)], LAST_NAMES[idx % len(LAST_NAMES)]) for idx in range(members)]
+    turns = [('greeting', '', {}),
+             ('register github', f'запомни гитхаб bench {source} 1', {}),
+             ('register tracker', f'запомни трекер 1 {source}', {})]
+    for first_name, last_name in team:
+        turns.append(('add member', f'добавь в команду {first_name} {last_name}', member_intent(first_name, last_name)))
+    turns += [('remind team', 'напомни команду', {}),
+              ('github issues', 'покажи тикеты гитхаб', {}),
+              ('tracker issues', 'покажи тикеты трекер', {}),
+              ('close issue', 'закрой тикет 3 гитхаб', {}),
+              ('start standup', 'начни стендап', {})]
+    for idx in range(members):
+        if idx % 2 == 0:
+            turns.append(('theme', f'запомни тему {THEMES[idx % len(THEMES)]}', {}))
+        turns.append(('report done', 'у меня всё', {'end.report': {}}))
+    turns.append(('clean team', 'удали команду', {}))
+    return turns
+
+
+def payload(user_id: str, session_id: str, message_id: int, command: str, intents: Dict[str, Any]):
+    # Повторная сессия после приветствия: new только у первого сообщения
+    return {'version': '1.0',
+            'meta': {'locale': 'ru-RU', 'timezone': 'Europe/Moscow', 'client_id': 'ru.yandex.searchplugin/7.16',
+                     'interfaces': {'screen': {}, 'account_linking': {}}},
+            'session': {'new': message_id == 0, 'message_id': message_id, 'session_id': session_id,
+                        'skill_id': 'bench-skill', 'user': {'user_id': user_id, 'access_token': 'bench-token'},
+                        'application': {'application_id': uuid.uuid4().hex}},
+            'request': {'command': command, 'original_utterance': command, 'type': 'SimpleUtterance',
+                        'nlu': {'tokens': command.split(), 'entities': [], 'intents': intents}},
+            'state': {'session': {}, 'user': {}, 'application': {}}}
+
+
+def in_process(backend: str, latency: float) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    StubTracker.latency = latency
+    dialog.GithubTracker = StubGithubTracker
+    dialog.YandexTracker = StubTracker
+    if backend == 'memory':
+        # MockStorage хранит пользователей в словаре, а каждая сессия работает со своим пользователем,
+        # поэтому одно хранилище на все потоки
+        factory = MockStorageConnectionFactory()
+        application.StorageConnectionFactory = lambda: factory
+    return application.handle_webhook
+
+
+def over_http(url: str) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    import requests
+    import urllib3
+    urllib3.disable_warnings()
+    local = threading.local()
+
+    def send(body: Dict[str, Any]) -> Dict[str, Any]:
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        response = local.session.post(url, json=body, timeout=10, verify=False)
+        response.raise_for_status()
+        return response.json()
+    return send
+
+
+def run_session(send, members: int) -> Tuple[List[Tuple[str, float]], int]:
+    user_id = f'bench-{uuid.uuid4().hex}'
+    session_id = uuid.uuid4().hex
+    source = f'b{uuid.uuid4().hex[:12]}'
+    timings = []
+    errors = 0
+    for message_id, (label, command, intents) in enumerate(session_script(members, source)):
+        start = time.perf_counter()
+        try:
+            # Первое сообщение нового пользователя только создаёт его, сессия продолжается
+            response = send(payload(user_id, session_id, message_id, command, intents))
+            if response.get('response', {}).get('text', '').startswith(UNRECOGNIZED):
+                errors += 1
+        except Exception:  # noqa: B902 - ошибки считаются, а не прерывают нагрузку
+            errors += 1
+        timings.append((label, time.perf_counter() - start))
+    return timings, errors
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if len(values) == 1:
+        return {'p50': values[0], 'p95': values[0], 'p99': values[0]}
+    quantiles = statistics.quantiles(values, n=100)
+    return {'p50': quantiles[49], 'p95': quantiles[94], 'p99': quantiles[98]}
+
+
+def summarize(results, elapsed: float) -> Dict[str, Any]:
+    by_label = defaultdict(list)
+    errors = 0
+    for timings, session_errors in results:
+        errors += session_errors
+        for label, seconds in timings:
+            by_label[label].append(seconds)
+    total = sum(len(values) for values in by_label.values())
+    return {'requests': total, 'errors': errors, 'throughput': total / elapsed,
+            'commands': {label: dict(count=len(values), **percentiles(values)) for label, values in by_label.items()}}
+
+
+def report(summary: Dict[str, Any]):
+    print(f"requests: {summary['requests']}, errors: {summary['errors']}, "
+          f"throughput: {summary['throughput']:.1f} req/s")
+    print(f"{'command':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, stats in summary['commands'].items():
+        print(f"{label:<18}{stats['count']:>7}{stats['p50'] * 1000:>10.2f}"
+              f"{stats['p95'] * 1000:>10.2f}{stats['p99'] * 1000:>10.2f}")
+
+
+def regressions(summary: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, slack: float) -> List[str]:
+    # slack - абсолютный запас: у команд, которые выполняются за десятки микросекунд, относительный разброс
+    # между машинами велик, и без него сравнение срабатывало бы на шум
+    found = []
+    if summary['errors'] > baseline['errors']:
+        found.append(f"errors: {summary['errors']} > {baseline['errors']}")
+    if summary['throughput'] < baseline['throughput'] * (1 - tolerance):
+        found.append(f"throughput: {summary['throughput']:.1f} < {baseline['throughput']:.1f} req/s")
+    for label, stats in baseline['commands'].items():
+        current = summary['commands'].get(label)
+        if current is not None and current['p95'] > max(stats['p95'] * (1 + tolerance), stats['p95'] + slack):
+            found.append(f"{label} p95: {current['p95'] * 1000:.2f} > {stats['p95'] * 1000:.2f} ms")
+    return found
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['memory', 'postgres'], default='memory')
+    parser.add_argument('--url', help='отправлять запросы на запущенный сервер')
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--members', type=int, default=5)
+    parser.add_argument('--upstream-latency', type=float, default=0.02, help='задержка заглушек, секунды')
+    parser.add_argument('--save', help='сохранить результат в JSON')
+    parser.add_argument('--baseline', help='сравнить с сохранённым результатом')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--slack-ms', type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    send = over_http(args.url) if args.url else in_process(args.backend, args.upstream_latency)
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda _: run_session(send, args.members), range(args.sessions)))
+    summary = summarize(results, time.perf_counter() - start)
+    report(summary)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(summary, file, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            found = regressions(summary, json.load(file), args.tolerance, args.slack_ms / 1000)
+        for line in found:
+            print(f'REGRESSION {line}')
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
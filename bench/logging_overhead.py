@@ -0,0 +1,113 @@
+"""Задержка обработки webhook при разных настройках логирования.
+
+handle_webhook вызывается в процессе, база заменена MockStorage из тестов. Режимы:
+    sync  - как было: DEBUG, синхронная запись в файл, запрос, ответ и тело ответа гитхаба через %r
+    queue - src/log.py: JSON через очередь и отдельный поток, сводки вместо полных тел
+    off   - логирование отключено
+
+    python bench/logging_overhead.py --requests 5000 --github-issues 100
+"""
+import argparse
+import atexit
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'test'))
+
+import application  # noqa: E402
+import log  # noqa: E402
+from mock_connection import MockStorageConnectionFactory  # noqa: E402
+
+COMMANDS = ['помощь', 'напомни команду', 'помощь продолжение', 'включи тишину']
+
+
+def payload(message_id, command):
+    # Примерно так выглядит запрос Алисы: кроме команды приходят meta, токены nlu и состояние
+    return {'version': '1.0',
+            'meta': {'locale': 'ru-RU', 'timezone': 'Europe/Moscow', 'client_id': 'ru.yandex.searchplugin/7.16',
+                     'interfaces': {'screen': {}, 'payments': {}, 'account_linking': {}}},
+            'session': {'new': False, 'message_id': message_id, 'session_id': 'bench-session',
+                        'skill_id': 'bench-skill', 'user': {'user_id': 'bench-user', 'access_token': 'x' * 40},
+                        'application': {'application_id': 'bench-application'}},
+            'request': {'command': command, 'original_utterance': command, 'type': 'SimpleUtterance',
+                        'markup': {'dangerous_context': False},
+                        'nlu': {'tokens': command.split(), 'entities': [], 'intents': {}}},
+            'state': {'session': {}, 'user': {}, 'application': {}}}
+
+
+def github_body(issues):
+    return [{'number': number, 'title': f'Тикет {number}', 'body': 'Описание. ' * 50, 'state': 'open',
+             'user': {'login': 'author', 'id': 1}, 'labels': [{'name': 'bug'}]} for number in range(issues)]
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    logging.disable(logging.NOTSET)
+
+
+def run(mode, requests, issues, output):
+    reset_logging()
+    listener = None
+    body = github_body(issues)
+    if mode == 'sync':
+        handler = logging.StreamHandler(output)
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.DEBUG)
+    elif mode == 'queue':
+        stderr, sys.stderr = sys.stderr, output
+        try:
+            listener = log.setup_logging()
+        finally:
+            sys.stderr = stderr
+    else:
+        logging.disable(logging.CRITICAL)
+
+    latencies = []
+    for message_id in range(requests):
+        request = payload(message_id, COMMANDS[message_id % len(COMMANDS)])
+        start = time.perf_counter()
+        if mode == 'sync':
+            # Прежние вызовы из application.py и GithubTracker
+            logging.info('Request: %r', request)
+            logging.info('response from github: %r', body)
+            response = application.handle_webhook(request)
+            logging.info('Response: %r', response)
+        else:
+            logging.getLogger('github').debug('issues page', extra={'issues': len(body)})
+            application.handle_webhook(request)
+        latencies.append(time.perf_counter() - start)
+    if listener is not None:
+        atexit.unregister(listener.stop)
+        listener.stop()
+    reset_logging()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'{mode:>6}: p50 {quantiles[49] * 1e6:8.1f} us, p99 {quantiles[98] * 1e6:8.1f} us, '
+          f'mean {statistics.mean(latencies) * 1e6:8.1f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--github-issues', type=int, default=100)
+    args = parser.parse_args()
+
+    factory = MockStorageConnectionFactory()
+    factory.storage.create_user('bench-user')
+    application.StorageConnectionFactory = lambda: factory
+
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as output:
+        for mode in ('sync', 'queue', 'off'):
+            run(mode, args.requests, args.github_issues, output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Время выполнения запросов StorageConnection с подготовкой на сервере и без неё.
+
+Работает в отдельной схеме, которую удаляет в конце. Подключение берётся из переменных окружения навыка.
+
+    python bench/prepared_statements.py --repeats 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from history import now  # noqa: E402
+from migrations import available_migrations  # noqa: E402
+from storage import StorageConnection, connection_params  # noqa: E402
+
+SCHEMA = 'bench_prepared_statements'
+USER_ID = 'bench-user'
+READS = ['check_standup', 'get_user', 'load_user_state', 'get_team', 'get_team_themes', 'get_github_info',
+         'get_tracker_info']
+
+
+# StorageConnection.__exit__ возвращает соединение в пул навыка, поэтому здесь транзакции завершаются явно
+def setup(conn, team_size: int):
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}')
+        for _, _, path in available_migrations():
+            with open(path, encoding='utf-8') as file:
+                cur.execute(file.read())
+        cur.execute("""INSERT INTO users(user_id, standup_held, cur_speaker, silence_enabled)
+                       VALUES (%s, FALSE, 0, TRUE)""", (USER_ID,))
+        cur.execute("""INSERT INTO persons(first_name, last_name, standup_organizer)
+                       SELECT 'name-' || i, 'surname-' || i, %s FROM generate_series(1, %s) i""",
+                    (USER_ID, team_size))
+    conn.commit()
+
+
+def run(conn, prepare: bool, repeats: int):
+    conn.prepare_statements = prepare
+    results = {}
+    for name in READS:
+        getattr(conn, name)(USER_ID)  # прогрев и PREPARE
+        start = time.perf_counter()
+        for _ in range(repeats):
+            getattr(conn, name)(USER_ID)
+        results[name] = (time.perf_counter() - start) / repeats * 1_000_000
+    conn.start_standup(USER_ID, now())
+    start = time.perf_counter()
+    for _ in range(repeats):
+        try:
+            conn.call_next_speaker(USER_ID, now())
+        except IndexError:
+            conn.start_standup(USER_ID, now())
+    results['call_next_speaker'] = (time.perf_counter() - start) / repeats * 1_000_000
+    conn.reset_user(USER_ID)
+    conn.commit()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=2000)
+    parser.add_argument('--team-size', type=int, default=10)
+    args = parser.parse_args()
+    load_dotenv()
+
+    conn = psycopg2.connect(connection_factory=StorageConnection, **connection_params())
+    try:
+        setup(conn, args.team_size)
+        with conn.cursor() as cur:
+            cur.execute(f'SET search_path TO {SCHEMA}')
+        conn.commit()
+        plain = run(conn, False, args.repeats)
+        prepared = run(conn, True, args.repeats)
+        print(f'{"statement":<20} {"plain, us":>10} {"prepared, us":>13}')
+        for name in plain:
+            print(f'{name:<20} {plain[name]:>10.1f} {prepared[name]:>13.1f}')
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
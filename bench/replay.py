@@ -0,0 +1,168 @@
+"""Воспроизведение записанных запросов (src/capture.py, CAPTURE_DIR) на запущенном навыке.
+
+Запросы отправляются в исходном темпе (--speed 1), ускоренно (--speed 10) или без пауз (--speed 0)
+в --concurrency потоков. Запросы одного пользователя всегда идут через один поток и по порядку, потому что
+ответ зависит от состояния, оставленного предыдущими. К идентификаторам пользователей добавляется
+суффикс прогона, так что каждый прогон начинается с чистых пользователей.
+
+С --compare-url каждый запрос отправляется и на вторую версию навыка. Печатаются распределения задержек
+обеих версий и различия в ответах. У версий должны быть отдельные базы, иначе вторая увидит изменения первой.
+
+    python bench/replay.py /var/capture --url https://localhost:5000/ --compare-url https://localhost:5001/ --speed 10
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import queue
+import statistics
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+import urllib3
+
+
+def capture_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, 'capture-*.jsonl*')))
+        else:
+            files.append(path)
+    return files
+
+
+def read_records(files: List[str]) -> Iterator[Dict[str, Any]]:
+    for path in files:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def comparable(response: Optional[Dict[str, Any]]) -> Any:
+    # Сравниваются только ответ навыка и запрос авторизации, session и version повторяют запрос
+    if response is None:
+        return None
+    return response.get('response'), 'start_account_linking' in response
+
+
+class Target:
+    def __init__(self, url: str):
+        self.url = url
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def send(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            # verify=False в самом запросе: session.verify перекрывается переменной REQUESTS_CA_BUNDLE
+            response = self.local.session.post(self.url, json=payload, timeout=10, verify=False)
+            response.raise_for_status()
+            result = response.json()
+        except (requests.RequestException, ValueError):
+            result = None
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(elapsed)
+            self.errors += result is None
+        return result
+
+
+def worker(jobs: queue.Queue, targets: List[Target], diffs: List[Tuple[Dict[str, Any], Any, Any]],
+           diffs_lock: threading.Lock):
+    while True:
+        payload = jobs.get()
+        if payload is None:
+            return
+        responses = [target.send(payload) for target in targets]
+        if len(responses) == 2 and comparable(responses[0]) != comparable(responses[1]):
+            with diffs_lock:
+                diffs.append((payload, comparable(responses[0]), comparable(responses[1])))
+
+
+def rename_user(payload: Dict[str, Any], run: str) -> Dict[str, Any]:
+    user = payload.get('session', {}).get('user')
+    if user and user.get('user_id'):
+        user['user_id'] = f"{user['user_id']}-{run}"
+    return payload
+
+
+def describe(values: List[float]) -> str:
+    if not values:
+        return 'no data'
+    if len(values) == 1:
+        return f'p50 {values[0] * 1000:.1f} ms'
+    quantiles = statistics.quantiles(values, n=100)
+    return (f'p50 {quantiles[49] * 1000:.1f} ms, p95 {quantiles[94] * 1000:.1f} ms, '
+            f'p99 {quantiles[98] * 1000:.1f} ms, max {max(values) * 1000:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='каталог CAPTURE_DIR или файлы записи')
+    parser.add_argument('--url', required=True)
+    parser.add_argument('--compare-url')
+    parser.add_argument('--speed', type=float, default=1.0, help='ускорение относительно записи, 0 - без пауз')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--limit', type=int, help='воспроизвести только первые N запросов')
+    parser.add_argument('--show-diffs', type=int, default=5, help='сколько различий в ответах напечатать')
+    args = parser.parse_args()
+    urllib3.disable_warnings()
+
+    records = sorted(read_records(capture_files(args.paths)), key=lambda entry: entry['time'])[:args.limit]
+    if not records:
+        parser.error('no captured requests found')
+    targets = [Target(args.url)] + ([Target(args.compare_url)] if args.compare_url else [])
+    run = uuid.uuid4().hex[:8]
+    diffs: List[Tuple[Dict[str, Any], Any, Any]] = []
+    diffs_lock = threading.Lock()
+    queues = [queue.Queue() for _ in range(args.concurrency)]
+    threads = [threading.Thread(target=worker, args=(jobs, targets, diffs, diffs_lock), daemon=True)
+               for jobs in queues]
+    for thread in threads:
+        thread.start()
+
+    first = records[0]['time']
+    start = time.monotonic()
+    max_lag = 0.0
+    for entry in records:
+        if args.speed > 0:
+            due = start + (entry['time'] - first) / args.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+        payload = rename_user(entry['payload'], run)
+        user_id = payload.get('session', {}).get('user', {}).get('user_id', '')
+        queues[zlib.crc32(user_id.encode('utf-8')) % len(queues)].put(payload)
+    for jobs in queues:
+        jobs.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    print(f'replayed {len(records)} requests in {elapsed:.1f} s ({len(records) / elapsed:.1f} req/s), '
+          f'max schedule lag {max_lag * 1000:.0f} ms')
+    print(f'{"captured":>10}: {describe([entry["duration"] for entry in records])}')
+    for name, target in zip(('A', 'B'), targets):
+        print(f'{name:>10}: {describe(target.latencies)}, errors {target.errors} ({target.url})')
+    if args.compare_url:
+        print(f'different responses: {len(diffs)}')
+        for payload, first_response, second_response in diffs[:args.show_diffs]:
+            print(f"  {payload['request'].get('command')!r}:\n    A: {first_response}\n    B: {second_response}")
+
+
+if __name__ == '__main__':
+    main()
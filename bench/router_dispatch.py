@@ -0,0 +1,85 @@
+"""Время выбора обработчика команды: Router против линейного перебора тех же правил.
+
+    python bench/router_dispatch.py --repeats 20000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dialog import DialogHandler  # noqa: E402
+
+# Реальные фразы пользователей навыка и интенты, которые для них распознаёт Алиса
+CORPUS = [
+    ('у меня всё', {'end.report': {}}),
+    ('я закончил', {'end.report': {}}),
+    ('продолжить', {}),
+    ('его сегодня нет', {'skip.person': {}}),
+    ('запомни тему обновление зависимостей', {}),
+    ('закончи стендап', {}),
+    ('покажи тикеты гитхаб', {}),
+    ('покажи тикеты трекер', {}),
+    ('закрой тикет 12 гитхаб', {}),
+    ('начни стендап', {}),
+    ('напомни команду', {}),
+    ('добавь в команду ивана петрова', {'team.newmember': {}}),
+    ('удали из команды ивана петрова', {'team.delmember': {}}),
+    ('запомни гитхаб login repo 123', {}),
+    ('помощь', {}),
+    ('включи тишину', {}),
+    ('расскажи анекдот', {}),
+]
+
+
+def linear(routers):
+    rules = []
+    for router in routers:
+        for kind, key, handler in router.routes:
+            rules.append((kind, re.compile(key) if kind == 'regex' else key, handler))
+
+    def match(command, intents):
+        for kind, key, handler in rules:
+            if kind == 'exact' and command == key or kind == 'prefix' and command.startswith(key):
+                return handler
+            if kind == 'regex' and key.match(command) or kind == 'intent' and key in intents:
+                return handler
+        return None
+    return match
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=20000)
+    parser.add_argument('--extra-commands', type=int, default=0,
+                        help='добавить столько синтетических команд, чтобы посмотреть на рост числа правил')
+    args = parser.parse_args()
+
+    for idx in range(args.extra_commands):
+        DialogHandler.idle_routes.exact(f'синтетическая команда {idx}')(None)
+        DialogHandler.idle_routes.prefix(f'синтетический префикс {idx} ')(None)
+
+    routers = [DialogHandler.common_routes, DialogHandler.standup_routes, DialogHandler.idle_routes]
+    linear_match = linear(routers)
+
+    def routed(command, intents):
+        # Как в handle_dialog: общие команды, затем команды режима
+        if route := DialogHandler.common_routes.match(command, intents):
+            return route
+        if route := DialogHandler.standup_routes.match(command, intents):
+            return route
+        return DialogHandler.idle_routes.match(command, intents)
+
+    for name, match in [('linear', linear_match), ('router', routed)]:
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for command, intents in CORPUS:
+                match(command, intents)
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {elapsed / (args.repeats * len(CORPUS)) * 1e9:.0f} ns/dispatch')
+
+
+if __name__ == '__main__':
+    main()
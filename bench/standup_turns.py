@@ -0,0 +1,137 @@
+"""Задержка одного хода стендапа ("у меня всё") с состоянием стендапа в памяти процесса и без него.
+
+Каждый пользователь проводит стендап с командой из --members человек, время и число запросов к базе
+замеряются для каждого "у меня всё" без сетевого слоя, через DialogHandler и пул соединений навыка.
+Режимы:
+  database    - STANDUP_STATE_CACHE_SIZE=0, снимок пользователя и команды читается из базы на каждом ходе;
+  memory      - ходы обслуживаются из памяти, запись в базу с проверкой standup_version;
+  two-workers - два кэша по очереди, как два воркера gunicorn без привязки пользователя к воркеру:
+                каждый ход видит чужое изменение, откатывается и повторяется по базе.
+
+В каждом ходе учтена и запись ответа для повторов запросов (src/idempotency.py), без неё -
+с WEBHOOK_DEDUP_STORE=memory. Работает в отдельной схеме (через PGOPTIONS), которую удаляет в конце.
+
+    python bench/standup_turns.py --users 200 --members 8
+"""
+import argparse
+import itertools
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+SCHEMA = 'bench_standup_turns'
+os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA}'
+
+import unit_of_work  # noqa: E402
+from dialog import DialogHandler  # noqa: E402
+from loadtest import payload  # noqa: E402
+from metrics import storage_seconds  # noqa: E402
+from migrations import available_migrations  # noqa: E402
+from request import Request  # noqa: E402
+from standup_state import StandupStateCache  # noqa: E402
+from storage import StorageConnectionFactory, close_pool, connection_params  # noqa: E402
+
+
+workers = iter(())
+worker = [None]
+unit_of_work.standup_state = lambda: worker[0]
+
+
+class BenchConnectionFactory(StorageConnectionFactory):
+    @staticmethod
+    def record_history(events):
+        pass  # история пишется в фоне и в задержку хода не входит
+
+
+def setup(conn):
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}')
+        for _, _, path in available_migrations():
+            with open(path, encoding='utf-8') as file:
+                cur.execute(file.read())
+    conn.commit()
+
+
+def create_users(conn, count: int, members: int):
+    users = [f'bench-{uuid.uuid4().hex}' for _ in range(count)]
+    with conn.cursor() as cur:
+        cur.execute("""INSERT INTO users(user_id, standup_held, cur_speaker, silence_enabled)
+                       SELECT unnest(%s::text[]), FALSE, 0, FALSE""", (users,))
+        cur.execute("""INSERT INTO persons(first_name, last_name, standup_organizer)
+                       SELECT 'имя' || i, 'фамилия' || i, u FROM unnest(%s::text[]) u, generate_series(1, %s) i""",
+                    (users, members))
+    conn.commit()
+    return users
+
+
+def statements() -> int:
+    with storage_seconds.lock:
+        return sum(sum(counts) for counts, _ in storage_seconds.values.values())
+
+
+def send(user_id: str, message_id: int, command: str, intents):
+    # Каждый запрос, включая повтор после StaleStandupState, обслуживает один "воркер"
+    worker[0] = next(workers)
+    handler = DialogHandler(BenchConnectionFactory())
+    handler.handle_dialog(Request(payload(user_id, user_id, message_id, command, intents)))
+    return handler.response
+
+
+def run(users, members: int, caches):
+    global workers
+    workers = itertools.cycle(caches)
+    latencies, queries = [], []
+    for user_id in users:
+        send(user_id, 1, 'начни стендап', {})
+        for turn in range(members):
+            before = statements()
+            start = time.perf_counter()
+            response = send(user_id, turn + 2, 'у меня всё', {'end.report': {}})
+            latencies.append(time.perf_counter() - start)
+            queries.append(statements() - before)
+            assert 'расскажи' in response['text'] or turn == members - 1, response['text']
+    return latencies, queries
+
+
+def describe(values):
+    quantiles = statistics.quantiles(values, n=100)
+    return f'p50 {quantiles[49] * 1000:6.2f} ms, p95 {quantiles[94] * 1000:6.2f} ms, mean {statistics.mean(values) * 1000:6.2f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--members', type=int, default=8)
+    args = parser.parse_args()
+    load_dotenv()
+
+    conn = psycopg2.connect(**connection_params())
+    try:
+        setup(conn)
+        modes = {'database': [StandupStateCache(0)],
+                 'memory': [StandupStateCache(10000)],
+                 'two-workers': [StandupStateCache(10000), StandupStateCache(10000)]}
+        run(create_users(conn, 10, args.members), args.members, modes['database'])  # прогрев и PREPARE
+        for name, caches in modes.items():
+            latencies, queries = run(create_users(conn, args.users, args.members), args.members, caches)
+            print(f'{name:<12} {describe(latencies)}, statements per turn {statistics.mean(queries):.2f}')
+    finally:
+        close_pool()
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        conn.commit()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
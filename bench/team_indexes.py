@@ -0,0 +1,99 @@
+"""Планы и время запросов к команде на миллионе участников до и после миграций с индексами.
+
+Работает в отдельной схеме, которую удаляет в конце, поэтому данные навыка не затрагиваются.
+Подключение берётся из тех же переменных окружения, что и у навыка (PG_HOST, PG_USER, PG_DB, PG_PWD).
+
+    python bench/team_indexes.py --persons 1000000 --team-size 10
+"""
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from migrations import available_migrations  # noqa: E402
+from storage import connection_params  # noqa: E402
+
+SCHEMA = 'bench_team_indexes'
+INDEX_MIGRATION = 3
+
+QUERIES = {
+    'get_team': ("""SELECT first_name, last_name FROM persons WHERE standup_organizer=%s""", 1),
+    'start_standup queue': ("""SELECT ARRAY(SELECT person_id FROM persons WHERE standup_organizer = %s
+                                            ORDER BY person_id ASC)""", 1),
+    'load_user_state': ("""SELECT u.user_id, json_agg(p.person_id ORDER BY p.person_id)
+                           FROM users u LEFT JOIN persons p ON p.standup_organizer = u.user_id
+                           WHERE u.user_id = %s GROUP BY u.user_id""", 1),
+    'del_team_member': ("""SELECT person_id FROM persons
+                           WHERE first_name=%s AND last_name=%s AND standup_organizer=%s""", 3),
+}
+
+
+def apply(cur, upto=None, only=None):
+    for version, _, path in available_migrations():
+        if (upto is not None and version > upto) or (only is not None and version != only):
+            continue
+        with open(path, encoding='utf-8') as file:
+            cur.execute(file.read())
+
+
+def params(arity: int, organizer: str):
+    return (organizer,) if arity == 1 else ('name-3', 'surname-3', organizer)
+
+
+def measure(cur, organizers, repeats: int):
+    for name, (query, arity) in QUERIES.items():
+        cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query, params(arity, organizers[0]))
+        print(f'--- {name}')
+        print('\n'.join(row[0] for row in cur.fetchall()))
+        start = time.perf_counter()
+        for i in range(repeats):
+            cur.execute(query, params(arity, organizers[i % len(organizers)]))
+            cur.fetchall()
+        print(f'{name}: {(time.perf_counter() - start) / repeats * 1000:.3f} ms/query')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--persons', type=int, default=1_000_000)
+    parser.add_argument('--team-size', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=200)
+    args = parser.parse_args()
+    load_dotenv()
+
+    conn = psycopg2.connect(**connection_params())
+    conn.autocommit = True
+    users = args.persons // args.team_size
+    organizers = [f'user-{i}' for i in range(1, users + 1, max(users // args.repeats, 1))]
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+            cur.execute(f'CREATE SCHEMA {SCHEMA}')
+            cur.execute(f'SET search_path TO {SCHEMA}')
+            apply(cur, upto=INDEX_MIGRATION - 1)
+            cur.execute("""INSERT INTO users(user_id, standup_held, cur_speaker, silence_enabled)
+                           SELECT 'user-' || i, FALSE, 0, TRUE FROM generate_series(1, %s) i""", (users,))
+            cur.execute("""INSERT INTO persons(first_name, last_name, standup_organizer)
+                           SELECT 'name-' || (i %% %s), 'surname-' || (i %% %s), 'user-' || (i %% %s + 1)
+                           FROM generate_series(1, %s) i""",
+                        (args.team_size, args.team_size, users, args.persons))
+            cur.execute('ANALYZE')
+
+            print(f'=== without indexes ({args.persons} persons, {users} teams)')
+            measure(cur, organizers, args.repeats)
+            apply(cur, only=INDEX_MIGRATION)
+            cur.execute('ANALYZE')
+            print('=== with indexes')
+            measure(cur, organizers, args.repeats)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
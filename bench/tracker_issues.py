@@ -0,0 +1,122 @@
+"""Список тикетов трекера на очереди из 10 тысяч тикетов: полная выгрузка очереди и ограниченный запрос.
+
+Вместо api.tracker.yandex.net поднимается локальная заглушка, которая отвечает как эндпоинт
+/v2/issues/_search: страницы по perPage (по умолчанию 50) со ссылкой на следующую в заголовке Link,
+поле fields сокращает тикет до перечисленных полей, Resolution: empty() в запросе оставляет открытые.
+
+    python bench/tracker_issues.py --issues 10000 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from tracker import PooledTrackerClient, YandexTracker  # noqa: E402
+
+QUEUE = 'BENCH'
+DEFAULT_PAGE_SIZE = 50
+
+
+def make_issue(number):
+    key = f'{QUEUE}-{number}'
+    return {
+        'self': f'http://localhost/v2/issues/{key}',
+        'id': f'{number:024x}',
+        'key': key,
+        'version': 3,
+        'summary': f'Тикет номер {number}',
+        'description': 'Подробное описание тикета. ' * 20,
+        'status': {'self': 'http://localhost/v2/statuses/1', 'id': '1', 'key': 'open', 'display': 'Открыт'},
+        'resolution': None if number % 2 else {'self': 'http://localhost/v2/resolutions/1', 'id': '1',
+                                               'key': 'fixed', 'display': 'Решён'},
+        'createdBy': {'self': 'http://localhost/v2/users/1', 'id': 'author', 'display': 'Автор'},
+        'updatedAt': f'2021-03-{number % 28 + 1:02d}T12:00:00.000+0000',
+        'followers': [{'self': 'http://localhost/v2/users/2', 'id': 'follower', 'display': 'Наблюдатель'}],
+    }
+
+
+class Stub(BaseHTTPRequestHandler):
+    issues = []
+    requests = 0
+    sent = 0
+
+    def do_GET(self):
+        # Клиент один раз запрашивает описание полей (/v2/fields) при первом обращении к атрибуту тикета
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'[]')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+        issues = self.issues
+        if 'Resolution: empty()' in (body.get('query') or ''):
+            issues = [issue for issue in issues if issue['resolution'] is None]
+        per_page = int(params.get('perPage', DEFAULT_PAGE_SIZE))
+        page = int(params.get('page', 1))
+        chunk = issues[(page - 1) * per_page:page * per_page]
+        if 'fields' in params:
+            fields = params['fields'].split(',') + ['self']
+            chunk = [{name: issue[name] for name in fields} for issue in chunk]
+        data = json.dumps(chunk).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if page * per_page < len(issues):
+            params['page'] = page + 1
+            query = '&'.join(f'{name}={value}' for name, value in params.items())
+            self.send_header('Link', f'<{url.path}?{query}>; rel="next"')
+        self.end_headers()
+        self.wfile.write(data)
+        Stub.requests += 1
+        Stub.sent += len(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def full_queue(tracker):
+    # Прежняя реализация list_issues: вся очередь целиком, все поля
+    return [f'{issue.key}: {issue.summary}' for issue in tracker.client.issues.find(filter={'queue': tracker.queue})]
+
+
+def run(name, fn, tracker, repeat):
+    Stub.requests = Stub.sent = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        lines = fn(tracker)
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f'{name:>10}: {elapsed * 1000:9.1f} ms, {Stub.requests // repeat:4d} requests, '
+          f'{Stub.sent // repeat / 1024:9.1f} KiB, {len(lines)} lines')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--issues', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    Stub.issues = [make_issue(number) for number in range(1, args.issues + 1)]
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    tracker = YandexTracker('token', 'org', QUEUE)
+    tracker.client = PooledTrackerClient(token='token', org_id='org', base_url=f'http://127.0.0.1:{server.server_port}')
+    try:
+        run('full', full_queue, tracker, args.repeat)
+        run('bounded', YandexTracker.list_issues, tracker, args.repeat)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
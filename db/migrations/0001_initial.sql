@@ -1,4 +1,4 @@
-CREATE TABLE USERS( -- пользователи навыка
+CREATE TABLE IF NOT EXISTS USERS( -- пользователи навыка
 	user_id TEXT PRIMARY KEY, -- user_id из навыка
 	standup_held BOOLEAN NOT NULL,
 	cur_speaker INTEGER NOT NULL,
@@ -10,7 +10,7 @@ CREATE TABLE USERS( -- пользователи навыка
 	silence_enabled BOOLEAN NOT NULL
 );
 
-CREATE TABLE PERSONS( -- участники команд
+CREATE TABLE IF NOT EXISTS PERSONS( -- участники команд
 	person_id SERIAL PRIMARY KEY,
 	first_name TEXT NOT NULL,
 	last_name TEXT,
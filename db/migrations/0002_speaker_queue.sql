@@ -0,0 +1,2 @@
+-- person_id участников в порядке выступления на текущем стендапе
+ALTER TABLE USERS ADD COLUMN IF NOT EXISTS speaker_queue INTEGER[];
@@ -0,0 +1,3 @@
+-- Все запросы к команде фильтруют по standup_organizer, а очередь стендапа строится в порядке person_id.
+-- Удаление по имени тоже сначала сужается до команды организатора, так что отдельный индекс по именам не нужен.
+CREATE INDEX IF NOT EXISTS persons_organizer_person_idx ON PERSONS(standup_organizer, person_id);
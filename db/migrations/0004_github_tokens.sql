@@ -0,0 +1,6 @@
+-- Токены установок гитхаба, общие для всех процессов навыка
+CREATE TABLE IF NOT EXISTS GITHUB_TOKENS(
+	installation_id TEXT PRIMARY KEY,
+	token TEXT NOT NULL,
+	expires_at TIMESTAMPTZ NOT NULL
+);
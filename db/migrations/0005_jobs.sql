@@ -0,0 +1,19 @@
+-- Фоновые задачи (src/jobs.py): действия в гитхабе и трекере, которые не ждут в webhook.
+-- Задача в состоянии running с истёкшим run_at считается брошенной и забирается снова
+CREATE TABLE IF NOT EXISTS JOBS(
+	job_id BIGSERIAL PRIMARY KEY,
+	user_id TEXT NOT NULL REFERENCES USERS(user_id),
+	kind TEXT NOT NULL,
+	args JSONB NOT NULL, -- зашифрованный токен трекера хранится здесь только до завершения задачи
+	state TEXT NOT NULL DEFAULT 'pending', -- pending, running, done, failed
+	attempts INTEGER NOT NULL DEFAULT 0,
+	run_at TIMESTAMPTZ NOT NULL DEFAULT now(), -- когда запускать, для running - когда истекает аренда
+	created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+	finished_at TIMESTAMPTZ,
+	result TEXT, -- сообщение пользователю
+	reported BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE INDEX IF NOT EXISTS jobs_due_idx ON JOBS(run_at) WHERE state IN ('pending', 'running');
+-- Результаты, которые ещё не показаны пользователю, читаются при каждом запросе
+CREATE INDEX IF NOT EXISTS jobs_unreported_idx ON JOBS(user_id) WHERE state IN ('done', 'failed') AND NOT reported;
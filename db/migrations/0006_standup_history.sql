@@ -0,0 +1,34 @@
+-- Когда начались текущий стендап и выступление текущего человека: из них считается длительность
+ALTER TABLE USERS ADD COLUMN IF NOT EXISTS standup_started_at TIMESTAMPTZ;
+ALTER TABLE USERS ADD COLUMN IF NOT EXISTS speaker_started_at TIMESTAMPTZ;
+
+-- История стендапов (src/history.py), только добавление. Секции по месяцам создаются при записи
+CREATE TABLE IF NOT EXISTS STANDUP_EVENTS(
+	user_id TEXT NOT NULL,
+	kind TEXT NOT NULL, -- start, speak, skip, theme, end
+	person_id INTEGER, -- у start и end пустой
+	happened_at TIMESTAMPTZ NOT NULL,
+	duration DOUBLE PRECISION, -- секунды: выступление для speak и skip, весь стендап для end
+	theme TEXT
+) PARTITION BY RANGE (happened_at);
+
+CREATE INDEX IF NOT EXISTS standup_events_user_idx ON STANDUP_EVENTS(user_id, happened_at);
+
+-- Агрегаты для отчётов, обновляются в той же транзакции, что и запись событий
+CREATE TABLE IF NOT EXISTS PERSON_STATS(
+	user_id TEXT NOT NULL,
+	person_id INTEGER NOT NULL,
+	turns INTEGER NOT NULL DEFAULT 0, -- выступления вместе с пропусками
+	skips INTEGER NOT NULL DEFAULT 0,
+	speaking_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+	themes INTEGER NOT NULL DEFAULT 0,
+	last_turn_at TIMESTAMPTZ,
+	PRIMARY KEY (user_id, person_id)
+);
+
+CREATE TABLE IF NOT EXISTS STANDUP_STATS(
+	user_id TEXT PRIMARY KEY,
+	standups INTEGER NOT NULL DEFAULT 0,
+	standup_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+	last_standup_at TIMESTAMPTZ
+);
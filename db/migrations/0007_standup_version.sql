@@ -0,0 +1,3 @@
+-- Номер изменения стендапа. Его увеличивает каждое изменение стендапа, по нему процесс проверяет,
+-- что состояние стендапа в его памяти (src/standup_state.py) совпадает с базой
+ALTER TABLE USERS ADD COLUMN IF NOT EXISTS standup_version BIGINT NOT NULL DEFAULT 0;
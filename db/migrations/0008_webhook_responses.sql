@@ -0,0 +1,13 @@
+-- Ответы на уже обработанные запросы Алисы, общие для всех процессов (src/idempotency.py).
+-- Строка вставляется в транзакции запроса до его обработки, поэтому повтор, пришедший в другой
+-- процесс, ждёт коммита первого запроса и получает его ответ. UNLOGGED: после сбоя базы таблица
+-- очищается, и повторы просто обрабатываются заново, как без неё
+CREATE UNLOGGED TABLE IF NOT EXISTS WEBHOOK_RESPONSES(
+	session_id TEXT NOT NULL,
+	message_id INTEGER NOT NULL,
+	response JSONB,
+	created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+	PRIMARY KEY (session_id, message_id)
+);
+
+CREATE INDEX IF NOT EXISTS webhook_responses_created_idx ON WEBHOOK_RESPONSES(created_at);
@@ -0,0 +1,3 @@
+-- Токены установок гитхаба теперь хранятся зашифрованными ключом TOKEN_SEAL_KEY (src/storage.py, TokenStore).
+-- Записанные раньше открытым текстом удаляются: токен живёт час, и при следующем запросе его выпустят заново
+DELETE FROM GITHUB_TOKENS;
@@ -1,35 +1,110 @@
 import logging
 import os
 import ssl
+import time
+from typing import Dict, Any, Optional
 
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, abort, request, jsonify
 
+import capture
+from deadline import Deadline, webhook_deadline
 from dialog import DialogHandler, AuthorizationRequest
+from idempotency import ResponsePending, response_cache
+from jobs import start_runner
+from log import setup_logging, truncate
+import metrics
+from migrations import migrate_on_start
 from request import Request
-from storage import StorageConnectionFactory
+from storage import StorageConnectionFactory, PoolTimeout
 
 application = Flask(__name__)
-logging.basicConfig(level=logging.DEBUG)
+setup_logging()
+logger = logging.getLogger('webhook')
 
 
-@application.route('/', methods=['POST'])
-def webhook():
-    logging.info('Request: %r', request.json)
-    handler = DialogHandler(StorageConnectionFactory())
-    response = {'version': request.json['version'],
-                'session': request.json['session']}
+def request_summary(payload: Dict[str, Any]) -> Dict[str, Any]:
+    session = payload.get('session', {})
+    request = payload.get('request', {})
+    return {'session_id': session.get('session_id'),
+            'message_id': session.get('message_id'),
+            'user_id': session.get('user', {}).get('user_id'),
+            'command': truncate(request.get('command', '')),
+            'intents': list(request.get('nlu', {}).get('intents', {}))}
+
+
+def response_summary(response: Dict[str, Any]) -> Dict[str, Any]:
+    if 'start_account_linking' in response:
+        return {'account_linking': True}
+    return {'text': truncate(response['response'].get('text', '')),
+            'end_session': response['response'].get('end_session')}
+
+
+def handle_webhook(payload: Dict[str, Any], deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    # Общая часть для всех серверов: принимает запрос Алисы и возвращает ответ навыка
+    started = time.time()
     try:
-        handler.handle_dialog(Request(request.json))
+        with metrics.webhook_seconds.time():
+            return dialog_response(payload, deadline)
+    finally:
+        capture.record(payload, started, time.time() - started)
+
+
+def dialog_response(payload: Dict[str, Any], deadline: Optional[Deadline]) -> Dict[str, Any]:
+    logger.info('request', extra=request_summary(payload))
+    req = Request(payload)
+    response = {'version': payload['version'],
+                'session': payload['session']}
+    key = req.message_key()
+    # Повтор запроса, на который этот процесс уже ответил, не трогает ни базу, ни гитхаб с трекером
+    if (cached := response_cache().get(key)) is not None:
+        metrics.webhook_dedup.inc('hit')
+        response['response'] = cached
+        logger.info('response', extra=response_summary(response))
+        return response
+    handler = DialogHandler(StorageConnectionFactory(), deadline or webhook_deadline())
+    try:
+        handler.handle_dialog(req)
         response['response'] = handler.response
+        if key is not None:
+            metrics.webhook_dedup.inc('shared_hit' if handler.replayed else 'miss')
+            response_cache().put(key, handler.response)
     except AuthorizationRequest:
         response['start_account_linking'] = {}
-    logging.info('Response: %r', response)
-    return jsonify(response)
+    except PoolTimeout as err:
+        logging.warning('Database pool is busy: %s', err)
+        response['response'] = {'end_session': False,
+                                'text': 'Извините, я сейчас перегружена. Повторите, пожалуйста, ещё раз'}
+    except ResponsePending as err:
+        # Первый такой же запрос ещё выполняется в другом процессе. Ответ не кэшируется,
+        # следующий повтор получит ответ первого запроса
+        logging.warning('Replayed request is still running: %s', err)
+        metrics.webhook_dedup.inc('pending')
+        response['response'] = {'end_session': False, 'text': 'Ещё выполняю эту команду, подождите пару секунд'}
+    logger.info('response', extra=response_summary(response))
+    return response
+
+
+@application.route('/', methods=['POST'])
+def webhook():
+    return jsonify(handle_webhook(request.json))
+
+
+@application.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not metrics.authorized(request.headers.get('Authorization')):
+        abort(404)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def ssl_context() -> ssl.SSLContext:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(os.getenv('SSL_CERT'), os.getenv('SSL_KEY'))
+    return context
 
 
 if __name__ == '__main__':
     load_dotenv()
-    context = ssl.SSLContext()
-    context.load_cert_chain(os.getenv('SSL_CERT'), os.getenv('SSL_KEY'))
-    application.run(host='0.0.0.0', ssl_context=context)
+    migrate_on_start()
+    start_runner()
+    application.run(host='0.0.0.0', ssl_context=ssl_context())
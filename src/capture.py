@@ -0,0 +1,163 @@
+import atexit
+import functools
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import shutil
+import threading
+from typing import Any, Dict, FrozenSet, Optional
+
+# Запись реальных запросов для bench/replay.py. Включается переменной CAPTURE_DIR.
+# Запросы пишутся по строке JSON в capture-PID.jsonl (у каждого процесса свой файл),
+# заполненный файл сжимается в capture-PID.jsonl.N.gz
+
+
+# Слова фраз, которые навык распознаёт по интентам Алисы, а не по тексту команды
+# (папка intents), и слова, которые Алиса добавляет к ним
+INTENT_WORDS = {'у', 'меня', 'всё', 'все', 'я', 'закончил', 'закончила', 'следующий', 'больше', 'ничего', 'не',
+                'сделал', 'сделала', 'нет', 'на', 'сегодня', 'сейчас', 'в', 'к', 'этот', 'этому', 'раз', 'моменту',
+                'он', 'она', 'его', 'её', 'ее', 'отсутствует', 'отпуске', 'болеет', 'пропусти', 'пропускаем',
+                'добавь', 'удали', 'из', 'команды', 'команду', 'человека', 'и', 'с', 'тикет', 'тикеты', 'ишью',
+                'запиши', 'яндекс', 'github', 'tracker', 'yandex'}
+
+
+def digest(value: str) -> str:
+    # HMAC с солью CAPTURE_SALT: без соли псевдоним известного идентификатора можно было бы просто посчитать
+    return hmac.new(os.environ['CAPTURE_SALT'].encode('utf-8'), value.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def pseudonym(value: Optional[str]) -> Optional[str]:
+    # Один и тот же пользователь в записи получает один и тот же псевдоним, поэтому сессии воспроизводятся
+    if value is None:
+        return None
+    return 'cap-' + digest(value)[:24]
+
+
+@functools.lru_cache
+def command_words() -> FrozenSet[str]:
+    # Слова из команд навыка. Всё остальное в тексте запроса - имена, логины, репозитории и темы
+    from dialog import DialogHandler
+    words = set(INTENT_WORDS)
+    for router in (DialogHandler.common_routes, DialogHandler.standup_routes, DialogHandler.idle_routes):
+        for kind, text, _ in router.routes:
+            if kind != 'intent':
+                words.update(re.findall(r'[^\W\d_]+', text.lower()))
+    return frozenset(words)
+
+
+def mask_text(text: str) -> str:
+    # Слова не из команд заменяются псевдонимами, одинаковые слова - одинаковыми, так что
+    # одно и то же имя в команде, токенах и слотах интента остаётся одним и тем же
+    def mask(match: re.Match) -> str:
+        word = match.group(0).lower()
+        return match.group(0) if word in command_words() else 'w' + digest(word)[:10]
+    return re.sub(r'[^\W\d_]+', mask, text)
+
+
+def mask_values(value: Any) -> Any:
+    if isinstance(value, str):
+        return mask_text(value)
+    if isinstance(value, dict):
+        return {key: mask_values(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [mask_values(item) for item in value]
+    return value
+
+
+def anonymize_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    request = dict(request)
+    for key in ('command', 'original_utterance'):
+        if key in request:
+            request[key] = mask_text(request[key])
+    if 'nlu' in request:
+        # Названия интентов и типы сущностей остаются как есть, маскируются только значения
+        nlu = dict(request['nlu'])
+        nlu['tokens'] = mask_values(nlu.get('tokens', []))
+        nlu['entities'] = [dict(entity, value=mask_values(entity.get('value'))) for entity in nlu.get('entities', [])]
+        nlu['intents'] = {name: dict(intent, slots={slot: dict(data, value=mask_values(data.get('value')))
+                                                    for slot, data in intent.get('slots', {}).items()})
+                          for name, intent in nlu.get('intents', {}).items()}
+        request['nlu'] = nlu
+    return request
+
+
+def anonymize(payload: Dict[str, Any]) -> Dict[str, Any]:
+    session = dict(payload.get('session', {}))
+    if 'user' in session:
+        # Токен трекера не записывается совсем, идентификаторы заменяются псевдонимами
+        session['user'] = {'user_id': pseudonym(session['user'].get('user_id'))}
+    session['session_id'] = pseudonym(session.get('session_id'))
+    session.pop('application', None)
+    result = {key: value for key, value in payload.items() if key not in ('session', 'meta')}
+    result['session'] = session
+    if 'request' in payload:
+        result['request'] = anonymize_request(payload['request'])
+    return result
+
+
+class CaptureFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(record.msg)
+        entry['payload'] = anonymize(entry['payload'])
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler форматирует запись ещё в потоке запроса. Здесь запрос уже обработан и больше
+    # не меняется, поэтому анонимизация и сериализация выполняются в потоке записи
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def gzip_rotator(source: str, dest: str):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+capture_lock = threading.Lock()
+
+
+def capture_logger() -> Optional[logging.Logger]:
+    with capture_lock:
+        return create_capture_logger()
+
+
+@functools.lru_cache
+def create_capture_logger() -> Optional[logging.Logger]:
+    directory = os.getenv('CAPTURE_DIR')
+    if not directory:
+        return None
+    if not os.getenv('CAPTURE_SALT'):
+        logging.warning('CAPTURE_DIR is set without CAPTURE_SALT, requests are not captured')
+        return None
+    os.makedirs(directory, exist_ok=True)
+    output = logging.handlers.RotatingFileHandler(os.path.join(directory, f'capture-{os.getpid()}.jsonl'), encoding='utf-8',
+                                                  maxBytes=int(os.getenv('CAPTURE_MAX_BYTES', str(64 * 1024 * 1024))),
+                                                  backupCount=int(os.getenv('CAPTURE_KEEP', '20')))
+    output.namer = lambda name: name + '.gz'
+    output.rotator = gzip_rotator
+    output.setFormatter(CaptureFormatter())
+    records = queue.SimpleQueue()
+    logger = logging.getLogger('capture')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(DeferredQueueHandler(records))
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return logger
+
+
+def record(payload: Dict[str, Any], started: float, duration: float):
+    logger = capture_logger()
+    if logger is None or random.random() >= float(os.getenv('CAPTURE_RATE', '1')):
+        return
+    logger.info({'time': started, 'duration': round(duration, 6), 'payload': payload})
@@ -0,0 +1,31 @@
+import concurrent.futures
+import functools
+import os
+import time
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    # Алиса ждёт ответ навыка около 3 секунд, поэтому у каждого запроса есть бюджет времени,
+    # который отсчитывается с момента получения webhook
+    def __init__(self, budget: float):
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+
+def webhook_deadline() -> Deadline:
+    return Deadline(float(os.getenv('WEBHOOK_BUDGET', '2.5')))
+
+
+@functools.lru_cache
+def executor() -> concurrent.futures.ThreadPoolExecutor:
+    return concurrent.futures.ThreadPoolExecutor(max_workers=int(os.getenv('UPSTREAM_WORKERS', '8')),
+                                                 thread_name_prefix='upstream')
@@ -2,31 +2,71 @@ import logging
 import os
 import random
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Callable, List, Optional, Tuple
 
 from requests import HTTPError
 
+from deadline import Deadline, DeadlineExceeded, webhook_deadline
 from github import GithubTracker
+from history import Event, now
+from idempotency import ReplayedRequest
+from issue_cache import github_key, issue_cache, tracker_key
+from issue_tracker import IssueTracker
+from jobs import retryable, seal_token, status_code
+from metrics import command_seconds
+from render import HELP_MESSAGE, HELP_NEXT, STANDUP_HELP, display_name, roster_name, roster_text, standup_report, \
+    tts_suffix
 from request import Request
-from tracker import YandexTracker, NoTokenException, NoInfoException
+from router import Router
+from standup_state import StaleStandupState
+from tracker import YandexTracker
+from user import User
+
+
+def split_names(text: str) -> List[Dict[str, str]]:
+    # "иван петров, мария и олег сидоров" - три человека. Первое слово - имя, последнее - фамилия.
+    # Повторы убираются, порядок сохраняется
+    persons = {}
+    for part in re.split(r',|\s+и\s+', text.lower()):
+        words = re.findall(r'[^\W\d_]+(?:-[^\W\d_]+)*', part)
+        if words:
+            person = {'first_name': words[0]}
+            if len(words) > 1:
+                person['last_name'] = words[-1]
+            persons.setdefault((words[0], person.get('last_name')), person)
+    return list(persons.values())
+
+
+SOURCE_NAMES = {'github': 'Гитхаб', 'tracker': 'Трекер'}
+SOURCE_SETTINGS = {'github': 'запомни гитхаб', 'tracker': 'запомни трекер'}
 
 
 class AuthorizationRequest(Exception):
     pass
 
 
+class TrackerAuthError(Exception):
+    pass
+
+
 class DialogHandler:
-    tts_end = 'если вы закончили , скажите " у меня всё " , иначе скажите " продолжить " '
-    begin_standup_re = re.compile('(начать|начни|проведи) (стендап|стенд ап|standup|stand up)')
-    end_standup_re = re.compile('за(кончи|верши)(ть)? (стендап|стенд ап|standup|stand up)')
     greetings = ['Привет', 'Добрый день', 'Здравствуйте']
-    close_issue_re = re.compile('закрой (issue|тикет) ([0-9]+) (гитхаб|трекер)')
+    # Команды, доступные всегда, только во время стендапа и только вне его.
+    # Во время стендапа "у меня всё" и "его нет" распознаются интентами, и они важнее текста команды
+    common_routes = Router()
+    standup_routes = Router(intents_first=True)
+    idle_routes = Router()
 
-    def __init__(self, connection_factory):
+    def __init__(self, connection_factory, deadline: Optional[Deadline] = None):
         self.connection_factory = connection_factory
+        self.deadline = deadline or webhook_deadline()
         self.connection = None
         self.response: Dict[str, Any] = {'end_session': False}
         self.silence_enabled = True
+        # События истории стендапов, отправляются в запись после коммита
+        self.events: List[Event] = []
+        # Ответ взят из webhook_responses: этот запрос - повтор уже обработанного (src/idempotency.py)
+        self.replayed = False
 
     def returning_greeting(self, user_id: str):
         greeting = random.choice(self.greetings)
@@ -36,62 +76,52 @@ class DialogHandler:
                                      'Чтобы выйти из этого состояния, скажите "закончить стендап"'
 
     def remind_team(self, user_id: str):
-        team = self.connection.get_team(user_id)
-        names = [f'{person["last_name"].capitalize()} {person["first_name"].capitalize()}' for person in team]
-        team_names = ', '.join(names)
-        self.response['text'] = 'Твоя команда: ' + team_names
+        self.response['text'] = roster_text(self.connection.get_team(user_id))
 
     def tts(self) -> str:
         if self.silence_enabled:
             # Звук тишины
-            return os.getenv('TTS_FILENAME') + ' ' + self.tts_end
+            return tts_suffix()
         else:
             return ''
 
     @staticmethod
     def help_message() -> str:
-        return 'Привет. Я могу помочь провести стендап.\n' \
-               'Команды доступные в обычном режиме:\n' \
-               '"Добавь в команду ИМЯ ФАМИЛИЯ" - так навык может запомнить участников команды.\n' \
-               '"Удали из команды ИМЯ ФАМИЛИЯ" - фраза, действие которой противоположно предыдущей.\n' \
-               '"Включи/выключи тишину" - выключает или включает проигрывание тишины во время стендапа.\n' \
-               '"Напомни команду" - посмотреть текущий состав команды.\n' \
-               '"Начни стендап" - Переходит в режим стендапа. Навык начнет по очереди предлагать участникам команды ' \
-               'рассказать о своём рабочем дне.\n' \
-               '"Помощь продолжение" - для остальных ключевых фраз.\n'
+        return HELP_MESSAGE
 
     @staticmethod
     def help_next() -> str:
-        return '"Авторизуй трекер" - навык предложит авторизоваться в Яндекс.трекере.\n' \
-               '"Запомни гитхаб LOGIN REPO INSTALLATION_ID" - передать навыку необходимую информацию о гитхабе. ' \
-               'Подробнее: LINK.\n' \
-               '"Запомни трекер ORG_ID QUEUE" - передать навыку необходимую информацию о трекере. ' \
-               'Подробнее: LINK.\n' \
-               '"Покажи тикеты трекер/гитхаб" - получить информацию об открытых тикетах в заданной системе.\n' \
-               '"Закрой тикет НОМЕР трекер/гитхаб" - закрыть тикет с номером НОМЕР в заданной системе.\n' \
-               '"Удали команду" - убирает всех людей из команды.\n' \
-               '"Помощь стендап" - покажет команды, доступные во время стендапа.'
+        return HELP_NEXT
 
     @staticmethod
     def standup_help() -> str:
-        return 'Режим стендапа:\n' \
-               '"У меня всё/я закончил" или другие вариации - завершает выступление текущего человека, очередь переходит к следующему.\n' \
-               '"Его/её сегодня нет" - выполняет ту же функцию, что и предыдущая фраза.\n' \
-               '"Продолжить" - если включено проигрывание тишины, то навык начнёт проигрывать её ещё раз.\n' \
-               '"Завершить стендап" - если возникает необходимость, то можно завершить стендап, не пройдя всю команду.\n' \
-               '"Запомни тему ТЕМА" - можно попросить навык запомнить небольшую тему, о которой он напомнит в конце стендапа.'
+        return STANDUP_HELP
 
     def new_user(self, user_id: str):
         self.connection.create_user(user_id)
         self.response['text'] = self.help_message()
 
-    def call_next(self, user_id: str):
+    def history_event(self, user_id: str, kind: str, person_id: Optional[int] = None,
+                      duration: Optional[float] = None, theme: Optional[str] = None):
+        self.events.append(Event(user_id, kind, person_id, now(), duration, theme))
+
+    def current_speaker_id(self, user: User) -> Optional[int]:
+        if 0 < user.cur_speaker <= len(user.speaker_queue):
+            return user.speaker_queue[user.cur_speaker - 1]
+        return None
+
+    def finish_turn(self, user_id: str, kind: str):
+        # Выступление текущего человека закончилось (kind - speak) или его пропустили (skip)
+        user = self.connection.get_user(user_id)
+        person_id = self.current_speaker_id(user)
+        if person_id is not None and user.speaker_started_at is not None:
+            self.history_event(user_id, kind, person_id, (now() - user.speaker_started_at).total_seconds())
+
+    def call_next(self, user_id: str, kind: str = 'speak'):
+        self.finish_turn(user_id, kind)
         try:
-            speaker = self.connection.call_next_speaker(user_id)
-            name = speaker['first_name'].capitalize()
-            if speaker['last_name'] != '':
-                name += ' ' + speaker['last_name'].capitalize()
-            text = f'{name}, расскажи о прошедшем дне'
+            speaker = self.connection.call_next_speaker(user_id, now())
+            text = f"{display_name(speaker['first_name'], speaker['last_name'])}, расскажи о прошедшем дне"
             if 'text' not in self.response:
                 self.response['text'] = text
             else:
@@ -105,14 +135,16 @@ class DialogHandler:
             self.end_standup(user_id)
 
     def end_standup(self, user_id):
+        self.finish_turn(user_id, 'speak')
+        started_at = self.connection.get_user(user_id).standup_started_at
+        if started_at is not None:
+            self.history_event(user_id, 'end', duration=(now() - started_at).total_seconds())
         self.response['text'] = 'Это был последний участник команды'
         themes = self.connection.get_team_themes(user_id)
         theme_list = []
         for theme in themes:
             if theme['theme']:
-                name = theme['first_name'].capitalize()
-                if theme['last_name'] is not None and theme['last_name'] != '':
-                    name += ' ' + theme['last_name'].capitalize()
+                name = display_name(theme['first_name'], theme.get('last_name'))
                 theme_list.append(f'у {name} '
                                   f'была тема "{theme["theme"]}"')  # TODO: Исправить падежи
         if theme_list:
@@ -149,6 +181,41 @@ class DialogHandler:
         self.response['text'] = f'Запомнила человека {names.get("last_name", "").capitalize()} ' \
                                 f'{names["first_name"].capitalize()}'
 
+    def add_team_members(self, user_id: str, persons: List[Dict[str, str]]):
+        # Все люди добавляются одним запросом к базе
+        self.connection.add_team_members(user_id, persons)
+        logging.info('Added %d persons to %r\'s storage', len(persons), user_id)
+        self.response['text'] = 'Запомнила людей: ' + ', '.join(roster_name(p['first_name'], p.get('last_name')).strip()
+                                                                for p in persons)
+
+    def import_team(self, req: Request, tracker: str):
+        source = self.issue_source(req, tracker)
+        if source is None:
+            return
+        key, connect = source
+        try:
+            # Список участников кэшируется как списки тикетов: если не успели в этот раз,
+            # повторная команда заберёт уже загруженный список
+            names = issue_cache().get(key + ('members',), lambda: connect().team_members(), self.deadline)
+        except DeadlineExceeded:
+            self.response['text'] = 'Участники ещё загружаются, повторите команду через пару секунд'
+            return
+        except TrackerAuthError as err:
+            self.github_auth_error(err)
+            return
+        except HTTPError as err:
+            logging.info(err)
+            self.response['text'] = 'Не удалось получить список участников'
+            return
+        persons = split_names(', '.join(names))
+        added = self.connection.import_team_members(req.user_id(), persons) if persons else []
+        if not added:
+            self.response['text'] = 'Все участники уже есть в команде'
+            return
+        logging.info('Imported %d of %d persons to %r\'s storage', len(added), len(persons), req.user_id())
+        self.response['text'] = 'Добавила в команду: ' + ', '.join(roster_name(p['first_name'], p.get('last_name')).strip()
+                                                                  for p in added)
+
     def del_team_member(self, user_id: str, names: Dict[str, str]):
         first_name = names.get('first_name', '')
         last_name = names.get('last_name', '')
@@ -181,44 +248,111 @@ class DialogHandler:
         self.response['text'] = 'При помощи команды \'запомни трекер ORG_ID QUEUE\' надо указать идентификатор ' \
                                 'организации и очередь, с которой вы хотите работать'
 
-    def get_tracker_client(self, req: Request):
+    def tracker_settings(self, req: Request) -> Optional[Tuple[str, str, str]]:
+        # Токен, организация и очередь трекера. Если чего-то нет, в ответ пишется подсказка
         org, queue = self.connection.get_tracker_info(req.user_id())
         if 'access_token' not in req._req['session']['user']:
             self.tracker_auth_help()
-            raise NoTokenException()
+            return None
         if org is None or queue is None:
             self.tracker_reg_help()
-            raise NoInfoException()
-        return YandexTracker(req._req['session']['user']['access_token'], org, queue)
+            return None
+        return req._req['session']['user']['access_token'], org, queue
 
-    def list_issues(self, req: Request, tracker: str):
-        client = None
+    @staticmethod
+    def github_source(username: str, repo: str, installation: str) -> Tuple[Tuple[str, ...], Callable[[], IssueTracker]]:
+        def connect() -> IssueTracker:
+            try:
+                return GithubTracker(username, repo, installation)
+            except HTTPError as err:
+                raise TrackerAuthError(f'Логин: {username}, репозиторий: {repo}, '
+                                       f'Installation_id: {installation}') from err
+        return github_key(username, repo, installation), connect
+
+    def issue_source(self, req: Request, tracker: str) -> Optional[Tuple[Tuple[str, ...], Callable[[], IssueTracker]]]:
+        # Возвращает ключ источника тикетов в кэше и функцию, создающую клиента. Создание клиента гитхаба
+        # ходит в сеть за токеном, поэтому оно выполняется вместе с запросом в пределах бюджета
         if tracker == 'github':
             username, repo, installation = self.connection.get_github_info(req.user_id())
             if username is None or repo is None or installation is None:
                 self.github_auth_help()
-                return
-            try:
-                client = GithubTracker(username, repo, installation)
-            except HTTPError as err:
-                logging.info(err)
-                self.response['text'] = f'Возникла ошибка в авторизации на гитхабе. Возможно это связано с неправильными ' \
-                                        f'данными. Проверьте данные и попробуйте ещё раз. Логин: {username}, репозиторий:' \
-                                        f' {repo}, Installation_id: {installation}.'
+                return None
+            return self.github_source(username, repo, installation)
+        settings = self.tracker_settings(req)
+        if settings is None:
+            return None
+        token, org, queue = settings
+        return tracker_key(token, org, queue), lambda: YandexTracker(token, org, queue)
+
+    def configured_sources(self, req: Request) -> List[Tuple[str, Tuple[str, ...], Callable[[], IssueTracker]]]:
+        # Все источники тикетов, которые пользователь настроил, без подсказок про ненастроенные
+        sources = []
+        username, repo, installation = self.connection.get_github_info(req.user_id())
+        if username is not None and repo is not None and installation is not None:
+            sources.append(('github', *self.github_source(username, repo, installation)))
+        org, queue = self.connection.get_tracker_info(req.user_id())
+        token = req._req['session']['user'].get('access_token')
+        if token is not None and org is not None and queue is not None:
+            sources.append(('tracker', tracker_key(token, org, queue), lambda: YandexTracker(token, org, queue)))
+        return sources
 
-        else:  # tracker == 'tracker'
-            try:
-                client = self.get_tracker_client(req)
-            except (NoTokenException, NoInfoException):
-                # message is already written
-                return
+    def github_auth_error(self, err: 'TrackerAuthError'):
+        logging.info(err.__cause__)
+        self.response['text'] = f'Возникла ошибка в авторизации на гитхабе. Возможно это связано с неправильными ' \
+                                f'данными. Проверьте данные и попробуйте ещё раз. {err}.'
+
+    def list_issues(self, req: Request, tracker: str):
+        source = self.issue_source(req, tracker)
+        if source is None:
+            return
+        key, connect = source
         try:
-            issues = client.list_issues()
+            issues = issue_cache().get(key, lambda: connect().list_issues(), self.deadline)
             self.response['text'] = ', '.join(issues)
+        except DeadlineExceeded:
+            self.response['text'] = 'Тикеты ещё загружаются, спросите ещё раз через пару секунд'
+        except TrackerAuthError as err:
+            self.github_auth_error(err)
         except HTTPError as err:
             logging.info(err)
             self.response['text'] = f'Возникла ошибка в получении тикетов.'
 
+    def list_all_issues(self, req: Request):
+        sources = self.configured_sources(req)
+        if not sources:
+            self.response['text'] = 'Не подключены ни гитхаб, ни трекер. Подробнее - в команде "помощь продолжение"'
+            return
+        # У каждого источника свой срок, но не позже общего бюджета ответа
+        timeout = float(os.getenv('ISSUE_SOURCE_TIMEOUT', '2'))
+        fetches = {key: ((lambda connect=connect: connect().list_issues()),
+                         Deadline(min(timeout, self.deadline.remaining())))
+                   for _, key, connect in sources}
+        results = issue_cache().get_many(fetches)
+        lines = []
+        failures = []
+        for name, key, _ in sources:
+            result = results[key]
+            if isinstance(result, Exception):
+                if not isinstance(result, DeadlineExceeded):
+                    logging.info('Failed to list %s issues: %r', name, result)
+                failures.append(self.source_failure(name, result))
+            else:
+                lines.append(f'{SOURCE_NAMES[name]}: ' + (', '.join(result) or 'открытых тикетов нет'))
+        self.response['text'] = '.\n'.join(lines + failures)
+
+    @staticmethod
+    def source_failure(name: str, err: Exception) -> str:
+        # Просить спросить ещё раз имеет смысл только когда источник не успел или временно недоступен,
+        # ошибку авторизации или настроек повтор не исправит
+        status = status_code(err)
+        if isinstance(err, TrackerAuthError) or status in (401, 403):
+            return f'{SOURCE_NAMES[name]}: ошибка авторизации, проверьте данные и попробуйте ещё раз'
+        if status == 404:
+            return f'{SOURCE_NAMES[name]}: не найдено, проверьте настройки командой "{SOURCE_SETTINGS[name]}"'
+        if isinstance(err, DeadlineExceeded) or retryable(err):
+            return f'{SOURCE_NAMES[name]} сейчас недоступен, спросите ещё раз через пару секунд'
+        return f'{SOURCE_NAMES[name]}: ошибка в получении тикетов'
+
     def register_github(self, user_id: str, command: str):
         splits = command.split(' ')
         if len(splits) > 5:
@@ -245,60 +379,194 @@ class DialogHandler:
     def start_standup(self, user_id: str):
         self.response['text'] = 'Хорошо, начинаю.\n'
         self.response['tts'] = 'хорошо , начинаю .'
-        self.connection.start_standup(user_id)
+        self.connection.start_standup(user_id, now())
+        self.history_event(user_id, 'start')
         self.call_next(user_id)
 
-    def close_issue(self, req: Request, issue_number: int, tracker: str):
-        client = None
+    def job_source(self, req: Request, tracker: str) -> Optional[Dict[str, Any]]:
+        # Всё, что нужно фоновой задаче для создания клиента (см. jobs.tracker_client)
         if tracker == 'github':
             username, repo, installation = self.connection.get_github_info(req.user_id())
             if username is None or repo is None or installation is None:
                 self.github_auth_help()
-                return
-            try:
-                client = GithubTracker(username, repo, installation)
-            except HTTPError as err:
-                logging.info(err)
-                self.response['text'] = f'Возникла ошибка в авторизации на гитхабе. Возможно это связано с неправильными ' \
-                                        f'данными. Проверьте данные и попробуйте ещё раз. Логин: {username}, репозиторий:' \
-                                        f' {repo}, Installation_id: {installation}, номер тикета: {issue_number}.'
-        else:
-            try:
-                client = self.get_tracker_client(req)
-            except (NoTokenException, NoInfoException):
-                # message is already written
-                return
-        try:
-            client.close_issue(issue_number)
-            self.response['text'] = 'Тикет успешно закрыт'
-        except HTTPError as err:
-            logging.info(err)
-            self.response['text'] = 'Не удалось закрыть тикет'
+                return None
+            return {'tracker': 'github', 'username': username, 'repo': repo, 'installation': installation}
+        settings = self.tracker_settings(req)
+        if settings is None:
+            return None
+        token, org, queue = settings
+        # Токен хранится в таблице задач только зашифрованным
+        sealed = seal_token(token)
+        if sealed is None:
+            logging.warning('TOKEN_SEAL_KEY is not set, tracker issues cannot be closed')
+            self.response['text'] = 'Закрытие тикетов трекера сейчас не настроено, закройте тикет в самом трекере'
+            return None
+        return {'tracker': 'tracker', 'sealed_token': sealed, 'org': org, 'queue': queue}
+
+    def close_issue(self, req: Request, issue_number: int, tracker: str):
+        # Закрытие - несколько последовательных запросов к трекеру, поэтому оно выполняется
+        # фоновой задачей, а результат навык сообщит в следующем ответе
+        args = self.job_source(req, tracker)
+        if args is None:
+            return
+        args['issue'] = issue_number
+        self.connection.enqueue_job(req.user_id(), 'close_issue', args)
+        self.response['text'] = 'Закрываю тикет, о результате сообщу в следующем ответе'
+
+    def report_jobs(self, user: User):
+        # Результаты фоновых задач, завершившихся после прошлого ответа, идут перед ответом на команду
+        reports = user.job_reports
+        if not reports:
+            return
+        text = ' '.join(report['result'] for report in reports)
+        self.response['text'] = f"{text}\n{self.response.get('text', '')}"
+        if 'tts' in self.response:
+            self.response['tts'] = f"{text} {self.response['tts']}"
+        self.connection.mark_jobs_reported(user.id, [report['job_id'] for report in reports])
 
-    def add_theme(self, req: Request):
-        theme = req.command()[13:]
+    def add_theme(self, req: Request, theme: str):
         self.connection.set_theme_for_current_speaker(req.user_id(), theme)
+        self.history_event(req.user_id(), 'theme', self.current_speaker_id(req.user), theme=theme)
         self.response['text'] = f'Запомнила тему "{theme}"'
         self.response['tts'] = f'запомнила тему {theme} . {self.tts()}'
 
-    def standup_mode(self, req: Request):
-        if 'end.report' in req.intents():
-            self.call_next(req.user_id())
-        elif req.command().startswith('запомни тему '):
-            self.add_theme(req)
-        elif self.end_standup_re.match(req.command()):
-            self.end_standup(req.user_id())
-        elif req.command() == 'продолжить':
-            self.response['text'] = ' '  # Игнорируем не команды
-            self.response['tts'] = self.tts()
-        elif 'skip.person' in req.intents():
-            self.response['text'] = 'Хорошо, пропускаю.\n'
-            self.response['tts'] = 'хорошо , пропускаю .'
-            self.call_next(req.user_id())
+    @common_routes.exact('покажи тикеты гитхаб')
+    def show_github_issues(self, req: Request, _):
+        self.list_issues(req, 'github')
+
+    @common_routes.exact('покажи тикеты трекер')
+    def show_tracker_issues(self, req: Request, _):
+        self.list_issues(req, 'tracker')
+
+    @common_routes.exact('покажи тикеты', 'покажи все тикеты', 'покажи тикеты везде')
+    def show_all_issues(self, req: Request, _):
+        self.list_all_issues(req)
+
+    @common_routes.regex('закрой (?:issue|тикет) (?P<issue_number>[0-9]+) (?P<tracker>гитхаб|трекер)')
+    def close_issue_command(self, req: Request, match):
+        tracker = 'github' if match.group('tracker') == 'гитхаб' else 'tracker'
+        self.close_issue(req, int(match.group('issue_number')), tracker)
+
+    @standup_routes.intent('end.report')
+    def end_report(self, req: Request, _):
+        self.call_next(req.user_id())
+
+    @standup_routes.prefix('запомни тему ')
+    def remember_theme(self, req: Request, theme: str):
+        self.add_theme(req, theme)
+
+    @standup_routes.regex('за(?:кончи|верши)(?:ть)? (?:стендап|стенд ап|standup|stand up)')
+    def end_standup_command(self, req: Request, _):
+        self.end_standup(req.user_id())
+
+    @standup_routes.exact('продолжить')
+    def continue_silence(self, req: Request, _):
+        self.response['text'] = ' '  # Игнорируем не команды
+        self.response['tts'] = self.tts()
+
+    @standup_routes.intent('skip.person')
+    def skip_person(self, req: Request, _):
+        self.response['text'] = 'Хорошо, пропускаю.\n'
+        self.response['tts'] = 'хорошо , пропускаю .'
+        self.call_next(req.user_id(), 'skip')
+
+    @idle_routes.prefix('запомни гитхаб')
+    def register_github_command(self, req: Request, _):
+        # Original utterance здесь, так как нам нужно именно то,
+        # что передали
+        self.register_github(req.user_id(), req.original_utterance())
+
+    @idle_routes.prefix('запомни трекер')
+    def register_tracker_command(self, req: Request, _):
+        self.register_tracker(req.user_id(), req.original_utterance())
+
+    @idle_routes.exact('авторизуй трекер')
+    def authorize_tracker(self, req: Request, _):
+        if 'access_token' in req._req['session']['user']:
+            self.response['text'] = 'Вы уже авторизованны'
+        else:
+            raise AuthorizationRequest()
+
+    @idle_routes.exact('помощь', 'что ты умеешь')
+    def help_command(self, req: Request, _):
+        self.response['text'] = self.help_message()
+
+    @idle_routes.exact('помощь продолжение')
+    def help_next_command(self, req: Request, _):
+        self.response['text'] = self.help_next()
+
+    @idle_routes.exact('помощь стендап')
+    def standup_help_command(self, req: Request, _):
+        self.response['text'] = self.standup_help()
+
+    @idle_routes.prefix('добавь в команду человека с именем')
+    def add_team_member_no_intent_command(self, req: Request, _):
+        self.add_team_member_no_intent(req)
+
+    @idle_routes.prefix('добавь в команду ')
+    def add_team_members_command(self, req: Request, names: str):
+        utterance = req.original_utterance()
+        if ',' in utterance:
+            # В command Алиса убирает знаки препинания, а запятые разделяют людей
+            names = utterance.lower().partition('в команду')[2]
+        persons = split_names(names)
+        if len(persons) > 1:
+            self.add_team_members(req.user_id(), persons)
+        elif 'team.newmember' in req.intents():
+            # Одно имя лучше разбирает грамматика интента
+            self.new_member_intent(req, req.intents()['team.newmember'])
+        elif persons:
+            self.add_team_member(req.user_id(), persons[0])
         else:
-            self.response['text'] = 'Не смогла распознать команду. Во время проведения стендапа могу ' \
-                                    'распознать следующие команды: "у меня всё", "продолжить", ' \
-                                    '"его|её сегодня нет", "запомнить тему ТЕМА", "закончи стендап"'
+            self.response['text'] = 'К сожалению я не смогла распознать имя, попробуйте ещё раз'
+
+    @idle_routes.regex('(?:импортируй|загрузи) команду (?:из )?(?P<member_source>гитхаба?|трекера?)')
+    def import_team_command(self, req: Request, match):
+        tracker = 'github' if match.group('member_source').startswith('гитхаб') else 'tracker'
+        self.import_team(req, tracker)
+
+    @idle_routes.exact('статистика стендапов', 'покажи статистику', 'покажи статистику стендапов')
+    def standup_report_command(self, req: Request, _):
+        self.response['text'] = standup_report(*self.connection.get_standup_report(req.user_id()))
+
+    @idle_routes.exact('напомни команду')
+    def remind_team_command(self, req: Request, _):
+        self.remind_team(req.user_id())
+
+    @idle_routes.regex('(?:начать|начни|проведи) (?:стендап|стенд ап|standup|stand up)')
+    def start_standup_command(self, req: Request, _):
+        self.start_standup(req.user_id())
+
+    @idle_routes.exact('включи тишину')
+    def enable_silence(self, req: Request, _):
+        self.connection.modify_silence(req.user_id(), True)
+        self.response['text'] = 'Тишина включена'
+
+    @idle_routes.exact('выключи тишину')
+    def disable_silence(self, req: Request, _):
+        self.connection.modify_silence(req.user_id(), False)
+        self.response['text'] = 'Тишина выключена'
+
+    @idle_routes.exact('удали команду')
+    def clean_team_command(self, req: Request, _):
+        self.clean_team(req.user_id())
+
+    @idle_routes.intent('team.newmember')
+    def new_member_intent(self, req: Request, intent: Dict[str, Any]):
+        self.add_team_member(req.user_id(), intent['slots']['name']['value'])
+
+    @idle_routes.intent('team.delmember')
+    def del_member_intent(self, req: Request, intent: Dict[str, Any]):
+        self.del_team_member(req.user_id(), intent['slots']['name']['value'])
+
+    def dispatch(self, router: Router, req: Request) -> bool:
+        route = router.match(req.command(), req.intents())
+        if route is None:
+            return False
+        handler, arg = route
+        with command_seconds.time(handler.__name__):
+            handler(self, req, arg)
+        return True
 
     def handle_dialog(self, req: Request):
         if not req.is_authorized():  # Не умеем работать с неавторизованными пользователями
@@ -307,101 +575,65 @@ class DialogHandler:
             self.response['end_session'] = True
             return
 
-        # Этот context manager закоммитит транзакцию и вернет соединение в пул
-        with self.connection_factory.create_conn() as connection:
-            self.connection = connection
-            req.user = self.connection.get_user(req.user_id())
-            if not req.user:  # Новый пользователь
-                self.new_user(req.user_id())
-                return
-
-            self.silence_enabled = req.user.silence_enabled
-
-            if 'account_linking_complete_event' in req._req:
-                self.response['text'] = 'Вы успешно авторизованны'
-                return
-
-            if req.is_session_new():
-                self.returning_greeting(req.user_id())
-                return
-
-            if req.command() == 'покажи тикеты гитхаб':
-                self.list_issues(req, 'github')
-                return
-
-            if req.command() == 'покажи тикеты трекер':
-                self.list_issues(req, 'tracker')
-                return
-
-            if close_issue_command := self.close_issue_re.match(req.command()):
-                self.close_issue(req, int(close_issue_command.group(2)), close_issue_command.group(3))
-                return
-
-            if self.connection.check_standup(req.user_id()):  # user_id в текущий момент проводит стендап
-                self.standup_mode(req)
-                return
-
-            if req.command().startswith('запомни гитхаб'):
-                # Original utterance здесь, так как нам нужно именно то,
-                # что передали
-                self.register_github(req.user_id(), req.original_utterance())
-                return
-
-            if req.command().startswith('запомни трекер'):
-                self.register_tracker(req.user_id(), req.original_utterance())
-                return
-
-            if req.command() == 'авторизуй трекер':
-                if 'access_token' in req._req['session']['user']:
-                    self.response['text'] = 'Вы уже авторизованны'
-                    return
-                else:
-                    raise AuthorizationRequest()
-
-            if req.command() == 'помощь' or req.command() == 'что ты умеешь':
-                self.response['text'] = self.help_message()
-                return
-
-            if req.command() == 'помощь продолжение':
-                self.response['text'] = self.help_next()
-                return
-
-            if req.command() == 'помощь стендап':
-                self.response['text'] = self.standup_help()
-                return
-
-            if req.command().startswith('добавь в команду человека с именем'):
-                self.add_team_member_no_intent(req)
-                return
-
-            if req.command() == 'напомни команду':
-                self.remind_team(req.user_id())
-                return
-
-            if self.begin_standup_re.match(req.command()):
-                self.start_standup(req.user_id())
-                return
-
-            if req.command() == 'включи тишину':
-                self.connection.modify_silence(req.user_id(), True)
-                self.response['text'] = 'Тишина включена'
-                return
-            elif req.command() == 'выключи тишину':
-                self.connection.modify_silence(req.user_id(), False)
-                self.response['text'] = 'Тишина выключена'
-                return
-
-            if req.command() == 'удали команду':
-                self.clean_team(req.user_id())
-                return
-
-            intents = req.intents()
-            if 'team.newmember' in intents:
-                self.add_team_member(req.user_id(), intents['team.newmember']['slots']['name']['value'])
-                return
-
-            if 'team.delmember' in intents:
-                self.del_team_member(req.user_id(), intents['team.delmember']['slots']['name']['value'])
-                return
+        try:
+            self.handle_user(req)
+        except StaleStandupState:
+            # Стендап изменил другой процесс, пока этот отвечал по копии из памяти. Транзакция
+            # откатилась, второй раз состояние читается из базы мимо памяти процесса: иначе копию,
+            # положенную туда другим запросом, могли бы снова застать устаревшей
+            self.response = {'end_session': False}
+            self.events = []
+            self.handle_user(req, cached=False)
+        if self.events:
+            self.connection_factory.record_history(self.events)
+
+    def handle_user(self, req: Request, cached: bool = True):
+        key = req.message_key()
+        try:
+            # Этот context manager закоммитит транзакцию и вернет соединение в пул
+            with self.connection_factory.create_conn(cached) as connection:
+                self.connection = connection
+                if key is not None:
+                    self.connection.claim_response(*key, self.deadline.remaining())
+                self.respond(req)
+                if key is not None:
+                    self.connection.store_response(*key, self.response)
+        except ReplayedRequest:
+            # Повтор запроса, который уже обработал другой процесс: всё сделанное откатилось,
+            # отвечаем тем же, что и в первый раз
+            self.events = []
+            with self.connection_factory.create_conn() as connection:
+                self.response = connection.get_response(*key)
+            self.replayed = True
+
+    def respond(self, req: Request):
+        req.user = self.connection.get_user(req.user_id())
+        if not req.user:  # Новый пользователь
+            self.new_user(req.user_id())
+            return
+
+        self.silence_enabled = req.user.silence_enabled
+        self.route(req)
+        self.report_jobs(req.user)
+
+    def route(self, req: Request):
+        if 'account_linking_complete_event' in req._req:
+            self.response['text'] = 'Вы успешно авторизованны'
+            return
+
+        if req.is_session_new():
+            self.returning_greeting(req.user_id())
+            return
+
+        if self.dispatch(self.common_routes, req):
+            return
+
+        if self.connection.check_standup(req.user_id()):  # user_id в текущий момент проводит стендап
+            if not self.dispatch(self.standup_routes, req):
+                self.response['text'] = 'Не смогла распознать команду. Во время проведения стендапа могу ' \
+                                        'распознать следующие команды: "у меня всё", "продолжить", ' \
+                                        '"его|её сегодня нет", "запомнить тему ТЕМА", "закончи стендап"'
+            return
 
+        if not self.dispatch(self.idle_routes, req):
             self.response['text'] = 'Неизвестная команда.'
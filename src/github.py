@@ -1,13 +1,35 @@
 import datetime
+import functools
 import logging
 import os
+import threading
+from collections import namedtuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import jwt
-import requests
-from cachetools import cached, Cache, TTLCache
+from cachetools import cached, Cache, LRUCache, TTLCache
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from requests import HTTPError
 
+from deadline import executor
+from http_client import session
 from issue_tracker import IssueTracker
+from log import truncate
+from metrics import github_responses, upstream_seconds
+from storage import TokenStore
+
+
+ISSUES_LIMIT = 10
+ISSUES_PAGE_SIZE = 2 * ISSUES_LIMIT
+ISSUES_MAX_PAGES = 3
+
+CachedPage = namedtuple('CachedPage', ['etag', 'titles', 'next_url', 'size'])
+# ETag и разобранное содержимое страниц тикетов, чтобы повторять запросы условными
+etag_cache = LRUCache(maxsize=1024)
+etag_lock = threading.Lock()
+# fetched - ответы 200, not_modified - ответы 304, bytes - скачано, bytes_saved - не пришлось скачивать
+stats = {'fetched': 0, 'not_modified': 0, 'bytes': 0, 'bytes_saved': 0}
+logger = logging.getLogger('github')
 
 
 class GithubTracker(IssueTracker):
@@ -16,25 +38,81 @@ class GithubTracker(IssueTracker):
         self.user = username
         self.repo = repo
 
+    @upstream_seconds.timed('github', 'list_issues')
     def list_issues(self):
+        titles = []
+        url = f'https://api.github.com/repos/{self.user}/{self.repo}/issues'
+        # PR тоже приходят из этого эндпоинта и отфильтровать их на стороне API нельзя,
+        # поэтому берём страницы с запасом и останавливаемся, как только набрали ISSUES_LIMIT тикетов
+        params = {'state': 'open', 'per_page': ISSUES_PAGE_SIZE}
+        for _ in range(ISSUES_MAX_PAGES):
+            page, url = self._issues_page(url, params)
+            titles.extend(page)
+            params = None  # ссылка на следующую страницу уже содержит параметры
+            if len(titles) >= ISSUES_LIMIT or url is None:
+                break
+        logger.debug('issue pages', extra=stats)
+        return titles[:ISSUES_LIMIT]
+
+    def _issues_page(self, url: str, params: Optional[Dict[str, Any]]) -> Tuple[List[str], Optional[str]]:
         headers = {'Authorization': f'token {self.token}', 'Accept': 'application/vnd.github.v3+json'}
-        response = requests.get(f'https://api.github.com/repos/{self.user}/{self.repo}/issues', headers=headers)
+        cache_key = (url, tuple(sorted(params.items())) if params else None)
+        with etag_lock:
+            cached = etag_cache.get(cache_key)
+        if cached is not None:
+            headers['If-None-Match'] = cached.etag
+        response = session().get(url, headers=headers, params=params)
+        if response.status_code == 304 and cached is not None:
+            # Условный запрос с ответом 304 не расходует лимит запросов гитхаба
+            github_responses.inc('304')
+            with etag_lock:
+                stats['not_modified'] += 1
+                stats['bytes_saved'] += cached.size
+            return cached.titles, cached.next_url
         response.raise_for_status()
+        github_responses.inc(str(response.status_code))
         data = response.json()
-        logging.info('response from github: %r', data)
+        logger.debug('issues page', extra={'url': url, 'issues': len(data), 'bytes': len(response.content)})
         titles = [f"{r['number']}. {r['title']}" for r in data if 'pull_request' not in r]
-        titles = titles[:10]
-        return titles
+        next_url = response.links.get('next', {}).get('url')
+        with etag_lock:
+            stats['fetched'] += 1
+            stats['bytes'] += len(response.content)
+            if etag := response.headers.get('ETag'):
+                etag_cache[cache_key] = CachedPage(etag, titles, next_url, len(response.content))
+        return titles, next_url
+
+    def issue_prefix(self, issue) -> str:
+        return f'{issue}. '
 
+    @upstream_seconds.timed('github', 'close_issue')
     def close_issue(self, issue):
         headers = {'Authorization': f'token {self.token}', 'Accept': 'application/vnd.github.v3+json'}
         params = {'state': 'closed'}
-        response = requests.patch(f'https://api.github.com/repos/{self.user}/{self.repo}/issues/{issue}',
+        response = session().patch(f'https://api.github.com/repos/{self.user}/{self.repo}/issues/{issue}',
                                   headers=headers,
                                   json=params)
         response.raise_for_status()
         data = response.json()
-        logging.info('response from github: %r', data)
+        logger.info('closed issue', extra={'repo': f'{self.user}/{self.repo}', 'issue': issue,
+                                           'state': data.get('state'), 'title': truncate(data.get('title', ''))})
+
+    @upstream_seconds.timed('github', 'team_members')
+    def team_members(self) -> List[str]:
+        # В REST у коллабораторов нет имён, а запрашивать профиль каждого - лишние запросы.
+        # GraphQL отдаёт логины и имена всех одним запросом, у кого имя не указано - берём логин
+        query = """query($owner: String!, $repo: String!) {
+                     repository(owner: $owner, name: $repo) {
+                       collaborators(first: 100) { nodes { login name } } } }"""
+        response = session().post('https://api.github.com/graphql',
+                                  headers={'Authorization': f'bearer {self.token}'},
+                                  json={'query': query, 'variables': {'owner': self.user, 'repo': self.repo}})
+        response.raise_for_status()
+        data = response.json()
+        if data.get('errors'):
+            raise HTTPError(f"GraphQL errors: {data['errors']}", response=response)
+        nodes = data['data']['repository']['collaborators']['nodes']
+        return [node['name'] or node['login'] for node in nodes]
 
 
 @cached(Cache(maxsize=1))
@@ -43,7 +121,7 @@ def github_app_key():
         return load_pem_private_key(keyfile.read(), password=None)
 
 
-@cached(TTLCache(maxsize=1, ttl=600))
+@cached(TTLCache(maxsize=1, ttl=600), lock=threading.Lock())
 def github_jwt() -> bytes:
     now = datetime.datetime.now(datetime.timezone.utc)
     delta_before = datetime.timedelta(0, 0, 0, 0, -1, 0, 0)  # 1 minute
@@ -57,14 +135,87 @@ def github_jwt() -> bytes:
     return jwt.encode(payload, key, algorithm='RS256')
 
 
-@cached(TTLCache(maxsize=10, ttl=600))
-def get_installation_token(installation) -> str:
+@upstream_seconds.timed('github', 'mint_token')
+def mint_installation_token(installation) -> Tuple[str, datetime.datetime]:
     app_token = github_jwt()
     headers = {'Authorization': f'Bearer {app_token}', 'Accept': 'application/vnd.github.v3+json'}
-    response = requests.post(
+    response = session().post(
         f'https://api.github.com/app/installations/{installation}/access_tokens', headers=headers
     )
     response.raise_for_status()
     data = response.json()
-    logging.info('response from github: %r', data)
-    return data['token']
+    expires_at = datetime.datetime.fromisoformat(data['expires_at'].replace('Z', '+00:00'))
+    logger.info('Minted token for installation %r, expires at %s', installation, expires_at)
+    return data['token'], expires_at
+
+
+class InstallationTokenCache:
+    # Токены установки гитхаба живут час. Токен отдаётся из кэша, пока до истечения больше refresh_margin,
+    # затем ещё min_validity отдаётся старый токен, а новый выпускается в фоне.
+    # Если задан store, токены разделяются между процессами через него
+    def __init__(self, maxsize: int, refresh_margin: datetime.timedelta, min_validity: datetime.timedelta,
+                 store=None, mint: Callable[[Any], Tuple[str, datetime.datetime]] = mint_installation_token):
+        self.tokens = LRUCache(maxsize=maxsize)
+        self.refresh_margin = refresh_margin
+        self.min_validity = min_validity
+        self.store = store
+        self.mint = mint
+        self.lock = threading.Lock()
+        self.refreshing = set()
+
+    def get(self, installation) -> str:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self.lock:
+            entry = self.tokens.get(installation)
+        if entry is not None:
+            token, expires_at = entry
+            if expires_at - now > self.refresh_margin:
+                return token
+            if expires_at - now > self.min_validity:
+                self.refresh_in_background(installation)
+                return token
+        return self.refresh(installation)
+
+    def refresh(self, installation) -> str:
+        if self.store is not None:
+            token, expires_at = self.store.get_or_mint(installation, self.mint,
+                                                       self.refresh_margin + self.min_validity)
+        else:
+            token, expires_at = self.mint(installation)
+        with self.lock:
+            self.tokens[installation] = (token, expires_at)
+        return token
+
+    def refresh_in_background(self, installation):
+        with self.lock:
+            if installation in self.refreshing:
+                return
+            self.refreshing.add(installation)
+
+        def refresh():
+            try:
+                self.refresh(installation)
+            except Exception as err:
+                logger.warning('Failed to refresh token for installation %r: %r', installation, err)
+            finally:
+                with self.lock:
+                    self.refreshing.discard(installation)
+        executor().submit(refresh)
+
+
+@functools.lru_cache
+def token_cache() -> InstallationTokenCache:
+    store = None
+    if os.getenv('GITHUB_TOKEN_STORE', '') == 'postgres':
+        if TokenStore.available():
+            store = TokenStore()
+        else:
+            logger.warning('TOKEN_SEAL_KEY is not set, GitHub tokens are kept per process')
+    return InstallationTokenCache(maxsize=int(os.getenv('GITHUB_TOKEN_CACHE_SIZE', '1000')),
+                                  refresh_margin=datetime.timedelta(seconds=int(os.getenv('GITHUB_TOKEN_REFRESH', '300'))),
+                                  min_validity=datetime.timedelta(seconds=60),
+                                  store=store)
+
+
+def get_installation_token(installation) -> str:
+    return token_cache().get(installation)
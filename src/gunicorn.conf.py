@@ -0,0 +1,59 @@
+# Продакшен запуск навыка: gunicorn -c src/gunicorn.conf.py
+# WEB_WORKERS процессов, в каждом WEB_THREADS потоков обработки запросов.
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = 'application:application'
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+workers = int(os.getenv('WEB_WORKERS', str(multiprocessing.cpu_count())))
+worker_class = 'gthread'
+# Ходы стендапа из памяти процесса (src/standup_state.py) быстрее, только если запросы одного пользователя
+# попадают в один воркер. Между несколькими воркерами запросы распределяются как придётся, копия в памяти
+# почти всегда оказывается устаревшей и ход выполняется дважды, поэтому здесь кэш по умолчанию выключен
+if workers > 1:
+    os.environ.setdefault('STANDUP_STATE_CACHE_SIZE', '0')
+# Каждому потоку нужно соединение с базой, поэтому по умолчанию потоков столько же, сколько соединений в пуле
+threads = int(os.getenv('WEB_THREADS', os.getenv('PG_POOL_MAX', '2')))
+# При остановке воркер перестаёт принимать запросы и ждёт завершения начатых не дольше этого времени
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '10'))
+timeout = 30
+
+# Приложение импортируется в каждом воркере после fork: пул соединений с базой, HTTP пул
+# и пулы потоков создаются лениво внутри процесса и не наследуются от мастера
+preload_app = False
+
+if os.getenv('SSL_CERT'):
+    certfile = os.getenv('SSL_CERT')
+    keyfile = os.getenv('SSL_KEY')
+
+
+def on_starting(server):
+    # Миграции применяются один раз в мастере, до запуска воркеров
+    from migrations import migrate_on_start
+    migrate_on_start()
+
+
+def post_worker_init(worker):
+    # Соединения открываются заранее, чтобы первый запрос к воркеру не ждал подключения к базе
+    from jobs import start_runner
+    from storage import pool
+    pool()
+    start_runner()
+
+
+def worker_exit(server, worker):
+    # Начатые запросы уже завершились и вернули соединения в пул, теперь их можно закрыть.
+    # Фоновые задачи доделываются в пределах того же graceful_timeout
+    from deadline import executor
+    from jobs import stop_runner
+    from storage import close_pool
+    stop_runner()
+    if executor.cache_info().currsize:
+        executor().shutdown(wait=False)
+    close_pool()
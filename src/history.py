@@ -0,0 +1,201 @@
+import atexit
+import datetime
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from metrics import history_events, storage_seconds
+from storage import connection_params
+
+# История стендапов. Обработчик запроса только кладёт события в очередь, а отдельный поток пишет их
+# пачками в секционированную по месяцам таблицу standup_events и в той же транзакции прибавляет
+# их к агрегатам person_stats и standup_stats, из которых строится отчёт
+
+Event = namedtuple('Event', ['user_id', 'kind', 'person_id', 'happened_at', 'duration', 'theme'])
+
+logger = logging.getLogger('history')
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def aggregate(events: Iterable[Event]) -> Tuple[Dict[Tuple[str, int], List], Dict[str, List]]:
+    # Приращения агрегатов по пачке событий: по людям [turns, skips, speaking_seconds, themes, last_turn_at]
+    # и по пользователям [standups, standup_seconds, last_standup_at]
+    persons: Dict[Tuple[str, int], List] = {}
+    standups: Dict[str, List] = {}
+    for event in events:
+        if event.kind in ('speak', 'skip', 'theme'):
+            stats = persons.setdefault((event.user_id, event.person_id), [0, 0, 0.0, 0, None])
+            if event.kind == 'theme':
+                stats[3] += 1
+                continue
+            stats[0] += 1
+            if event.kind == 'skip':
+                stats[1] += 1
+            else:
+                stats[2] += event.duration or 0.0
+            stats[4] = max(stats[4] or event.happened_at, event.happened_at)
+        elif event.kind == 'end':
+            stats = standups.setdefault(event.user_id, [0, 0.0, None])
+            stats[0] += 1
+            stats[1] += event.duration or 0.0
+            stats[2] = max(stats[2] or event.happened_at, event.happened_at)
+    return persons, standups
+
+
+def month_bounds(moment: datetime.datetime) -> Tuple[datetime.date, datetime.date]:
+    start = moment.astimezone(datetime.timezone.utc).date().replace(day=1)
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+class HistoryWriter:
+    # Пачка уходит, когда набралось batch_size событий или прошло flush_interval секунд с первого из них.
+    # Если база не успевает и в очереди max_pending событий, новые события отбрасываются, запросы не ждут.
+    # Пачка, не записанная из-за потери соединения или конфликта транзакций, пишется снова до max_attempts раз
+    # с задержкой от retry_delay секунд, удваивающейся с каждой попыткой
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int, max_attempts: int = 3,
+                 retry_delay: float = 0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.events: queue.Queue = queue.Queue(maxsize=max_pending)
+        self.partitions: Set[datetime.date] = set()
+        self.conn = None
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def record(self, events: Iterable[Event]):
+        self.start()
+        for event in events:
+            try:
+                self.events.put_nowait(event)
+            except queue.Full:
+                history_events.inc('dropped')
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='history', daemon=True)
+                self.thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        # Дописывает накопленное и останавливает поток
+        with self.lock:
+            thread = self.thread
+        if thread is not None:
+            self.events.put(None)
+            thread.join(timeout)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            first = self.events.get()
+            if first is None:
+                break
+            batch = [first]
+            flush_at = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    event = self.events.get(timeout=max(flush_at - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+            self.write(batch)
+        if self.conn is not None:
+            self.conn.close()
+
+    def write(self, batch: List[Event]):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.write_once(batch)
+                history_events.inc('written', amount=len(batch))
+                return
+            except psycopg2.Error as err:
+                if self.conn is not None and not self.conn.closed:
+                    self.conn.close()
+                transient = isinstance(err, (psycopg2.OperationalError, psycopg2.InterfaceError))
+                if not transient or attempt == self.max_attempts:
+                    logger.warning('Failed to write %d standup events after %d attempts: %r', len(batch), attempt, err)
+                    history_events.inc('dropped', amount=len(batch))
+                    return
+                logger.info('Failed to write %d standup events, retrying: %r', len(batch), err)
+                history_events.inc('retried', amount=len(batch))
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def write_once(self, batch: List[Event]):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(**connection_params())
+        with storage_seconds.time('history'), self.conn, self.conn.cursor() as cur:
+            created = self.ensure_partitions(cur, batch)
+            execute_values(cur, """INSERT INTO standup_events(user_id, kind, person_id, happened_at, duration, theme)
+                                   VALUES %s""", batch)
+            persons, standups = aggregate(batch)
+            if persons:
+                execute_values(cur, """INSERT INTO person_stats AS s(user_id, person_id, turns, skips,
+                                                                      speaking_seconds, themes, last_turn_at)
+                                       VALUES %s
+                                       ON CONFLICT (user_id, person_id) DO UPDATE SET
+                                           turns = s.turns + EXCLUDED.turns,
+                                           skips = s.skips + EXCLUDED.skips,
+                                           speaking_seconds = s.speaking_seconds + EXCLUDED.speaking_seconds,
+                                           themes = s.themes + EXCLUDED.themes,
+                                           last_turn_at = GREATEST(s.last_turn_at, EXCLUDED.last_turn_at)""",
+                               [key + tuple(stats) for key, stats in persons.items()])
+            if standups:
+                execute_values(cur, """INSERT INTO standup_stats AS s(user_id, standups, standup_seconds,
+                                                                      last_standup_at)
+                                       VALUES %s
+                                       ON CONFLICT (user_id) DO UPDATE SET
+                                           standups = s.standups + EXCLUDED.standups,
+                                           standup_seconds = s.standup_seconds + EXCLUDED.standup_seconds,
+                                           last_standup_at = GREATEST(s.last_standup_at, EXCLUDED.last_standup_at)""",
+                               [(user_id,) + tuple(stats) for user_id, stats in standups.items()])
+        self.partitions.update(created)
+
+    def ensure_partitions(self, cur, batch: List[Event]) -> List[datetime.date]:
+        # Возвращает месяцы, секции которых проверены. Они запоминаются только после коммита
+        created = []
+        for start, end in {month_bounds(event.happened_at) for event in batch}:
+            if start in self.partitions:
+                continue
+            # Секцию могут одновременно создавать несколько процессов. Границы в UTC явно,
+            # иначе они зависели бы от часового пояса сессии
+            cur.execute("""SELECT pg_advisory_xact_lock(hashtext('standup_events_partition'))""")
+            cur.execute(f"""CREATE TABLE IF NOT EXISTS standup_events_{start:%Y_%m} PARTITION OF standup_events
+                            FOR VALUES FROM ('{start} 00:00+00') TO ('{end} 00:00+00')""")
+            created.append(start)
+        return created
+
+
+history_lock = threading.Lock()
+
+
+def history_writer() -> HistoryWriter:
+    with history_lock:
+        return create_history_writer()
+
+
+@functools.lru_cache
+def create_history_writer() -> HistoryWriter:
+    writer = HistoryWriter(batch_size=int(os.getenv('HISTORY_BATCH_SIZE', '500')),
+                           flush_interval=float(os.getenv('HISTORY_FLUSH_INTERVAL', '1')),
+                           max_pending=int(os.getenv('HISTORY_MAX_PENDING', '100000')),
+                           max_attempts=int(os.getenv('HISTORY_MAX_ATTEMPTS', '3')),
+                           retry_delay=float(os.getenv('HISTORY_RETRY_DELAY', '0.5')))
+    atexit.register(writer.stop, 5)
+    return writer
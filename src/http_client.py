@@ -0,0 +1,51 @@
+import functools
+import os
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def timeouts() -> Tuple[float, float]:
+    return float(os.getenv('HTTP_CONNECT_TIMEOUT', '2')), float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+
+
+class TimeoutSession(requests.Session):
+    # requests по умолчанию ждёт ответа бесконечно
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', timeouts())
+        return super().request(*args, **kwargs)
+
+
+# Один пул соединений на процесс для гитхаба и трекера: соединения держатся открытыми (keep-alive)
+# и переиспользуются между запросами, к одному хосту держится не больше HTTP_POOL_SIZE соединений.
+# Когда все они заняты, запрос не ждёт свободного (requests не передаёт urllib3 время ожидания пула,
+# и поток webhook ждал бы без ограничения), а открывает лишнее соединение и закрывает его после ответа
+@functools.lru_cache
+def adapter() -> HTTPAdapter:
+    return HTTPAdapter(pool_connections=int(os.getenv('HTTP_POOL_HOSTS', '10')),
+                       pool_maxsize=int(os.getenv('HTTP_POOL_SIZE', '10')),
+                       pool_block=False)
+
+
+def attach(session: requests.Session) -> requests.Session:
+    session.mount('https://', adapter())
+    session.mount('http://', adapter())
+    return session
+
+
+@functools.lru_cache
+def session() -> requests.Session:
+    return attach(TimeoutSession())
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    # Для каждого хоста: сколько запросов отправлено и сколько соединений для этого пришлось открыть
+    result = {}
+    pools = adapter().poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None:
+            result[f'{pool.scheme}://{pool.host}:{pool.port}'] = {'requests': pool.num_requests,
+                                                                  'connections': pool.num_connections}
+    return result
@@ -0,0 +1,54 @@
+import copy
+import functools
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from cachetools import TTLCache
+
+# Алиса повторяет webhook, на который не дождалась ответа, с теми же session_id и message_id.
+# Повтор не должен выполняться заново: второе "у меня всё" пропустило бы человека. Ответы на
+# обработанные запросы хранятся здесь, в памяти процесса, и в таблице webhook_responses, общей
+# для всех процессов (StorageConnection.claim_response), куда попадает повтор, пришедший в другой воркер
+
+Key = Tuple[str, int]
+
+
+class ReplayedRequest(Exception):
+    # Ответ на этот запрос уже закоммитил другой процесс или поток
+    pass
+
+
+class ResponsePending(Exception):
+    # Этот запрос ещё выполняет другой процесс или поток, и его ответа не дождаться до конца бюджета
+    pass
+
+
+def dedup_ttl() -> int:
+    # Сколько секунд помнить ответ. Алиса повторяет запрос через секунды, так что час - с большим запасом
+    return int(os.getenv('WEBHOOK_DEDUP_TTL', '3600'))
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int, ttl: int):
+        self.responses: Optional[TTLCache] = TTLCache(maxsize=maxsize, ttl=ttl) if maxsize > 0 else None
+        self.lock = threading.Lock()
+
+    def get(self, key: Optional[Key]) -> Optional[Dict[str, Any]]:
+        if self.responses is None or key is None:
+            return None
+        with self.lock:
+            response = self.responses.get(key)
+        return copy.deepcopy(response)
+
+    def put(self, key: Optional[Key], response: Dict[str, Any]):
+        if self.responses is None or key is None:
+            return
+        response = copy.deepcopy(response)
+        with self.lock:
+            self.responses[key] = response
+
+
+@functools.lru_cache
+def response_cache() -> ResponseCache:
+    return ResponseCache(maxsize=int(os.getenv('WEBHOOK_DEDUP_SIZE', '10000')), ttl=dedup_ttl())
@@ -0,0 +1,115 @@
+import concurrent.futures
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from deadline import Deadline, DeadlineExceeded, executor
+
+
+def github_key(username: str, repo: str, installation) -> Tuple[str, ...]:
+    # Запись кэша отдаётся без обращения к источнику, поэтому в ключе есть то, с чем источник был прочитан:
+    # другой пользователь с тем же репозиторием, но без доступа к установке, свою запись не найдёт
+    return 'github', str(installation), username, repo
+
+
+def tracker_key(token: str, org: str, queue: str) -> Tuple[str, ...]:
+    # То же для трекера, доступ к очереди определяет OAuth токен пользователя. В памяти держим только его хэш
+    return 'tracker', hashlib.sha256(token.encode('utf-8')).hexdigest(), org, queue
+
+
+class IssueListCache:
+    # Кэш готовых списков тикетов по источнику и доступу к нему (github_key, tracker_key).
+    # Свежая запись отдаётся сразу. Устаревшая тоже отдаётся сразу, но в фоне запускается обновление.
+    # Записи старше max_age считаются отсутствующими, число записей ограничено maxsize
+    def __init__(self, maxsize: int, ttl: float, max_age: float, timer: Callable[[], float] = time.monotonic):
+        self.entries: LRUCache = LRUCache(maxsize=maxsize)
+        self.ttl = ttl
+        self.max_age = max_age
+        self.timer = timer
+        self.lock = threading.Lock()
+        self.refreshing: Dict[Hashable, concurrent.futures.Future] = {}
+
+    def _lookup(self, key: Hashable) -> Tuple[Optional[List[str]], bool]:
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None, False
+        issues, fetched_at = entry
+        age = self.timer() - fetched_at
+        if age > self.max_age:
+            return None, False
+        return issues, age <= self.ttl
+
+    def get(self, key: Hashable, fetch: Callable[[], List[str]], deadline: Deadline) -> List[str]:
+        issues, fresh = self._lookup(key)
+        if issues is not None:
+            if not fresh:
+                self.refresh(key, fetch)
+            return issues
+        future = self.refresh(key, fetch)
+        try:
+            return future.result(timeout=deadline.remaining())
+        except concurrent.futures.TimeoutError:
+            raise DeadlineExceeded()
+
+    def get_many(self, fetches: Dict[Hashable, Tuple[Callable[[], List[str]], Deadline]]) -> Dict[Hashable, Any]:
+        # Несколько источников сразу: запросы к отсутствующим в кэше источникам запускаются параллельно,
+        # каждый ждём до своего срока. Вместо списка тикетов у источника может быть ошибка или DeadlineExceeded
+        results: Dict[Hashable, Any] = {}
+        pending = {}
+        for key, (fetch, _) in fetches.items():
+            issues, fresh = self._lookup(key)
+            if issues is not None:
+                if not fresh:
+                    self.refresh(key, fetch)
+                results[key] = issues
+            else:
+                pending[key] = self.refresh(key, fetch)
+        # Запросы уже идут одновременно, поэтому последовательное ожидание не дольше самого позднего срока
+        for key, future in pending.items():
+            try:
+                results[key] = future.result(timeout=fetches[key][1].remaining())
+            except concurrent.futures.TimeoutError:
+                results[key] = DeadlineExceeded()
+            except Exception as err:
+                results[key] = err
+        return results
+
+    def refresh(self, key: Hashable, fetch: Callable[[], List[str]]) -> concurrent.futures.Future:
+        # Одновременно для одного источника идёт не больше одного запроса
+        with self.lock:
+            if (future := self.refreshing.get(key)) is not None:
+                return future
+            future = executor().submit(fetch)
+            self.refreshing[key] = future
+
+        def store(done: concurrent.futures.Future):
+            with self.lock:
+                self.refreshing.pop(key, None)
+                if done.exception() is None:
+                    self.entries[key] = (done.result(), self.timer())
+            if done.exception() is not None:
+                logging.info('Failed to refresh issues for %r: %r', key, done.exception())
+        future.add_done_callback(store)
+        return future
+
+    def discard_issue(self, key: Hashable, prefix: str):
+        # Убирает закрытый тикет из закэшированного списка, не сбрасывая остальное
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                issues, fetched_at = entry
+                self.entries[key] = ([issue for issue in issues if not issue.startswith(prefix)], fetched_at)
+
+
+@functools.lru_cache
+def issue_cache() -> IssueListCache:
+    return IssueListCache(maxsize=int(os.getenv('ISSUE_CACHE_SIZE', '1024')),
+                          ttl=float(os.getenv('ISSUE_CACHE_TTL', '60')),
+                          max_age=float(os.getenv('ISSUE_CACHE_MAX_AGE', '3600')))
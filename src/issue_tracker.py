@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import List
 
 
 class IssueTracker(ABC):
@@ -10,3 +11,13 @@ class IssueTracker(ABC):
     @abstractmethod
     def close_issue(self, issue):
         pass
+
+    @abstractmethod
+    def issue_prefix(self, issue) -> str:
+        # С чего начинается строка тикета в выводе list_issues
+        pass
+
+    @abstractmethod
+    def team_members(self) -> List[str]:
+        # Имена участников репозитория или очереди в виде "Имя Фамилия"
+        pass
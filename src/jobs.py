@@ -0,0 +1,284 @@
+import functools
+import logging
+import os
+import random
+import select
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+import requests
+from cryptography.fernet import Fernet
+from yandex_tracker_client.exceptions import OutOfRetries, TrackerRequestError
+
+from github import GithubTracker
+from issue_cache import github_key, issue_cache, tracker_key
+from issue_tracker import IssueTracker
+from metrics import job_seconds
+from storage import connection_params
+from tracker import YandexTracker
+
+# Очередь фоновых задач в таблице jobs. Webhook только добавляет задачу (StorageConnection.enqueue_job)
+# и сразу отвечает, а задачу выполняет один из потоков JobRunner. Результат записывается в таблицу
+# и показывается пользователю в следующем ответе навыка
+
+CHANNEL = 'alice_jobs'
+PLACES = {'github': 'в гитхабе', 'tracker': 'в трекере'}
+
+logger = logging.getLogger('jobs')
+
+
+@functools.lru_cache
+def token_cipher() -> Optional[Fernet]:
+    # Токены в базе (токен трекера в jobs.args, токены установок гитхаба в github_tokens) хранятся
+    # зашифрованными ключом TOKEN_SEAL_KEY (Fernet.generate_key()), одинаковым у всех процессов навыка
+    key = os.getenv('TOKEN_SEAL_KEY')
+    return Fernet(key) if key else None
+
+
+def seal_token(token: str) -> Optional[str]:
+    cipher = token_cipher()
+    if cipher is None:
+        return None
+    return cipher.encrypt(token.encode()).decode()
+
+
+def open_token(sealed: str) -> str:
+    cipher = token_cipher()
+    if cipher is None:
+        raise RuntimeError('TOKEN_SEAL_KEY is not set')
+    return cipher.decrypt(sealed.encode()).decode()
+
+
+def tracker_client(args: Dict[str, Any]) -> IssueTracker:
+    if args['tracker'] == 'github':
+        return GithubTracker(args['username'], args['repo'], args['installation'])
+    return YandexTracker(open_token(args['sealed_token']), args['org'], args['queue'])
+
+
+def source_key(args: Dict[str, Any]) -> Tuple[str, ...]:
+    if args['tracker'] == 'github':
+        return github_key(args['username'], args['repo'], args['installation'])
+    return tracker_key(open_token(args['sealed_token']), args['org'], args['queue'])
+
+
+def close_issue(args: Dict[str, Any]) -> str:
+    client = tracker_client(args)
+    client.close_issue(args['issue'])
+    issue_cache().discard_issue(source_key(args), client.issue_prefix(args['issue']))
+    return f"Тикет {args['issue']} {PLACES[args['tracker']]} закрыт."
+
+
+# Вид задачи: функция, которая её выполняет и возвращает сообщение пользователю,
+# и сообщение на случай, если задача так и не выполнилась
+HANDLERS: Dict[str, Tuple[Callable[[Dict[str, Any]], str], str]] = {
+    'close_issue': (close_issue, 'Не удалось закрыть тикет {issue} {place}.'),
+}
+
+
+def status_code(err: Exception) -> Optional[int]:
+    # HTTP-статус ошибки гитхаба (requests.HTTPError) или трекера (TrackerServerError)
+    return getattr(err, 'status_code', None) or getattr(getattr(err, 'response', None), 'status_code', None)
+
+
+def retryable(err: Exception) -> bool:
+    # Повторяем сетевые ошибки, ответы 5xx и 429. Остальное (нет тикета, нет доступа) повтором не исправить
+    if isinstance(err, (requests.ConnectionError, requests.Timeout, TrackerRequestError, OutOfRetries)):
+        return True
+    status = status_code(err)
+    return status is not None and (status >= 500 or status == 429)
+
+
+def failure_message(kind: str, args: Dict[str, Any]) -> str:
+    # Задача неизвестного вида или без нужных аргументов всё равно должна получить результат
+    try:
+        return HANDLERS[kind][1].format(place=PLACES.get(args.get('tracker'), ''), **args)
+    except (KeyError, IndexError, ValueError, AttributeError):
+        return 'Не удалось выполнить фоновую задачу.'
+
+
+class JobRunner:
+    # workers потоков, у каждого своё соединение: задача выполняется без открытой транзакции,
+    # а соединения пула остаются обработчикам запросов. Поток забирает задачу с FOR UPDATE SKIP LOCKED,
+    # поэтому потоки и процессы не мешают друг другу. Новые задачи будят потоки через NOTIFY,
+    # отложенные повторы находятся опросом раз в poll_interval секунд
+    def __init__(self, workers: int, poll_interval: float, lease: float, max_attempts: int,
+                 backoff: float, max_backoff: float, keep_days: int = 7):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.keep_days = keep_days
+        self.stopped = threading.Event()
+        self.threads: List[threading.Thread] = []
+        self.last_prune = 0.0
+        self.prune_lock = threading.Lock()
+
+    def start(self):
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f'jobs-{idx}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        # Начатые задачи доделываются, новые не берутся
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def work(self):
+        conn = None
+        while not self.stopped.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = self.connect()
+                if not self.run_next(conn):
+                    self.prune(conn)
+                    self.wait(conn)
+            except psycopg2.Error as err:
+                logger.warning('Job worker database error: %r', err)
+                if conn is not None:
+                    conn.close()
+                self.stopped.wait(self.poll_interval)
+            except Exception:
+                # Поток не должен умирать из-за ошибки вне задачи (например, в select), иначе задачи
+                # перестанут выполняться без единого сообщения
+                logger.exception('Job worker failed')
+                if conn is not None:
+                    conn.close()
+                self.stopped.wait(self.poll_interval)
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def connect():
+        conn = psycopg2.connect(**connection_params())
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {CHANNEL}')
+        return conn
+
+    def wait(self, conn):
+        if select.select([conn], [], [], self.poll_interval)[0]:
+            conn.poll()
+            conn.notifies.clear()
+
+    def claim(self, conn) -> Optional[Tuple[int, str, Dict[str, Any], int]]:
+        with conn.cursor() as cur:
+            cur.execute("""UPDATE jobs SET state = 'running', attempts = attempts + 1,
+                                           run_at = now() + %s * interval '1 second'
+                           WHERE job_id = (SELECT job_id FROM jobs
+                                           WHERE state IN ('pending', 'running') AND run_at <= now()
+                                           ORDER BY run_at LIMIT 1 FOR UPDATE SKIP LOCKED)
+                           RETURNING job_id, kind, args, attempts""", (self.lease,))
+            return cur.fetchone()
+
+    def run_next(self, conn) -> bool:
+        job = self.claim(conn)
+        if job is None:
+            return False
+        job_id, kind, args, attempts = job
+        if attempts > self.max_attempts:
+            # Все попытки уже были, но поток с последней умер (OOM, SIGKILL) и не записал результат.
+            # Аренда истекла, и задача завершается ошибкой, а не выполняется снова
+            logger.warning('Job %d (%s) abandoned after %d attempts', job_id, kind, attempts - 1)
+            self.finish(conn, job_id, 'failed', failure_message(kind, args))
+            return True
+        try:
+            self.run(conn, job_id, kind, args, attempts)
+        except psycopg2.Error:
+            raise
+        except Exception:
+            # Ошибка не в самой задаче, а вокруг неё: без этого задача выполнялась бы снова после каждой аренды
+            logger.exception('Job %d (%s) crashed', job_id, kind)
+            self.finish(conn, job_id, 'failed', failure_message(kind, args))
+        return True
+
+    def run(self, conn, job_id: int, kind: str, args: Dict[str, Any], attempts: int):
+        start = time.perf_counter()
+        try:
+            result = HANDLERS[kind][0](args)
+        except Exception as err:
+            job_seconds.observe(time.perf_counter() - start, kind, 'error')
+            if retryable(err) and attempts < self.max_attempts:
+                delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff) * random.uniform(0.5, 1)
+                logger.info('Job %d (%s) failed, retry in %.1f s: %r', job_id, kind, delay, err)
+                self.retry(conn, job_id, delay)
+            else:
+                logger.warning('Job %d (%s) failed after %d attempts: %r', job_id, kind, attempts, err)
+                self.finish(conn, job_id, 'failed', failure_message(kind, args))
+            return
+        job_seconds.observe(time.perf_counter() - start, kind, 'done')
+        self.finish(conn, job_id, 'done', result)
+
+    @staticmethod
+    def retry(conn, job_id: int, delay: float):
+        with conn.cursor() as cur:
+            cur.execute("""UPDATE jobs SET state = 'pending', run_at = now() + %s * interval '1 second'
+                           WHERE job_id = %s""", (delay, job_id))
+
+    @staticmethod
+    def finish(conn, job_id: int, state: str, result: str):
+        # Версия стендапа растёт вместе с результатом: копия стендапа в памяти процессов (src/standup_state.py)
+        # устаревает, и следующий ход читает пользователя из базы вместе с этим результатом
+        with conn.cursor() as cur:
+            cur.execute("""WITH job AS (UPDATE jobs SET state = %s, result = %s, finished_at = now(),
+                                                         args = args - ARRAY['token', 'sealed_token']
+                                         WHERE job_id = %s RETURNING user_id)
+                           UPDATE users SET standup_version = standup_version + 1
+                           WHERE user_id = (SELECT user_id FROM job)""", (state, result, job_id))
+
+    def prune(self, conn):
+        # Показанные результаты старше keep_days удаляются, не чаще раза в час на процесс
+        with self.prune_lock:
+            if time.monotonic() - self.last_prune < 3600 and self.last_prune:
+                return
+            self.last_prune = time.monotonic()
+        with conn.cursor() as cur:
+            cur.execute("""DELETE FROM jobs WHERE reported AND finished_at < now() - %s * interval '1 day'""",
+                        (self.keep_days,))
+
+
+runner_lock = threading.Lock()
+
+
+def runner() -> JobRunner:
+    with runner_lock:
+        return create_runner()
+
+
+@functools.lru_cache
+def create_runner() -> JobRunner:
+    return JobRunner(workers=int(os.getenv('JOB_WORKERS', '2')),
+                     poll_interval=float(os.getenv('JOB_POLL_INTERVAL', '1')),
+                     lease=float(os.getenv('JOB_LEASE', '60')),
+                     max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', '5')),
+                     backoff=float(os.getenv('JOB_BACKOFF', '5')),
+                     max_backoff=float(os.getenv('JOB_MAX_BACKOFF', '300')))
+
+
+def start_runner():
+    runner().start()
+
+
+def stop_runner():
+    with runner_lock:
+        if create_runner.cache_info().currsize:
+            create_runner().stop(timeout=float(os.getenv('WEB_GRACEFUL_TIMEOUT', '10')))
+
+
+if __name__ == '__main__':
+    # Отдельный процесс только для фоновых задач, например когда у веб-процессов JOB_WORKERS=0
+    from dotenv import load_dotenv
+    from log import setup_logging
+    load_dotenv()
+    setup_logging()
+    start_runner()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stop_runner()
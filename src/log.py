@@ -0,0 +1,79 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from typing import Any, Dict, Optional
+
+# Поля записи, которые есть у любого LogRecord: всё остальное пришло через extra
+RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+def sampling_rates() -> Dict[str, float]:
+    # LOG_SAMPLING="webhook=0.1,github=0.01": доля записей уровня INFO и ниже, которая попадёт в лог.
+    # Категория - первая часть имени логгера, для корневого логгера - root
+    rates = {}
+    for item in os.getenv('LOG_SAMPLING', '').split(','):
+        if '=' in item:
+            category, rate = item.split('=', 1)
+            rates[category.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name.partition('.')[0], 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+                'level': record.levelname,
+                'logger': record.name,
+                'thread': record.threadName,
+                'message': record.getMessage()}
+        data.update((key, value) for key, value in vars(record).items() if key not in RECORD_FIELDS)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def truncate(value: Any, limit: Optional[int] = None) -> str:
+    # Большие значения (тела ответов, списки тикетов) обрезаются, чтобы не форматировать и не писать мегабайты
+    limit = limit or int(os.getenv('LOG_MAX_LENGTH', '500'))
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) <= limit:
+        return text
+    return f'{text[:limit]}...(+{len(text) - limit})'
+
+
+def setup_logging() -> Optional[logging.handlers.QueueListener]:
+    # Поток запроса только кладёт запись в очередь, форматирование в JSON и запись в stderr
+    # выполняет отдельный поток QueueListener. LOG_FORMAT=text оставляет обычный текстовый формат
+    root = logging.getLogger()
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    if any(isinstance(handler, logging.handlers.QueueHandler) for handler in root.handlers):
+        return None
+    output = logging.StreamHandler()
+    if os.getenv('LOG_FORMAT', 'json') == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(SamplingFilter(sampling_rates()))
+    root.addHandler(handler)
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
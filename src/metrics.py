@@ -0,0 +1,132 @@
+import bisect
+import contextlib
+import functools
+import hmac
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Метрики процесса в текстовом формате Prometheus. При запуске через gunicorn у каждого воркера свои значения
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry: List['Metric'] = []
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        pass
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield f'{self.name}{format_labels(self.labels, labels)} {value}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: число наблюдений в каждой корзине (последняя - +Inf) и их сумма
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        with self.lock:
+            counts, total = self.values.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def timed(self, *labels: str) -> Callable:
+        def decorator(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.time(*labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = [(labels, list(counts), total[0]) for labels, (counts, total) in self.values.items()]
+        bucket_labels = self.labels + ('le',)
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{format_labels(bucket_labels, labels + (le,))} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {total}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {cumulative}'
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+def authorized(authorization: Optional[str]) -> bool:
+    # /metrics отдаётся на том же порту, что и webhook Алисы, поэтому только с заголовком
+    # "Authorization: Bearer METRICS_TOKEN". Без METRICS_TOKEN метрики не отдаются вовсе
+    token = os.getenv('METRICS_TOKEN')
+    if not token or authorization is None:
+        return False
+    return hmac.compare_digest(authorization.encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+
+
+webhook_seconds = Histogram('alice_webhook_seconds', 'Webhook handling time')
+command_seconds = Histogram('alice_command_seconds', 'Dialog command handling time', ['handler'])
+storage_seconds = Histogram('alice_storage_query_seconds', 'Postgres statement time', ['statement'])
+pool_wait_seconds = Histogram('alice_pool_wait_seconds', 'Time spent waiting for a pooled connection')
+pool_timeouts = Counter('alice_pool_timeouts_total', 'Connection pool acquisitions that timed out')
+upstream_seconds = Histogram('alice_upstream_seconds', 'Issue tracker call time', ['tracker', 'operation'])
+github_responses = Counter('alice_github_responses_total', 'GitHub issue page responses by status', ['status'])
+job_seconds = Histogram('alice_job_seconds', 'Background job run time', ['kind', 'outcome'])
+history_events = Counter('alice_history_events_total', 'Standup history events by outcome', ['outcome'])
+standup_state_lookups = Counter('alice_standup_state_total', 'In-memory standup state hits and stale copies', ['outcome'])
+webhook_dedup = Counter('alice_webhook_dedup_total', 'Webhook requests by dedup outcome: hit, shared_hit, pending or miss', ['outcome'])
@@ -0,0 +1,94 @@
+import argparse
+import logging
+import os
+import re
+from typing import List, Tuple
+
+import psycopg2
+from dotenv import load_dotenv
+
+from storage import connection_params
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db', 'migrations')
+MIGRATION_RE = re.compile(r'^(\d+)_(\w+)\.sql$')
+# Один ключ advisory lock на все процессы, чтобы миграции не применялись параллельно
+MIGRATION_LOCK = 7203153
+
+
+def available_migrations() -> List[Tuple[int, str, str]]:
+    directory = os.getenv('MIGRATIONS_DIR', MIGRATIONS_DIR)
+    migrations = []
+    for filename in os.listdir(directory):
+        if match := MIGRATION_RE.match(filename):
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    return sorted(migrations)
+
+
+def applied_migrations(cur) -> List[int]:
+    cur.execute("""CREATE TABLE IF NOT EXISTS schema_migrations(
+                       version INTEGER PRIMARY KEY,
+                       name TEXT NOT NULL,
+                       applied_at TIMESTAMPTZ NOT NULL DEFAULT now())""")
+    cur.execute("""SELECT version FROM schema_migrations ORDER BY version""")
+    return [row[0] for row in cur.fetchall()]
+
+
+def migrate(conn) -> List[str]:
+    applied = []
+    with conn.cursor() as cur:
+        cur.execute("""SELECT pg_advisory_lock(%s)""", (MIGRATION_LOCK,))
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                done = set(applied_migrations(cur))
+        for version, name, path in available_migrations():
+            if version in done:
+                continue
+            with open(path, encoding='utf-8') as file:
+                sql = file.read()
+            # Каждая миграция в своей транзакции вместе с отметкой о применении
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                    cur.execute("""INSERT INTO schema_migrations(version, name) VALUES (%s, %s)""", (version, name))
+            logging.info('Applied migration %04d_%s', version, name)
+            applied.append(f'{version:04d}_{name}')
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("""SELECT pg_advisory_unlock(%s)""", (MIGRATION_LOCK,))
+        conn.commit()
+    return applied
+
+
+def migrate_on_start():
+    if os.getenv('MIGRATE_ON_START', '1') == '0':
+        return
+    conn = psycopg2.connect(**connection_params())
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Применяет миграции схемы из db/migrations')
+    parser.add_argument('--list', action='store_true', help='показать миграции и их состояние')
+    args = parser.parse_args()
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    conn = psycopg2.connect(**connection_params())
+    try:
+        if args.list:
+            with conn, conn.cursor() as cur:
+                done = set(applied_migrations(cur))
+            for version, name, _ in available_migrations():
+                print(f'{version:04d}_{name}: {"applied" if version in done else "pending"}')
+        else:
+            applied = migrate(conn)
+            print('Applied: ' + (', '.join(applied) if applied else 'nothing'))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
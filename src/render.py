@@ -0,0 +1,82 @@
+import functools
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+HELP_MESSAGE = 'Привет. Я могу помочь провести стендап.\n' \
+               'Команды доступные в обычном режиме:\n' \
+               '"Добавь в команду ИМЯ ФАМИЛИЯ" - так навык может запомнить участников команды. ' \
+               'Можно назвать сразу нескольких через запятую или "и".\n' \
+               '"Удали из команды ИМЯ ФАМИЛИЯ" - фраза, действие которой противоположно предыдущей.\n' \
+               '"Включи/выключи тишину" - выключает или включает проигрывание тишины во время стендапа.\n' \
+               '"Напомни команду" - посмотреть текущий состав команды.\n' \
+               '"Начни стендап" - Переходит в режим стендапа. Навык начнет по очереди предлагать участникам команды ' \
+               'рассказать о своём рабочем дне.\n' \
+               '"Помощь продолжение" - для остальных ключевых фраз.\n'
+
+HELP_NEXT = '"Авторизуй трекер" - навык предложит авторизоваться в Яндекс.трекере.\n' \
+            '"Запомни гитхаб LOGIN REPO INSTALLATION_ID" - передать навыку необходимую информацию о гитхабе. ' \
+            'Подробнее: LINK.\n' \
+            '"Запомни трекер ORG_ID QUEUE" - передать навыку необходимую информацию о трекере. ' \
+            'Подробнее: LINK.\n' \
+            '"Покажи тикеты трекер/гитхаб" - получить информацию об открытых тикетах в заданной системе.\n' \
+            '"Покажи все тикеты" - открытые тикеты сразу из всех подключённых систем.\n' \
+            '"Закрой тикет НОМЕР трекер/гитхаб" - закрыть тикет с номером НОМЕР в заданной системе.\n' \
+            '"Импортируй команду гитхаб/трекер" - добавить в команду участников репозитория или очереди.\n' \
+            '"Статистика стендапов" - сколько в среднем длятся стендапы и выступления, кто чаще пропускает.\n' \
+            '"Удали команду" - убирает всех людей из команды.\n' \
+            '"Помощь стендап" - покажет команды, доступные во время стендапа.'
+
+STANDUP_HELP = 'Режим стендапа:\n' \
+               '"У меня всё/я закончил" или другие вариации - завершает выступление текущего человека, очередь переходит к следующему.\n' \
+               '"Его/её сегодня нет" - выполняет ту же функцию, что и предыдущая фраза.\n' \
+               '"Продолжить" - если включено проигрывание тишины, то навык начнёт проигрывать её ещё раз.\n' \
+               '"Завершить стендап" - если возникает необходимость, то можно завершить стендап, не пройдя всю команду.\n' \
+               '"Запомни тему ТЕМА" - можно попросить навык запомнить небольшую тему, о которой он напомнит в конце стендапа.'
+
+TTS_END = 'если вы закончили , скажите " у меня всё " , иначе скажите " продолжить " '
+
+
+@functools.lru_cache
+def tts_suffix() -> str:
+    # Звук тишины и подсказка. Переменные окружения к первому запросу уже загружены
+    return os.getenv('TTS_FILENAME', '') + ' ' + TTS_END
+
+
+def display_name(first_name: str, last_name: Optional[str]) -> str:
+    # "Иван Петров" - так навык обращается к выступающему
+    name = first_name.capitalize()
+    if last_name:
+        name += ' ' + last_name.capitalize()
+    return name
+
+
+def roster_name(first_name: str, last_name: Optional[str]) -> str:
+    # "Петров Иван" - так команда перечисляется в "напомни команду"
+    return f'{(last_name or "").capitalize()} {first_name.capitalize()}'
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if not minutes:
+        return f'{seconds} с'
+    return f'{minutes} мин {seconds} с'
+
+
+def standup_report(totals: Optional[Tuple[int, float]], persons: List[Dict[str, Any]]) -> str:
+    if not totals and not persons:
+        return 'Истории стендапов пока нет'
+    lines = []
+    if totals:
+        standups, seconds = totals
+        lines.append(f'Проведено стендапов: {standups}, в среднем {format_duration(seconds / standups)}')
+    for person in persons:
+        spoken = person['turns'] - person['skips']
+        average = f"в среднем {format_duration(person['speaking_seconds'] / spoken)}" if spoken \
+            else 'выступлений не было'
+        lines.append(f"{roster_name(person['first_name'], person['last_name']).strip()}: {average}, "
+                     f"пропусков {person['skips']} из {person['turns']}")
+    return '.\n'.join(lines)
+
+
+def roster_text(team: List[Dict[str, Any]]) -> str:
+    return 'Твоя команда: ' + ', '.join(roster_name(p['first_name'], p.get('last_name')) for p in team)
@@ -1,4 +1,4 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
 
 class Request:
@@ -21,7 +21,14 @@ class Request:
         return self._req['request']['command']
 
     def original_utterance(self) -> str:
-        return self._req['request']['original_utterance']
+        return self._req['request'].get('original_utterance', '')
+
+    def message_key(self) -> Optional[Tuple[str, int]]:
+        # Повтор запроса приходит с теми же session_id и message_id (src/idempotency.py)
+        session = self._req['session']
+        if session.get('session_id') is None or session.get('message_id') is None:
+            return None
+        return session['session_id'], session['message_id']
 
     def is_authorized(self) -> bool:
         return 'user' in self._req['session']
@@ -0,0 +1,114 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Handler = Callable[..., None]
+
+
+class PrefixTrie:
+    # Trie по словам: команда разбивается на слова один раз, дальше спуск по словарям.
+    # Префикс с пробелом на конце совпадает, только если после него есть ещё слова
+    def __init__(self):
+        self.root: Dict[Optional[str], Any] = {}
+
+    def add(self, prefix: str, value):
+        node = self.root
+        for word in prefix.split():
+            node = node.setdefault(word, {})
+        node[None] = (value, prefix.endswith(' '))
+
+    def longest_prefix(self, text: str) -> Optional[Tuple[Any, str]]:
+        # Возвращает значение самого длинного зарегистрированного префикса и остаток строки после него
+        node = self.root
+        if text.partition(' ')[0] not in node:
+            return None
+        words = text.split(' ')
+        found = None
+        for idx, word in enumerate(words, 1):
+            node = node.get(word)
+            if node is None:
+                break
+            if None in node:
+                value, needs_more = node[None]
+                if not needs_more or idx < len(words):
+                    found = (value, idx)
+        if found is None:
+            return None
+        value, length = found
+        return value, ' '.join(words[length:])
+
+
+class Router:
+    # Сопоставляет команду с обработчиком. Порядок проверки: точное совпадение фразы,
+    # самый длинный префикс, регулярные выражения (одним скомпилированным выражением) и интенты.
+    # С intents_first интенты проверяются до текста: распознанный Алисой интент важнее случайного
+    # совпадения фразы. Обработчик вызывается как handler(dialog, req, arg), где arg - остаток
+    # команды после префикса, re.Match для регулярного выражения или слоты интента.
+    def __init__(self, intents_first: bool = False):
+        self.intents_first = intents_first
+        self.exact_phrases: Dict[str, Handler] = {}
+        self.prefixes = PrefixTrie()
+        self.patterns: List[Tuple[str, Handler]] = []
+        self.pattern_handlers: Dict[str, Handler] = {}
+        self.intents: List[Tuple[str, Handler]] = []
+        self.routes: List[Tuple[str, str, Handler]] = []  # в порядке объявления, для отладки и бенчмарков
+        self.compiled: Optional[re.Pattern] = None
+
+    def exact(self, *phrases: str):
+        def register(handler: Handler) -> Handler:
+            for phrase in phrases:
+                self.exact_phrases[phrase] = handler
+                self.routes.append(('exact', phrase, handler))
+            return handler
+        return register
+
+    def prefix(self, *prefixes: str):
+        def register(handler: Handler) -> Handler:
+            for prefix in prefixes:
+                self.prefixes.add(prefix, handler)
+                self.routes.append(('prefix', prefix, handler))
+            return handler
+        return register
+
+    def regex(self, pattern: str):
+        def register(handler: Handler) -> Handler:
+            self.pattern_handlers[f'_route{len(self.patterns)}'] = handler
+            self.patterns.append((pattern, handler))
+            self.routes.append(('regex', pattern, handler))
+            self.compiled = None
+            return handler
+        return register
+
+    def intent(self, name: str):
+        def register(handler: Handler) -> Handler:
+            self.intents.append((name, handler))
+            self.routes.append(('intent', name, handler))
+            return handler
+        return register
+
+    def _compile(self) -> re.Pattern:
+        # Все выражения в одном: каждое в своей именованной группе, по lastgroup понятно, какое совпало.
+        # Именованные группы внутри выражений должны быть уникальны в пределах роутера
+        self.compiled = re.compile('|'.join(f'(?P<_route{idx}>{pattern})'
+                                            for idx, (pattern, _) in enumerate(self.patterns)))
+        return self.compiled
+
+    def match(self, command: str, intents: Dict[str, Any]) -> Optional[Tuple[Handler, Any]]:
+        if self.intents_first and (found := self._match_intent(intents)):
+            return found
+        if handler := self.exact_phrases.get(command):
+            return handler, None
+        if found := self.prefixes.longest_prefix(command):
+            return found
+        if self.patterns:
+            compiled = self.compiled or self._compile()
+            if match := compiled.match(command):
+                return self.pattern_handlers[match.lastgroup], match
+        if not self.intents_first:
+            return self._match_intent(intents)
+        return None
+
+    def _match_intent(self, intents: Dict[str, Any]) -> Optional[Tuple[Handler, Any]]:
+        for name, handler in self.intents:
+            if name in intents:
+                return handler, intents[name]
+        return None
@@ -0,0 +1,68 @@
+import copy
+import functools
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from metrics import standup_state_lookups
+from user import User
+
+# Состояние идущих стендапов в памяти процесса: пользователь и команда такими, какими их оставил
+# последний закоммиченный запрос. Ход стендапа ("у меня всё", "его нет") обслуживается из этой копии
+# без чтения из базы, а изменения по-прежнему пишутся в users и persons в той же транзакции.
+#
+# Источник истины - Postgres. Любое изменение стендапа увеличивает users.standup_version, и запрос,
+# обслуженный из памяти, пишет в базу только при совпадении версии (UPDATE ... WHERE standup_version = N),
+# а запрос без записей сверяет версию перед коммитом. Если стендап успел изменить другой воркер
+# или другой сервер, транзакция откатывается, копия удаляется и запрос выполняется заново по данным
+# из базы. Поэтому несколько воркеров не расходятся, а только чаще промахиваются мимо памяти.
+
+
+class StaleStandupState(Exception):
+    pass
+
+
+def snapshot(user: User, team: List[Dict[str, Any]]) -> Tuple[User, List[Dict[str, Any]]]:
+    # Запрос меняет свой снимок, а в памяти должно остаться только закоммиченное состояние
+    user = copy.copy(user)
+    user.speaker_queue = list(user.speaker_queue)
+    user.job_reports = list(user.job_reports)
+    return user, [dict(person) for person in team]
+
+
+class StandupStateCache:
+    def __init__(self, maxsize: int):
+        self.entries: Optional[LRUCache] = LRUCache(maxsize=maxsize) if maxsize > 0 else None
+        self.lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[Tuple[User, List[Dict[str, Any]]]]:
+        if self.entries is None:
+            return None
+        with self.lock:
+            cached = self.entries.get(user_id)
+        if cached is None:
+            return None
+        standup_state_lookups.inc('hit')
+        return snapshot(*cached)
+
+    def put(self, user: User, team: List[Dict[str, Any]]):
+        if self.entries is None:
+            return
+        cached = snapshot(user, team)
+        with self.lock:
+            self.entries[user.id] = cached
+
+    def discard(self, user_id: str, stale: bool = False):
+        if self.entries is None:
+            return
+        if stale:
+            standup_state_lookups.inc('stale')
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+@functools.lru_cache
+def standup_state() -> StandupStateCache:
+    return StandupStateCache(maxsize=int(os.getenv('STANDUP_STATE_CACHE_SIZE', '10000')))
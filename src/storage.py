@@ -1,166 +1,654 @@
+import datetime
 import functools
+import logging
 import os
-from typing import Dict, List, Optional
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import psycopg2
+import psycopg2.errors
 import psycopg2.extensions
 import psycopg2.pool
+from cryptography.fernet import InvalidToken
+from psycopg2.extras import Json
 
+from idempotency import ReplayedRequest, ResponsePending, dedup_ttl
+from metrics import pool_timeouts, pool_wait_seconds, storage_seconds
+from standup_state import StandupStateCache
+from unit_of_work import UnitOfWork
 from user import User
 
 
+# Все запросы навыка. Они готовятся на сервере один раз на соединение (PREPARE)
+# и дальше выполняются по имени, поэтому параметры записаны как $1, $2, ...
+STATEMENTS = {
+    # Очередь выступающих фиксируется в момент начала стендапа,
+    # дальше продвижение по ней - один UPDATE без чтения всей команды
+    'start_standup': """UPDATE users SET standup_held = TRUE, cur_speaker = 0, speaker_queue = ARRAY(
+                            SELECT person_id FROM persons WHERE standup_organizer = $1 ORDER BY person_id ASC),
+                            standup_started_at = $2, speaker_started_at = NULL,
+                            standup_version = standup_version + 1
+                        WHERE user_id = $1""",
+    'modify_silence': """UPDATE users SET silence_enabled = $2 WHERE user_id=$1""",
+    'reset_user': """UPDATE users SET standup_held = FALSE, cur_speaker = 0, speaker_queue = NULL,
+                                     standup_started_at = NULL, speaker_started_at = NULL,
+                                     standup_version = standup_version + 1
+                     WHERE user_id=$1""",
+    'reset_themes': """UPDATE persons SET last_theme = NULL WHERE standup_organizer = $1""",
+    'check_standup': """SELECT standup_held FROM users WHERE user_id = $1""",
+    'create_user': """INSERT INTO users(user_id, standup_held, cur_speaker, silence_enabled) VALUES($1, False, 0, True)""",
+    'get_user': """SELECT user_id, standup_held, cur_speaker, github_login, repo, installation_id, tracker_org,
+                          tracker_queue, silence_enabled, speaker_queue, standup_started_at, speaker_started_at,
+                          standup_version
+                   FROM users WHERE user_id = $1""",
+    # Пользователь и вся его команда одним запросом
+    'load_user_state': """SELECT u.user_id, u.standup_held, u.cur_speaker, u.github_login, u.repo, u.installation_id,
+                                 u.tracker_org, u.tracker_queue, u.silence_enabled, u.speaker_queue,
+                                 (SELECT json_agg(json_build_object('job_id', j.job_id, 'result', j.result)
+                                                  ORDER BY j.job_id)
+                                  FROM jobs j WHERE j.user_id = u.user_id AND j.state IN ('done', 'failed')
+                                                    AND NOT j.reported),
+                                 u.standup_started_at, u.speaker_started_at, u.standup_version,
+                                 COALESCE(json_agg(json_build_object('person_id', p.person_id,
+                                                                     'first_name', p.first_name,
+                                                                     'last_name', p.last_name,
+                                                                     'theme', p.last_theme)
+                                                   ORDER BY p.person_id) FILTER (WHERE p.person_id IS NOT NULL),
+                                          '[]')
+                          FROM users u LEFT JOIN persons p ON p.standup_organizer = u.user_id
+                          WHERE u.user_id = $1
+                          GROUP BY u.user_id""",
+    'add_team_member': """INSERT INTO persons(first_name, last_name, standup_organizer) VALUES ($2, $3, $1)""",
+    'add_team_member_first_name': """INSERT INTO persons(first_name, standup_organizer) VALUES ($2, $1)""",
+    # Несколько человек одним INSERT: имена и фамилии приходят двумя массивами одинаковой длины
+    'add_team_members': """INSERT INTO persons(first_name, last_name, standup_organizer)
+                           SELECT t.first_name, t.last_name, $1
+                           FROM unnest($2::text[], $3::text[]) WITH ORDINALITY AS t(first_name, last_name, idx)
+                           ORDER BY t.idx""",
+    # То же, но без людей, которые уже есть в команде. Возвращает только добавленных
+    'import_team_members': """INSERT INTO persons(first_name, last_name, standup_organizer)
+                              SELECT t.first_name, t.last_name, $1
+                              FROM unnest($2::text[], $3::text[]) WITH ORDINALITY AS t(first_name, last_name, idx)
+                              WHERE NOT EXISTS (SELECT 1 FROM persons p
+                                                WHERE p.standup_organizer = $1 AND p.first_name = t.first_name
+                                                      AND p.last_name IS NOT DISTINCT FROM t.last_name)
+                              ORDER BY t.idx
+                              RETURNING person_id, first_name, last_name""",
+    'del_team_member': """DELETE FROM persons WHERE (first_name=$2 AND last_name=$3 AND standup_organizer=$1)
+                          RETURNING person_id""",
+    'del_team_member_first_name': """DELETE FROM persons WHERE (first_name=$2 AND last_name IS NULL AND standup_organizer=$1)
+                                     RETURNING person_id""",
+    # В порядке добавления, так же команда перечисляется в "напомни команду" и в очереди выступающих
+    'get_team': """SELECT person_id, first_name, last_name FROM persons WHERE standup_organizer=$1
+                   ORDER BY person_id""",
+    # Атомарно сдвигаем очередь и сразу получаем следующего выступающего
+    'call_next_speaker': """WITH advanced AS (
+                                UPDATE users SET cur_speaker = cur_speaker + 1, speaker_started_at = $2,
+                                                 standup_version = standup_version + 1
+                                WHERE user_id = $1
+                                RETURNING cur_speaker, cardinality(speaker_queue) AS queue_len,
+                                          speaker_queue[cur_speaker] AS person_id, standup_version)
+                            SELECT a.cur_speaker, a.queue_len, p.person_id, p.first_name, p.last_name, a.standup_version
+                            FROM advanced a LEFT JOIN persons p ON p.person_id = a.person_id""",
+    'set_theme_for_current_speaker': """WITH speaker AS (
+                                            UPDATE users SET standup_version = standup_version + 1 WHERE user_id = $1
+                                            RETURNING speaker_queue[cur_speaker] AS person_id)
+                                        UPDATE persons SET last_theme = $2
+                                        WHERE person_id = (SELECT person_id FROM speaker)""",
+    # Записи стендапа, который процесс ведёт по состоянию в памяти (src/standup_state.py): применяются,
+    # только если с тех пор стендап никто не менял, то есть standup_version в базе равна $N
+    'advance_speaker': """UPDATE users SET cur_speaker = $2, speaker_started_at = $3,
+                                          standup_version = standup_version + 1
+                          WHERE user_id = $1 AND standup_version = $4""",
+    'set_theme_checked': """WITH speaker AS (
+                                UPDATE users SET standup_version = standup_version + 1
+                                WHERE user_id = $1 AND standup_version = $3
+                                RETURNING speaker_queue[cur_speaker] AS person_id),
+                            theme AS (UPDATE persons SET last_theme = $2 WHERE person_id = (SELECT person_id FROM speaker))
+                            SELECT count(*) FROM speaker""",
+    'reset_user_checked': """UPDATE users SET standup_held = FALSE, cur_speaker = 0, speaker_queue = NULL,
+                                              standup_started_at = NULL, speaker_started_at = NULL,
+                                              standup_version = standup_version + 1
+                             WHERE user_id = $1 AND standup_version = $2""",
+    'get_standup_version': """SELECT standup_version FROM users WHERE user_id = $1""",
+    'get_team_themes': """SELECT person_id, first_name, last_name, last_theme FROM persons
+                          WHERE standup_organizer = $1 ORDER BY person_id""",
+    'get_github_info': """SELECT github_login, repo, installation_id FROM users WHERE user_id=$1""",
+    'get_tracker_info': """SELECT tracker_org, tracker_queue FROM users WHERE user_id=$1""",
+    'register_github': """UPDATE users SET github_login=$2, repo=$3, installation_id=$4 WHERE user_id=$1""",
+    'register_tracker': """UPDATE users SET tracker_org=$2, tracker_queue=$3 WHERE user_id=$1""",
+    'clean_team': """DELETE FROM persons WHERE standup_organizer = $1""",
+    # Задача для src/jobs.py. NOTIFY доставляется при коммите, тогда же задача становится видна потокам
+    'enqueue_job': """WITH job AS (INSERT INTO jobs(user_id, kind, args) VALUES ($1, $2, $3::jsonb) RETURNING job_id)
+                      SELECT pg_notify('alice_jobs', job_id::text) FROM job""",
+    # Отчёт по стендапам читает только агрегаты истории (src/history.py)
+    'get_standup_totals': """SELECT standups, standup_seconds FROM standup_stats WHERE user_id = $1""",
+    'get_person_stats': """SELECT p.first_name, p.last_name, s.turns, s.skips, s.speaking_seconds
+                           FROM person_stats s JOIN persons p ON p.person_id = s.person_id
+                           WHERE s.user_id = $1 ORDER BY p.person_id""",
+    # Ответ на запрос Алисы для повторов (src/idempotency.py). Строка вставляется в начале транзакции запроса,
+    # конкурирующий повтор ждёт на уникальном индексе, пока она не закоммитится, и получает ошибку уникальности
+    'claim_response': """INSERT INTO webhook_responses(session_id, message_id) VALUES ($1, $2)""",
+    # Ожидание на уникальном индексе ограничено оставшимся бюджетом ответа только для этой вставки
+    'set_lock_timeout': """SELECT set_config('lock_timeout', $1, true)""",
+    'reset_lock_timeout': """SELECT set_config('lock_timeout', reset_val, true) FROM pg_settings
+                            WHERE name = 'lock_timeout'""",
+    'get_response': """SELECT response FROM webhook_responses WHERE session_id = $1 AND message_id = $2""",
+    'store_response': """UPDATE webhook_responses SET response = $3::jsonb WHERE session_id = $1 AND message_id = $2""",
+    'mark_jobs_reported': """UPDATE jobs SET reported = TRUE WHERE user_id = $1 AND job_id = ANY($2::bigint[])""",
+}
+# Те же запросы для выполнения без подготовки, например за pgbouncer в режиме транзакций
+PLAIN_STATEMENTS = {name: re.sub(r'\$(\d+)', r'%(\1)s', query) for name, query in STATEMENTS.items()}
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        self.connection.query_count += 1
+        return super().execute(query, vars)
+
+
 class StorageConnection(psycopg2.extensions.connection):
-    def start_standup(self, user_id: str):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = CountingCursor
+        self.query_count = 0
+        # Если batch не None, то запросы без результата откладываются и отправляются одним запросом
+        self.batch: Optional[List[Tuple[str, Tuple]]] = None
+        self.prepare_statements = os.getenv('PG_PREPARE', '1') == '1'
+        self.prepared = set()
+        self.prepared_backend = None
+        self.share_responses = os.getenv('WEBHOOK_DEDUP_STORE', 'postgres') == 'postgres'
+
+    def _prepare(self, cur, names):
+        # Подготовленные запросы живут в серверном процессе. Если соединение переподключилось
+        # к другому процессу, то готовим их заново
+        backend = self.get_backend_pid()
+        if backend != self.prepared_backend:
+            self.prepared = set()
+            self.prepared_backend = backend
+        for name in names:
+            if name not in self.prepared:
+                cur.execute(f'PREPARE alice_{name} AS {STATEMENTS[name]}')
+                self.prepared.add(name)
+
+    def _statement(self, name: str, params: Tuple):
+        if not self.prepare_statements:
+            return PLAIN_STATEMENTS[name], {str(i): param for i, param in enumerate(params, 1)}
+        if not params:
+            return f'EXECUTE alice_{name}', None
+        return f'EXECUTE alice_{name}({", ".join(["%s"] * len(params))})', params
+
+    def _send(self, cur, label: str, statements: List[Tuple[str, Tuple]]):
+        if self.prepare_statements:
+            self._prepare(cur, [name for name, _ in statements])
+        try:
+            with storage_seconds.time(label):
+                if len(statements) == 1:
+                    cur.execute(*self._statement(*statements[0]))
+                else:
+                    cur.execute(b';'.join(cur.mogrify(*self._statement(name, params)) for name, params in statements))
+        except psycopg2.errors.UniqueViolation as err:
+            if err.diag.constraint_name == 'webhook_responses_pkey':
+                raise ReplayedRequest(err.diag.message_detail) from err
+            raise
+        except psycopg2.errors.LockNotAvailable as err:
+            # lock_timeout задаётся только вокруг claim_response
+            if any(name == 'claim_response' for name, _ in statements):
+                raise ResponsePending(err.diag.message_primary) from err
+            raise
+
+    def _execute(self, cur, name: str, params: Tuple):
+        # Любое чтение должно видеть отложенные записи, поэтому они уходят в базу тем же запросом,
+        # что и чтение. Результат и rowcount у курсора - от последнего запроса, то есть от чтения
+        batch, self.batch = self.batch or [], None if self.batch is None else []
+        self._send(cur, name, batch + [(name, params)])
+
+    def begin_batch(self):
+        if self.batch is None:
+            self.batch = []
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
         with self.cursor() as cur:
-            cur.execute("""UPDATE users SET standup_held = TRUE WHERE user_id=%s""", (user_id,))
+            self._send(cur, 'batch', batch)
 
-    def modify_silence(self, user_id: str, value: bool):
+    def _write(self, name: str, params: Tuple):
+        if self.batch is not None:
+            self.batch.append((name, params))
+            return
         with self.cursor() as cur:
-            cur.execute("""UPDATE users SET silence_enabled = %s WHERE user_id=%s""", (value, user_id))
+            self._execute(cur, name, params)
+
+    def start_standup(self, user_id: str, started_at: datetime.datetime):
+        self._write('start_standup', (user_id, started_at))
+
+    def modify_silence(self, user_id: str, value: bool):
+        self._write('modify_silence', (user_id, value))
 
     def reset_user(self, user_id: str):
-        with self.cursor() as cur:
-            cur.execute("""UPDATE users SET standup_held = FALSE, cur_speaker = 0 WHERE user_id=%s""", (user_id,))
-        with self.cursor() as cur:
-            cur.execute("""UPDATE persons SET last_theme = NULL WHERE standup_organizer = %s""", (user_id,))
+        self._write('reset_user', (user_id,))
+        self._write('reset_themes', (user_id,))
 
     def check_standup(self, user_id: str) -> bool:
         with self.cursor() as cur:
-            cur.execute("""SELECT standup_held FROM users WHERE user_id = %s""", (user_id,))
+            self._execute(cur, 'check_standup', (user_id,))
             result = cur.fetchone()
             if not result:
                 return False
             return result[0]
 
     def create_user(self, user_id: str):
-        with self.cursor() as cur:
-            cur.execute("""INSERT INTO users(user_id, standup_held, cur_speaker, silence_enabled) VALUES(%s, False, 0, True)""", (user_id,))
+        self._write('create_user', (user_id,))
 
     def get_user(self, user_id: str) -> Optional[User]:
         with self.cursor() as cur:
-            cur.execute("""SELECT * FROM users where user_id = %s""", (user_id,))
+            self._execute(cur, 'get_user', (user_id,))
             result = cur.fetchone()
             if not result:
                 return None
             else:
-                return User(*result)
+                return User(*result[:-3], standup_started_at=result[-3], speaker_started_at=result[-2],
+                            standup_version=result[-1])
+
+    def load_user_state(self, user_id: str) -> Tuple[Optional[User], List[Dict[str, Any]]]:
+        with self.cursor() as cur:
+            self._execute(cur, 'load_user_state', (user_id,))
+            result = cur.fetchone()
+            if not result:
+                return None, []
+            return User(*result[:-1]), result[-1]
 
     def add_team_member(self, user_id: str, person: Dict[str, str]):
+        if 'last_name' in person:
+            self._write('add_team_member', (user_id, person['first_name'], person['last_name']))
+        else:
+            self._write('add_team_member_first_name', (user_id, person['first_name']))
+
+    def add_team_members(self, user_id: str, persons: List[Dict[str, str]]):
+        self._write('add_team_members', (user_id, [p['first_name'] for p in persons],
+                                         [p.get('last_name') for p in persons]))
+
+    def import_team_members(self, user_id: str, persons: List[Dict[str, str]]) -> List[Dict[str, Any]]:
         with self.cursor() as cur:
-            if 'last_name' in person:
-                cur.execute("""INSERT INTO persons(first_name, last_name, standup_organizer) VALUES (%s, %s, %s)""",
-                            (person['first_name'], person['last_name'], user_id))
-            else:
-                cur.execute("""INSERT INTO persons(first_name, standup_organizer) VALUES (%s, %s)""",
-                            (person['first_name'], user_id))
+            self._execute(cur, 'import_team_members', (user_id, [p['first_name'] for p in persons],
+                                                       [p.get('last_name') for p in persons]))
+            return [{'person_id': person_id, 'first_name': first_name, 'last_name': last_name}
+                    for person_id, first_name, last_name in cur.fetchall()]
 
     def del_team_member(self, user_id: str, person: Dict[str, str]):
         with self.cursor() as cur:
             if 'last_name' in person:
-                cur.execute("""DELETE FROM persons WHERE (first_name=%s AND last_name=%s AND standup_organizer=%s) RETURNING *""",
-                            (person['first_name'], person['last_name'], user_id))
+                self._execute(cur, 'del_team_member', (user_id, person['first_name'], person['last_name']))
             else:
-                cur.execute("""DELETE FROM persons WHERE (first_name=%s AND last_name IS NULL AND standup_organizer=%s) RETURNING *""",
-                            (person['first_name'], user_id))
+                self._execute(cur, 'del_team_member_first_name', (user_id, person['first_name']))
             return cur.fetchone() is not None
 
     def get_team(self, user_id: str) -> List[Dict[str, str]]:
         with self.cursor() as cur:
-            # Здесь порядок не очень важен, поэтому без ORDER BY
-            cur.execute(
-                """SELECT first_name, last_name FROM persons WHERE standup_organizer=%s""",
-                (user_id,))
+            self._execute(cur, 'get_team', (user_id,))
             persons = cur.fetchall()
             result = []
             for person in persons:
-                result.append({'first_name': person[0], 'last_name': person[1] or ''})
+                result.append({'person_id': person[0], 'first_name': person[1], 'last_name': person[2] or ''})
             return result
 
-    def get_team_member(self, user_id: str, member_idx: int) -> Dict[str, str]:
-        with self.cursor() as cur:
-            cur.execute(
-                """SELECT first_name, last_name FROM persons WHERE standup_organizer=%s ORDER BY person_id ASC""",
-                (user_id,))
-            persons = cur.fetchall()
-            return {'first_name': persons[member_idx][0], 'last_name': persons[member_idx][1] or ''}
+    def call_next_speaker(self, user_id: str, started_at: datetime.datetime) -> Dict[str, Any]:
+        while True:
+            with self.cursor() as cur:
+                self._execute(cur, 'call_next_speaker', (user_id, started_at))
+                speaker_num, queue_len, person_id, first_name, last_name, version = cur.fetchone()
+            if speaker_num > (queue_len or 0):
+                # This throws IndexError so we can end the standup
+                raise IndexError('speaker queue is exhausted')
+            if person_id is not None:
+                return {'person_id': person_id, 'first_name': first_name, 'last_name': last_name or '',
+                        'position': speaker_num, 'version': version}
+            # Человека удалили из команды во время стендапа - переходим к следующему
 
-    def call_next_speaker(self, user_id: str) -> Dict[str, str]:
+    def set_theme_for_current_speaker(self, user_id: str, theme: str):
+        self._write('set_theme_for_current_speaker', (user_id, theme))
+
+    # Варианты записей для стендапа, который ведётся по состоянию в памяти. Выполняются сразу, а не
+    # в пакете: False значит, что стендап успел изменить другой процесс и ничего не записано
+    def advance_speaker(self, user_id: str, position: int, started_at: datetime.datetime, version: int) -> bool:
         with self.cursor() as cur:
-            cur.execute("""SELECT cur_speaker FROM users where user_id = %s""", (user_id,))
-            speaker_num = cur.fetchone()[0]
-            # This throws IndexError so we can end the standup
-        next_speaker = self.get_team_member(user_id, speaker_num)
+            self._execute(cur, 'advance_speaker', (user_id, position, started_at, version))
+            return cur.rowcount == 1
+
+    def set_theme_checked(self, user_id: str, theme: str, version: int) -> bool:
         with self.cursor() as cur:
-            cur.execute("""UPDATE users SET cur_speaker = cur_speaker + 1 WHERE user_id = %s""", (user_id,))
-        return next_speaker
+            self._execute(cur, 'set_theme_checked', (user_id, theme, version))
+            return cur.fetchone()[0] == 1
 
-    def set_theme_for_current_speaker(self, user_id: str, theme: str):
+    def reset_user_checked(self, user_id: str, version: int) -> bool:
         with self.cursor() as cur:
-            cur.execute("""SELECT cur_speaker FROM users where user_id = %s""", (user_id,))
-            speaker_num = cur.fetchone()[0]
-        speaker = self.get_team_member(user_id, speaker_num - 1)
+            self._execute(cur, 'reset_user_checked', (user_id, version))
+            if cur.rowcount != 1:
+                return False
+        self._write('reset_themes', (user_id,))
+        return True
+
+    def get_standup_version(self, user_id: str) -> Optional[int]:
         with self.cursor() as cur:
-            if not speaker['last_name']:
-                cur.execute("""UPDATE persons SET last_theme = %s WHERE standup_organizer = %s AND first_name = %s AND last_name IS NULL""",
-                            (theme, user_id, speaker['first_name']))
-            else:
-                cur.execute("""UPDATE persons SET last_theme = %s WHERE standup_organizer = %s AND first_name = %s AND last_name = %s""",
-                            (theme, user_id, speaker['first_name'], speaker['last_name']))
+            self._execute(cur, 'get_standup_version', (user_id,))
+            result = cur.fetchone()
+            return result[0] if result else None
 
     def get_team_themes(self, user_id: str) -> List[Dict[str, str]]:
         with self.cursor() as cur:
-            cur.execute("""SELECT first_name, last_name, last_theme FROM persons WHERE standup_organizer = %s""",
-                        (user_id,))
+            self._execute(cur, 'get_team_themes', (user_id,))
             themes = cur.fetchall()
             result = []
             for theme in themes:
-                result.append({'first_name': theme[0], 'last_name': theme[1], 'theme': theme[2]})
+                result.append({'person_id': theme[0], 'first_name': theme[1], 'last_name': theme[2],
+                               'theme': theme[3]})
             return result
 
     def get_github_info(self, user_id: str):
         with self.cursor() as cur:
-            cur.execute("""SELECT github_login, repo, installation_id FROM users WHERE user_id=%s""", (user_id,))
+            self._execute(cur, 'get_github_info', (user_id,))
             data = cur.fetchone()
             return data
 
     def get_tracker_info(self, user_id: str):
         with self.cursor() as cur:
-            cur.execute("""SELECT tracker_org, tracker_queue FROM users WHERE user_id=%s""", (user_id,))
+            self._execute(cur, 'get_tracker_info', (user_id,))
             data = cur.fetchone()
             return data
 
     def register_github(self, user_id: str, name: str, repo: str, installation_id: str):
-        with self.cursor() as cur:
-            cur.execute("""UPDATE users SET github_login=%s, repo=%s, installation_id=%s WHERE user_id=%s""",
-                        (name, repo, installation_id, user_id))
+        self._write('register_github', (user_id, name, repo, installation_id))
 
     def register_tracker(self, user_id: str, org: str, queue: str):
-        with self.cursor() as cur:
-            cur.execute("""UPDATE users SET tracker_org=%s, tracker_queue=%s WHERE user_id=%s""",
-                        (org, queue, user_id))
+        self._write('register_tracker', (user_id, org, queue))
 
     def clean_team(self, user_id: str):
+        self._write('clean_team', (user_id,))
+
+    def get_standup_report(self, user_id: str) -> Tuple[Optional[Tuple[int, float]], List[Dict[str, Any]]]:
+        with self.cursor() as cur:
+            self._execute(cur, 'get_standup_totals', (user_id,))
+            totals = cur.fetchone()
+            self._execute(cur, 'get_person_stats', (user_id,))
+            persons = [{'first_name': first_name, 'last_name': last_name, 'turns': turns, 'skips': skips,
+                        'speaking_seconds': seconds} for first_name, last_name, turns, skips, seconds in cur.fetchall()]
+        return totals, persons
+
+    def enqueue_job(self, user_id: str, kind: str, args: Dict[str, Any]):
+        self._write('enqueue_job', (user_id, kind, Json(args)))
+
+    def mark_jobs_reported(self, user_id: str, job_ids: List[int]):
+        self._write('mark_jobs_reported', (user_id, job_ids))
+
+    def claim_response(self, session_id: str, message_id: int, timeout: Optional[float] = None):
+        # Закрепляет запрос за этой транзакцией. Вставка уходит в базу вместе с первым чтением, и если
+        # запрос уже обработан, то это чтение бросит ReplayedRequest, а транзакция откатится.
+        # Если первый запрос не закоммитится за timeout секунд, бросается ResponsePending
+        if not self.share_responses:
+            return
+        if timeout is None:
+            self._write('claim_response', (session_id, message_id))
+            return
+        # lock_timeout = 0 в Postgres - ждать без ограничения
+        self._write('set_lock_timeout', (f'{max(int(timeout * 1000), 1)}ms',))
+        self._write('claim_response', (session_id, message_id))
+        self._write('reset_lock_timeout', ())
+
+    def get_response(self, session_id: str, message_id: int) -> Optional[Dict[str, Any]]:
         with self.cursor() as cur:
-            cur.execute("""DELETE FROM persons WHERE standup_organizer = %s""", (user_id,))
+            self._execute(cur, 'get_response', (session_id, message_id))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def store_response(self, session_id: str, message_id: int, response: Dict[str, Any]):
+        if self.share_responses:
+            self._write('store_response', (session_id, message_id, Json(response)))
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        res = super().__exit__(exc_type, exc_val, exc_tb)
+        if exc_type is None:
+            try:
+                self.flush()
+            except (psycopg2.Error, ReplayedRequest, ResponsePending) as err:
+                self.batch = None
+                super().__exit__(type(err), err, err.__traceback__)
+                pool().putconn(self)
+                raise
+        self.batch = None
+        with storage_seconds.time('commit' if exc_type is None else 'rollback'):
+            res = super().__exit__(exc_type, exc_val, exc_tb)
         pool().putconn(self)
         return res
 
 
+def connection_params() -> Dict[str, Optional[str]]:
+    return {'host': os.getenv('PG_HOST'),
+            'user': os.getenv('PG_USER'),
+            'database': os.getenv('PG_DB'),
+            'password': os.getenv('PG_PWD')}
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    pass
+
+
+class BoundedConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    # В отличие от ThreadedConnectionPool не падает сразу, когда все соединения заняты,
+    # а ждёт освобождения соединения не дольше timeout секунд
+    def __init__(self, minconn, maxconn, *args, timeout: float = 2.0, health_check: bool = False, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self.health_check = health_check
+        self.released = threading.Condition(self._lock)
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def getconn(self, key=None):
+        while True:
+            conn = self._acquire(key)
+            if self._healthy(conn):
+                return conn
+            logging.warning('Dropping broken connection from the pool')
+            self.putconn(conn, key, close=True)
+
+    def _acquire(self, key):
+        start = time.monotonic()
+        with self.released:
+            self.waiting += 1
+            try:
+                while not self._pool and len(self._used) >= self.maxconn:
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        pool_timeouts.inc()
+                        raise PoolTimeout(f'no free connection in {self.timeout} seconds')
+                    self.released.wait(remaining)
+                conn = self._getconn(key)
+            finally:
+                self.waiting -= 1
+            waited = time.monotonic() - start
+            self.acquired += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+        pool_wait_seconds.observe(waited)
+        return conn
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if not self.health_check:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""SELECT 1""")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, conn=None, key=None, close=False):
+        with self.released:
+            self._putconn(conn, key, close or bool(conn.closed))
+            self.released.notify()
+
+    def stats(self) -> Dict[str, float]:
+        with self.released:
+            return {'checked_out': len(self._used),
+                    'idle': len(self._pool),
+                    'waiting': self.waiting,
+                    'acquired': self.acquired,
+                    'timeouts': self.timeouts,
+                    'wait_time': self.wait_time,
+                    'max_wait_time': self.max_wait_time}
+
+
+pool_lock = threading.Lock()
+
+
+def pool() -> BoundedConnectionPool:
+    # lru_cache не мешает нескольким потокам одновременно создать пул при первых запросах,
+    # тогда соединение из одного пула возвращалось бы в другой
+    with pool_lock:
+        return create_pool()
+
+
 @functools.lru_cache
-def pool() -> psycopg2.pool.ThreadedConnectionPool:
-    return psycopg2.pool.ThreadedConnectionPool(minconn=1,
-                                                maxconn=2,
-                                                host=os.getenv('PG_HOST'),
-                                                user=os.getenv('PG_USER'),
-                                                database=os.getenv('PG_DB'),
-                                                password=os.getenv('PG_PWD'),
-                                                connection_factory=StorageConnection)
+def create_pool() -> BoundedConnectionPool:
+    maxconn = int(os.getenv('PG_POOL_MAX', '2'))
+    # Соединения сверх minconn закрываются при возврате в пул, поэтому по умолчанию держим все открытыми
+    return BoundedConnectionPool(minconn=int(os.getenv('PG_POOL_MIN', str(maxconn))),
+                                 maxconn=maxconn,
+                                 timeout=float(os.getenv('PG_POOL_TIMEOUT', '2')),
+                                 health_check=os.getenv('PG_POOL_HEALTH_CHECK', '0') == '1',
+                                 connection_factory=StorageConnection,
+                                 **connection_params())
+
+
+def close_pool():
+    # Закрывает пул этого процесса при остановке сервера, если он успел создаться
+    with pool_lock:
+        if create_pool.cache_info().currsize:
+            create_pool().closeall()
+            create_pool.cache_clear()
+
+
+class TokenStore:
+    # Общее для всех процессов хранилище токенов гитхаба. Использует свои соединения, а не пул:
+    # токены выпускаются в фоновых потоках, пока обработчики запросов держат соединения пула.
+    # Выпуск токена - запрос к гитхабу, поэтому соединение берётся на один вызов, а ждут друг друга
+    # только потоки одной установки. Между процессами выпуск сериализует pg_advisory_xact_lock.
+    # В таблице токены лежат зашифрованными тем же ключом, что и токен трекера в задачах (jobs.seal_token)
+    @staticmethod
+    def available() -> bool:
+        from jobs import token_cipher
+        return token_cipher() is not None
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle: List[psycopg2.extensions.connection] = []
+        self.installation_locks: Dict[str, threading.Lock] = {}
+
+    def _installation_lock(self, installation) -> threading.Lock:
+        with self.lock:
+            return self.installation_locks.setdefault(str(installation), threading.Lock())
+
+    def _getconn(self) -> psycopg2.extensions.connection:
+        with self.lock:
+            while self.idle:
+                conn = self.idle.pop()
+                if not conn.closed:
+                    return conn
+        return psycopg2.connect(**connection_params())
+
+    def _putconn(self, conn: psycopg2.extensions.connection):
+        if conn.closed:
+            return
+        with self.lock:
+            self.idle.append(conn)
+
+    def get_or_mint(self, installation, mint: Callable[[Any], Tuple[str, datetime.datetime]],
+                    min_remaining: datetime.timedelta) -> Tuple[str, datetime.datetime]:
+        from jobs import open_token, seal_token
+        with self._installation_lock(installation):
+            conn = self._getconn()
+            try:
+                with conn, conn.cursor() as cur:
+                    # Пока один процесс выпускает токен для установки, остальные ждут и забирают его из таблицы
+                    cur.execute("""SELECT pg_advisory_xact_lock(hashtext('github_token:' || %s))""",
+                                (str(installation),))
+                    cur.execute("""SELECT token, expires_at FROM github_tokens
+                                   WHERE installation_id = %s AND expires_at > now() + %s""",
+                                (str(installation), min_remaining))
+                    if row := cur.fetchone():
+                        try:
+                            return open_token(row[0]), row[1]
+                        except InvalidToken:
+                            # Записан другим ключом: выпускаем новый токен и перезаписываем строку
+                            logging.warning('Cannot open stored token for installation %r', installation)
+                    token, expires_at = mint(installation)
+                    cur.execute("""INSERT INTO github_tokens(installation_id, token, expires_at) VALUES (%s, %s, %s)
+                                   ON CONFLICT (installation_id)
+                                   DO UPDATE SET token = EXCLUDED.token, expires_at = EXCLUDED.expires_at""",
+                                (str(installation), seal_token(token), expires_at))
+                    return token, expires_at
+            except psycopg2.OperationalError:
+                conn.close()
+                raise
+            finally:
+                self._putconn(conn)
+
+
+class ResponsePruner:
+    # Старые ответы для повторов webhook удаляет каждый веб-процесс сам, не чаще раза в interval секунд,
+    # в отдельном потоке и соединении мимо пула, так что это не зависит от того, где выполняются фоновые задачи
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_run: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def maybe_prune(self):
+        with self.lock:
+            if self.last_run is not None and time.monotonic() - self.last_run < self.interval:
+                return
+            self.last_run = time.monotonic()
+        threading.Thread(target=self.prune, name='prune-responses', daemon=True).start()
+
+    @staticmethod
+    def prune():
+        conn = None
+        try:
+            conn = psycopg2.connect(**connection_params())
+            with conn, conn.cursor() as cur:
+                cur.execute("""DELETE FROM webhook_responses WHERE created_at < now() - %s * interval '1 second'""",
+                            (dedup_ttl(),))
+                logging.info('Pruned %d webhook responses', cur.rowcount)
+        except psycopg2.Error as err:
+            logging.warning('Failed to prune webhook responses: %r', err)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+@functools.lru_cache
+def response_pruner() -> ResponsePruner:
+    return ResponsePruner(interval=float(os.getenv('WEBHOOK_DEDUP_PRUNE_INTERVAL', '600')))
 
 
 class StorageConnectionFactory:
     @staticmethod
-    def create_conn() -> StorageConnection:
-        return pool().getconn()
+    def create_conn(cached: bool = True) -> UnitOfWork:
+        # cached=False - состояние стендапа читается только из базы, мимо памяти процесса
+        if os.getenv('WEBHOOK_DEDUP_STORE', 'postgres') == 'postgres':
+            response_pruner().maybe_prune()
+        return UnitOfWork(pool().getconn(), None if cached else StandupStateCache(0))
+
+    @staticmethod
+    def record_history(events):
+        # Запись истории стендапов идёт в фоне, мимо пула
+        from history import history_writer
+        history_writer().record(events)
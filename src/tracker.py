@@ -1,15 +1,20 @@
+import functools
+from itertools import islice
+from typing import List
+
 import yandex_tracker_client as ytc
-from cachetools import TTLCache, cached
+from yandex_tracker_client.connection import Connection
 
+from http_client import attach, timeouts
 from issue_tracker import IssueTracker
+from metrics import upstream_seconds
 
-
-class NoTokenException(Exception):
-    pass
+ISSUES_LIMIT = 10
 
 
-class NoInfoException(Exception):
-    pass
+def quote(value: str) -> str:
+    # Строковое значение в языке запросов трекера: в кавычках, кавычки и обратные слеши внутри экранируются
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
 
 
 class YandexTracker(IssueTracker):
@@ -17,15 +22,45 @@ class YandexTracker(IssueTracker):
         self.client = get_ytc(token, org_id)
         self.queue = queue
 
+    @upstream_seconds.timed('tracker', 'list_issues')
     def list_issues(self):
-        return [f'{issue.key}: {issue.summary}' for issue in self.client.issues.find(filter={'queue': self.queue})]
+        # Только открытые тикеты, недавно обновлённые первыми, одной страницей размером с ISSUES_LIMIT.
+        # Следующие страницы клиент запрашивает лениво при итерации, islice до них не доходит
+        issues = self.client.issues.find(
+            query=f'Queue: {quote(self.queue)} Resolution: empty() "Sort by": Updated DESC',
+            per_page=ISSUES_LIMIT,
+            fields='key,summary',
+        )
+        return [f'{issue.key}: {issue.summary}' for issue in islice(issues, ISSUES_LIMIT)]
 
+    def issue_prefix(self, issue) -> str:
+        return f'{self.queue}-{issue}: '
+
+    @upstream_seconds.timed('tracker', 'close_issue')
     def close_issue(self, issue):
         issue = self.client.issues[f'{self.queue}-{issue}']
         transition = issue.transitions['close']
         transition.execute(comment='Закрыто из Алисы', resolution='fixed')
 
+    @upstream_seconds.timed('tracker', 'team_members')
+    def team_members(self) -> List[str]:
+        # Участники приходят вместе с очередью, display у них уже заполнен и отдельно не запрашивается
+        queue = self.client.queues.get(self.queue, expand='team')
+        return [user.display for user in queue.teamUsers]
+
+
+class PooledConnection(Connection):
+    # Соединение клиента трекера, чья сессия ходит через общий HTTP пул процесса (src/http_client.py)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        attach(self.session)
+
+
+class PooledTrackerClient(ytc.TrackerClient):
+    connector = PooledConnection
+
 
-@cached(TTLCache(maxsize=10, ttl=600))
+@functools.lru_cache(maxsize=256)
 def get_ytc(token, org_id):
-    return ytc.TrackerClient(token=token, org_id=org_id)
+    # Один клиент на токен и организацию: сессия с заголовками авторизации создаётся один раз
+    return PooledTrackerClient(token=token, org_id=org_id, timeout=timeouts())
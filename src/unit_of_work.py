@@ -0,0 +1,251 @@
+import datetime
+import logging
+from typing import Dict, List, Optional, Any
+
+from standup_state import StaleStandupState, StandupStateCache, standup_state
+from user import User
+
+
+# Обёртка над StorageConnection на время одного запроса.
+# Пользователь и его команда загружаются одним запросом в get_user, дальше чтения
+# обслуживаются из этого снимка. Записи без результата копятся и уходят в базу одним
+# запросом вместе со следующим чтением из базы или при выходе из контекста.
+# Во время стендапа снимок берётся из памяти процесса (src/standup_state.py), тогда записи
+# стендапа проверяют standup_version, а при расхождении с базой бросается StaleStandupState.
+class UnitOfWork:
+
+    def __init__(self, connection, states: Optional[StandupStateCache] = None):
+        self.connection = connection
+        self.states = states if states is not None else standup_state()
+        self.user: Optional[User] = None
+        self.team: List[Dict[str, Any]] = []
+        # Снимок взят из памяти, и подтверждён ли он базой в этой транзакции
+        self.from_memory = False
+        self.verified = False
+        self.start_query_count = connection.query_count
+
+    def __getattr__(self, item):
+        return getattr(self.connection, item)
+
+    def __enter__(self):
+        self.connection.__enter__()
+        self.connection.begin_batch()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None and self.from_memory:
+            try:
+                # Запрос ничего не записал в стендап: ответ верен, только если стендап никто не менял
+                self._verify()
+            except Exception as err:
+                self.connection.__exit__(type(err), err, err.__traceback__)
+                raise
+        res = self.connection.__exit__(exc_type, exc_val, exc_tb)
+        if exc_type is None and self.user is not None:
+            self._remember()
+        logging.debug('Unit of work for %r made %d queries', self.user.id if self.user else None, self.query_count)
+        return res
+
+    @property
+    def query_count(self) -> int:
+        return self.connection.query_count - self.start_query_count
+
+    def _loaded(self, user_id: str) -> bool:
+        return self.user is not None and self.user.id == user_id
+
+    def _remember(self):
+        # Вызывается после коммита, так что в памяти не бывает состояния, которого нет в базе
+        if self.user.stanup_held and self.user.standup_version is not None:
+            self.states.put(self.user, self.team)
+        else:
+            self.states.discard(self.user.id)
+
+    def _confirm(self, applied: bool):
+        if not applied:
+            self.states.discard(self.user.id, stale=True)
+            raise StaleStandupState(self.user.id)
+        self.verified = True
+
+    def _verify(self):
+        if not self.verified:
+            self._confirm(self.connection.get_standup_version(self.user.id) == self.user.standup_version)
+
+    def get_user(self, user_id: str) -> Optional[User]:
+        if not self._loaded(user_id):
+            cached = self.states.get(user_id)
+            if cached is not None:
+                self.user, self.team = cached
+                self.from_memory = True
+            else:
+                self.user, self.team = self.connection.load_user_state(user_id)
+        return self.user
+
+    def check_standup(self, user_id: str) -> bool:
+        if not self._loaded(user_id):
+            return self.connection.check_standup(user_id)
+        return self.user.stanup_held
+
+    def get_team(self, user_id: str) -> List[Dict[str, str]]:
+        if not self._loaded(user_id):
+            return self.connection.get_team(user_id)
+        return [{'person_id': p['person_id'], 'first_name': p['first_name'], 'last_name': p['last_name'] or ''}
+                for p in self.team]
+
+    def get_team_themes(self, user_id: str) -> List[Dict[str, str]]:
+        if not self._loaded(user_id):
+            return self.connection.get_team_themes(user_id)
+        if self.from_memory:
+            # Темы могли запомнить через другой воркер, а итог стендапа должен их содержать
+            self._verify()
+        return [{'person_id': p['person_id'], 'first_name': p['first_name'], 'last_name': p['last_name'],
+                 'theme': p['theme']} for p in self.team]
+
+    def get_github_info(self, user_id: str):
+        if not self._loaded(user_id):
+            return self.connection.get_github_info(user_id)
+        return self.user.github_login, self.user.repo, self.user.installation_id
+
+    def get_tracker_info(self, user_id: str):
+        if not self._loaded(user_id):
+            return self.connection.get_tracker_info(user_id)
+        return self.user.tracker_org, self.user.tracker_queue
+
+    def create_user(self, user_id: str):
+        self.connection.create_user(user_id)
+        self.user = User(user_id, False, 0, None, None, None, None, None, True)
+        self.team = []
+
+    def start_standup(self, user_id: str, started_at: datetime.datetime):
+        self.connection.start_standup(user_id, started_at)
+        if self._loaded(user_id):
+            self.user.stanup_held = True
+            self.user.cur_speaker = 0
+            self.user.standup_started_at = started_at
+            self.user.speaker_started_at = None
+            self.user.speaker_queue = [p['person_id'] for p in self.team]
+            self._bump_version()
+
+    def _bump_version(self):
+        if self.user.standup_version is not None:
+            self.user.standup_version += 1
+
+    def call_next_speaker(self, user_id: str, started_at: datetime.datetime) -> Dict[str, Any]:
+        if self._loaded(user_id) and self.from_memory:
+            return self._advance_speaker(started_at)
+        try:
+            speaker = self.connection.call_next_speaker(user_id, started_at)
+        except IndexError:
+            # Очередь закончилась, но указатель в базе всё равно сдвинулся за её конец
+            if self._loaded(user_id):
+                self.user.cur_speaker = len(self.user.speaker_queue) + 1
+                self.user.standup_version = None
+            raise
+        if self._loaded(user_id):
+            self.user.cur_speaker = speaker['position']
+            self.user.speaker_started_at = started_at
+            self.user.standup_version = speaker['version']
+        return speaker
+
+    def _advance_speaker(self, started_at: datetime.datetime) -> Dict[str, Any]:
+        # Следующий выступающий по снимку: удалённых из команды пропускаем, как и call_next_speaker в базе
+        team = {p['person_id']: p for p in self.team}
+        position = self.user.cur_speaker + 1
+        while position <= len(self.user.speaker_queue) and self.user.speaker_queue[position - 1] not in team:
+            position += 1
+        self._confirm(self.connection.advance_speaker(self.user.id, position, started_at, self.user.standup_version))
+        self.user.standup_version += 1
+        self.user.cur_speaker = position
+        self.user.speaker_started_at = started_at
+        if position > len(self.user.speaker_queue):
+            raise IndexError('speaker queue is exhausted')
+        person = team[self.user.speaker_queue[position - 1]]
+        return {'person_id': person['person_id'], 'first_name': person['first_name'],
+                'last_name': person['last_name'] or '', 'position': position}
+
+    def set_theme_for_current_speaker(self, user_id: str, theme: str):
+        if self._loaded(user_id) and self.from_memory:
+            self._confirm(self.connection.set_theme_checked(user_id, theme, self.user.standup_version))
+        else:
+            self.connection.set_theme_for_current_speaker(user_id, theme)
+        if self._loaded(user_id):
+            self._bump_version()
+        if self._loaded(user_id) and 0 < self.user.cur_speaker <= len(self.user.speaker_queue):
+            person_id = self.user.speaker_queue[self.user.cur_speaker - 1]
+            for person in self.team:
+                if person['person_id'] == person_id:
+                    person['theme'] = theme
+
+    def reset_user(self, user_id: str):
+        if self._loaded(user_id) and self.from_memory:
+            self._confirm(self.connection.reset_user_checked(user_id, self.user.standup_version))
+        else:
+            self.connection.reset_user(user_id)
+        if self._loaded(user_id):
+            self._bump_version()
+            self.user.stanup_held = False
+            self.user.cur_speaker = 0
+            self.user.speaker_queue = []
+            self.user.standup_started_at = None
+            self.user.speaker_started_at = None
+            for person in self.team:
+                person['theme'] = None
+
+    def modify_silence(self, user_id: str, value: bool):
+        self.connection.modify_silence(user_id, value)
+        if self._loaded(user_id):
+            self.user.silence_enabled = value
+
+    def register_github(self, user_id: str, name: str, repo: str, installation_id: str):
+        self.connection.register_github(user_id, name, repo, installation_id)
+        if self._loaded(user_id):
+            self.user.github_login, self.user.repo, self.user.installation_id = name, repo, installation_id
+
+    def register_tracker(self, user_id: str, org: str, queue: str):
+        self.connection.register_tracker(user_id, org, queue)
+        if self._loaded(user_id):
+            self.user.tracker_org, self.user.tracker_queue = org, queue
+
+    def add_team_member(self, user_id: str, person: Dict[str, str]):
+        self.connection.add_team_member(user_id, person)
+        if self._loaded(user_id):
+            self.team.append({'person_id': None, 'first_name': person['first_name'],
+                              'last_name': person.get('last_name'), 'theme': None})
+
+    def add_team_members(self, user_id: str, persons: List[Dict[str, str]]):
+        self.connection.add_team_members(user_id, persons)
+        if self._loaded(user_id):
+            self.team.extend({'person_id': None, 'first_name': p['first_name'], 'last_name': p.get('last_name'),
+                              'theme': None} for p in persons)
+
+    def import_team_members(self, user_id: str, persons: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        if self._loaded(user_id):
+            present = {(p['first_name'], p['last_name']) for p in self.team}
+            persons = [p for p in persons if (p['first_name'], p.get('last_name')) not in present]
+            if not persons:
+                # Все уже в команде, в базу можно не ходить
+                return []
+        added = self.connection.import_team_members(user_id, persons)
+        if self._loaded(user_id):
+            self.team.extend(dict(p, theme=None) for p in added)
+        return added
+
+    def del_team_member(self, user_id: str, person: Dict[str, str]) -> bool:
+        if self._loaded(user_id):
+            last_name = person.get('last_name')
+            remaining = [p for p in self.team
+                         if p['first_name'] != person['first_name'] or p['last_name'] != last_name]
+            if len(remaining) == len(self.team):
+                # Такого человека нет в команде, в базу можно не ходить
+                return False
+            self.team = remaining
+        return self.connection.del_team_member(user_id, person)
+
+    def mark_jobs_reported(self, user_id: str, job_ids: List[int]):
+        self.connection.mark_jobs_reported(user_id, job_ids)
+        if self._loaded(user_id):
+            self.user.job_reports = [r for r in self.user.job_reports if r['job_id'] not in job_ids]
+
+    def clean_team(self, user_id: str):
+        self.connection.clean_team(user_id)
+        if self._loaded(user_id):
+            self.team = []
@@ -1,5 +1,7 @@
 class User:
-    def __init__(self, user_id, standup_held, cur_speaker, github_login, repo, installation_id, tracker_org, tracker_queue, silence_enabled):
+    def __init__(self, user_id, standup_held, cur_speaker, github_login, repo, installation_id, tracker_org, tracker_queue, silence_enabled,
+                 speaker_queue=None, job_reports=None, standup_started_at=None, speaker_started_at=None,
+                 standup_version=0):
         self.id = user_id
         self.stanup_held = standup_held
         self.cur_speaker = cur_speaker
@@ -9,3 +11,11 @@ class User:
         self.tracker_org = tracker_org
         self.tracker_queue = tracker_queue
         self.silence_enabled = silence_enabled
+        self.speaker_queue = speaker_queue or []
+        # Завершённые фоновые задачи, о которых пользователь ещё не узнал: [{'job_id': ..., 'result': ...}]
+        self.job_reports = job_reports or []
+        # Начало стендапа и выступления текущего человека, для истории стендапов
+        self.standup_started_at = standup_started_at
+        self.speaker_started_at = speaker_started_at
+        # Номер последнего изменения стендапа в базе, None - неизвестен (src/standup_state.py)
+        self.standup_version = standup_version
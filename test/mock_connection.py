@@ -1,16 +1,31 @@
+import datetime
 from typing import Dict, List, Optional
 
+from history import aggregate
+from idempotency import ReplayedRequest
+from user import User
+
 
 class MockStorage:
     def __init__(self):
         self.storage = {}
+        self.history = []
+        self.next_person_id = 1
+        self.responses = {}
 
-    def start_standup(self, user_id: str):
+    def start_standup(self, user_id: str, started_at: datetime.datetime):
         self.storage[user_id]['standup_held'] = True
+        self.storage[user_id]['cur_speaker'] = 0
+        self.storage[user_id]['standup_started_at'] = started_at
+        self.storage[user_id]['speaker_started_at'] = None
+        self.storage[user_id]['speaker_queue'] = [p['person_id'] for p in self.storage[user_id]['team']]
 
     def reset_user(self, user_id: str):
         self.storage[user_id]['standup_held'] = False
         self.storage[user_id]['cur_speaker'] = 0
+        self.storage[user_id]['speaker_queue'] = []
+        self.storage[user_id]['standup_started_at'] = None
+        self.storage[user_id]['speaker_started_at'] = None
         for i in range(len(self.storage[user_id]['team'])):
             self.storage[user_id]['team'][i]['theme'] = None
 
@@ -18,15 +33,56 @@ class MockStorage:
         return self.storage[user_id]['standup_held']
 
     def create_user(self, user_id: str):
-        self.storage[user_id] = {'standup_held': False, 'cur_speaker': 0, 'team': []}
+        # Как и в базе, тишина у нового пользователя включена
+        self.storage[user_id] = {'standup_held': False, 'cur_speaker': 0, 'team': [], 'speaker_queue': [],
+                                 'silence_enabled': True}
 
     def check_user_exists(self, user_id: str) -> bool:
         return user_id in self.storage
 
+    def get_user(self, user_id: str) -> Optional[User]:
+        if user_id not in self.storage:
+            return None
+        data = self.storage[user_id]
+        reports = [{'job_id': job['job_id'], 'result': job['result']} for job in data.get('jobs', [])
+                   if job['result'] is not None and not job['reported']]
+        return User(user_id, data['standup_held'], data['cur_speaker'], None, None, None, None, None,
+                    data.get('silence_enabled', False), data['speaker_queue'], reports,
+                    data.get('standup_started_at'), data.get('speaker_started_at'))
+
+    def register_github(self, user_id: str, name: str, repo: str, installation_id: str):
+        self.storage[user_id]['github'] = (name, repo, installation_id)
+
+    def get_github_info(self, user_id: str):
+        return self.storage[user_id].get('github', (None, None, None))
+
+    def register_tracker(self, user_id: str, org: str, queue: str):
+        self.storage[user_id]['tracker'] = (org, queue)
+
+    def get_tracker_info(self, user_id: str):
+        return self.storage[user_id].get('tracker', (None, None))
+
+    def clean_team(self, user_id: str):
+        self.storage[user_id]['team'] = []
+
+    def modify_silence(self, user_id: str, value: bool):
+        self.storage[user_id]['silence_enabled'] = value
+
     def add_team_member(self, user_id: str, person: Dict[str, Optional[str]]):
-        person.update({'theme': None})
+        person.update({'theme': None, 'person_id': self.next_person_id})
+        self.next_person_id += 1
         self.storage[user_id]['team'].append(person)
 
+    def add_team_members(self, user_id: str, persons: List[Dict[str, Optional[str]]]):
+        for person in persons:
+            self.add_team_member(user_id, person)
+
+    def import_team_members(self, user_id: str, persons: List[Dict[str, Optional[str]]]) -> List[Dict[str, str]]:
+        present = {(p['first_name'], p.get('last_name') or None) for p in self.storage[user_id]['team']}
+        added = [person for person in persons if (person['first_name'], person.get('last_name')) not in present]
+        self.add_team_members(user_id, added)
+        return added
+
     def del_team_member(self, user_id: str, person: Dict[str, str]):
         del_idx = None
         for (idx, p) in enumerate(self.storage[user_id]['team']):
@@ -41,16 +97,12 @@ class MockStorage:
     def get_team(self, user_id: str) -> List[Dict[str, str]]:
         return self.storage[user_id]['team']
 
-    def get_team_member(self, user_id: str, member_idx: int) -> Dict[str, str]:
-        member = self.storage[user_id]['team'][member_idx]
-        member['last_name'] = member.get('last_name', '')
-        return member
-
     def set_theme_for_current_speaker(self, user_id: str, theme: str):
-        speaker = self.get_team_member(user_id, self.storage[user_id]['cur_speaker'] - 1)
-        for (idx, person) in enumerate(self.storage[user_id]['team']):
-            if speaker['first_name'] == person['first_name'] and speaker.get('last_name', '') == person.get('last_name', ''):
-                self.storage[user_id]['team'][idx]['theme'] = theme
+        queue = self.storage[user_id]['speaker_queue']
+        person_id = queue[self.storage[user_id]['cur_speaker'] - 1]
+        for person in self.storage[user_id]['team']:
+            if person['person_id'] == person_id:
+                person['theme'] = theme
                 break
 
     def get_team_themes(self, user_id: str) -> List[Dict[str, str]]:
@@ -59,10 +111,46 @@ class MockStorage:
             member['last_name'] = member.get('last_name', '')
         return team
 
-    def call_next_speaker(self, user_id: str) -> Dict[str, str]:
-        speaker = self.get_team_member(user_id, self.storage[user_id]['cur_speaker'])
-        self.storage[user_id]['cur_speaker'] += 1
-        return speaker
+    def call_next_speaker(self, user_id: str, started_at: datetime.datetime) -> Dict[str, str]:
+        queue = self.storage[user_id]['speaker_queue']
+        self.storage[user_id]['speaker_started_at'] = started_at
+        while True:
+            self.storage[user_id]['cur_speaker'] += 1
+            person_id = queue[self.storage[user_id]['cur_speaker'] - 1]
+            for member in self.storage[user_id]['team']:
+                if member['person_id'] == person_id:
+                    member['last_name'] = member.get('last_name', '')
+                    return member
+
+    def get_standup_report(self, user_id: str):
+        persons, standups = aggregate(self.history)
+        team = {p['person_id']: p for p in self.storage[user_id]['team']}
+        stats = [{'first_name': team[person_id]['first_name'], 'last_name': team[person_id].get('last_name'),
+                  'turns': turns, 'skips': skips, 'speaking_seconds': seconds}
+                 for (owner, person_id), (turns, skips, seconds, _, _) in sorted(persons.items())
+                 if owner == user_id and person_id in team]
+        totals = standups.get(user_id)
+        return (totals[0], totals[1]) if totals else None, stats
+
+    def enqueue_job(self, user_id: str, kind: str, args: Dict):
+        jobs = self.storage[user_id].setdefault('jobs', [])
+        jobs.append({'job_id': len(jobs) + 1, 'kind': kind, 'args': args, 'result': None, 'reported': False})
+
+    def mark_jobs_reported(self, user_id: str, job_ids: List[int]):
+        for job in self.storage[user_id].get('jobs', []):
+            if job['job_id'] in job_ids:
+                job['reported'] = True
+
+    def claim_response(self, session_id: str, message_id: int, timeout: Optional[float] = None):
+        if (session_id, message_id) in self.responses:
+            raise ReplayedRequest(f'{session_id}/{message_id}')
+        self.responses[(session_id, message_id)] = None
+
+    def get_response(self, session_id: str, message_id: int) -> Optional[Dict]:
+        return self.responses.get((session_id, message_id))
+
+    def store_response(self, session_id: str, message_id: int, response: Dict):
+        self.responses[(session_id, message_id)] = response
 
     def __enter__(self):
         return self
@@ -75,5 +163,8 @@ class MockStorageConnectionFactory:
     def __init__(self):
         self.storage = MockStorage()
 
-    def create_conn(self) -> MockStorage:
+    def create_conn(self, cached: bool = True) -> MockStorage:
         return self.storage
+
+    def record_history(self, events):
+        self.storage.history.extend(events)
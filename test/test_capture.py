@@ -0,0 +1,60 @@
+import gzip
+import json
+import os
+
+import capture
+
+
+class TestCapture:
+    def test_payload_is_anonymized(self, monkeypatch):
+        monkeypatch.setenv('CAPTURE_SALT', 'salt')
+        payload = {'version': '1.0', 'meta': {'client_id': 'client'},
+                   'session': {'session_id': 'session', 'message_id': 1, 'new': False,
+                               'user': {'user_id': 'user', 'access_token': 'secret'},
+                               'application': {'application_id': 'app'}},
+                   'request': {'command': 'помощь'}}
+        result = capture.anonymize(payload)
+        assert result['session']['user'] == {'user_id': capture.pseudonym('user')}
+        assert result['session']['session_id'] == capture.pseudonym('session')
+        assert 'application' not in result['session'] and 'meta' not in result
+        assert 'secret' not in json.dumps(result)
+        assert payload['session']['user']['user_id'] == 'user'
+
+    def test_names_in_utterance_are_masked(self, monkeypatch):
+        monkeypatch.setenv('CAPTURE_SALT', 'salt')
+        payload = {'session': {'session_id': 'session', 'user': {'user_id': 'user'}},
+                   'request': {'command': 'добавь в команду иван петров',
+                               'original_utterance': 'Добавь в команду Иван Петров',
+                               'nlu': {'tokens': ['добавь', 'в', 'команду', 'иван', 'петров'],
+                                       'entities': [{'type': 'YANDEX.FIO', 'tokens': {'start': 3, 'end': 5},
+                                                     'value': {'first_name': 'иван', 'last_name': 'петров'}}],
+                                       'intents': {'team.newmember': {'slots': {'name': {
+                                           'type': 'YANDEX.FIO',
+                                           'value': {'first_name': 'иван', 'last_name': 'петров'}}}}}}}}
+        request = capture.anonymize(payload)['request']
+        first, last = capture.mask_text('иван'), capture.mask_text('петров')
+        assert 'иван' not in json.dumps(request, ensure_ascii=False).lower()
+        assert request['command'] == f'добавь в команду {first} {last}'
+        assert request['original_utterance'] == f'Добавь в команду {first} {last}'
+        assert request['nlu']['tokens'][3:] == [first, last]
+        assert request['nlu']['intents']['team.newmember']['slots']['name']['value'] == \
+            {'first_name': first, 'last_name': last}
+        assert request['nlu']['entities'][0]['type'] == 'YANDEX.FIO'
+        assert capture.mask_text('закрой тикет 3 гитхаб') == 'закрой тикет 3 гитхаб'
+
+    def test_capture_needs_salt(self, monkeypatch, tmp_path):
+        monkeypatch.setenv('CAPTURE_DIR', str(tmp_path))
+        monkeypatch.delenv('CAPTURE_SALT', raising=False)
+        capture.create_capture_logger.cache_clear()
+        try:
+            assert capture.capture_logger() is None
+        finally:
+            capture.create_capture_logger.cache_clear()
+
+    def test_rotated_files_are_compressed(self, tmp_path):
+        source = tmp_path / 'capture.jsonl'
+        source.write_text('{"time": 1}\n', encoding='utf-8')
+        capture.gzip_rotator(str(source), str(source) + '.1.gz')
+        assert not os.path.exists(source)
+        with gzip.open(str(source) + '.1.gz', 'rt', encoding='utf-8') as file:
+            assert file.read() == '{"time": 1}\n'
@@ -1,5 +1,10 @@
+import threading
 from typing import Dict, Any, Optional
 
+from requests import HTTPError, Response
+
+import dialog
+from deadline import Deadline
 from mock_connection import MockStorageConnectionFactory
 from dialog import DialogHandler
 from request import Request
@@ -31,3 +36,238 @@ def add_del_intent(request: Request, first_name: str, last_name: Optional[str]):
 class TestDialogHandler:
     def test_pass(self):
         assert True
+
+    def test_standup_follows_queue_snapshot(self):
+        factory = MockStorageConnectionFactory()
+        factory.storage.create_user('user')
+        for first_name, last_name in [('иван', 'петров'), ('мария', None)]:
+            req = create_request('user', 'добавь в команду')
+            add_name_intent(req, first_name, last_name)
+            DialogHandler(factory).handle_dialog(req)
+
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('user', 'начни стендап'))
+        assert 'Иван Петров, расскажи о прошедшем дне' in handler.response['text']
+
+        # Добавленный во время стендапа человек не попадает в текущую очередь
+        factory.storage.add_team_member('user', {'first_name': 'олег'})
+
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('user', 'запомни тему релиз'))
+        req = create_request('user', 'у меня всё')
+        req._req['request']['nlu']['intents']['end.report'] = {}
+        handler = DialogHandler(factory)
+        handler.handle_dialog(req)
+        assert handler.response['text'] == 'Мария, расскажи о прошедшем дне'
+
+        req = create_request('user', 'у меня всё')
+        req._req['request']['nlu']['intents']['end.report'] = {}
+        handler = DialogHandler(factory)
+        handler.handle_dialog(req)
+        assert 'у Иван Петров была тема "релиз"' in handler.response['text']
+        assert handler.response['end_session']
+
+    def test_slow_issue_tracker_answers_within_deadline(self, monkeypatch):
+        released = threading.Event()
+
+        class SlowTracker:
+            def __init__(self, username, repo, installation):
+                pass
+
+            def list_issues(self):
+                released.wait(5)
+                return ['1. Медленный тикет']
+
+        monkeypatch.setattr(dialog, 'GithubTracker', SlowTracker)
+        factory = MockStorageConnectionFactory()
+        factory.storage.create_user('user')
+        factory.storage.register_github('user', 'login', 'slow-repo', '1')
+
+        handler = DialogHandler(factory, Deadline(0.05))
+        handler.handle_dialog(create_request('user', 'покажи тикеты гитхаб'))
+        assert handler.response['text'] == 'Тикеты ещё загружаются, спросите ещё раз через пару секунд'
+
+        released.set()
+        handler = DialogHandler(factory, Deadline(1))
+        handler.handle_dialog(create_request('user', 'покажи тикеты гитхаб'))
+        assert handler.response['text'] == '1. Медленный тикет'
+
+    def test_issue_cache_is_per_credential(self, monkeypatch):
+        class InstallationTracker:
+            def __init__(self, username, repo, installation):
+                if installation != '1':
+                    raise HTTPError('installation is not allowed for this repository')
+
+            def list_issues(self):
+                return ['1. Закрытый тикет']
+
+        monkeypatch.setattr(dialog, 'GithubTracker', InstallationTracker)
+        factory = MockStorageConnectionFactory()
+        for user_id, installation in [('owner', '1'), ('stranger', '2')]:
+            factory.storage.create_user(user_id)
+            factory.storage.register_github(user_id, 'login', 'private-repo', installation)
+
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('owner', 'покажи тикеты гитхаб'))
+        assert handler.response['text'] == '1. Закрытый тикет'
+
+        # Тот же репозиторий с чужой установкой не получает закэшированный список владельца
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('stranger', 'покажи тикеты гитхаб'))
+        assert handler.response['text'].startswith('Возникла ошибка в авторизации на гитхабе')
+
+    def test_all_issues_tell_auth_and_config_errors_apart(self, monkeypatch):
+        def http_error(status: int) -> HTTPError:
+            response = Response()
+            response.status_code = status
+            return HTTPError(str(status), response=response)
+
+        class UnauthorizedGithub:
+            def __init__(self, username, repo, installation):
+                raise http_error(401)
+
+        class MissingQueue:
+            def __init__(self, token, org, queue):
+                pass
+
+            def list_issues(self):
+                raise http_error(404)
+
+        monkeypatch.setattr(dialog, 'GithubTracker', UnauthorizedGithub)
+        monkeypatch.setattr(dialog, 'YandexTracker', MissingQueue)
+        factory = MockStorageConnectionFactory()
+        factory.storage.create_user('user')
+        factory.storage.register_github('user', 'login', 'unauthorized-repo', '1')
+        factory.storage.register_tracker('user', 'org', 'MISSING')
+
+        req = create_request('user', 'покажи все тикеты')
+        req._req['session']['user']['access_token'] = 'token'
+        handler = DialogHandler(factory)
+        handler.handle_dialog(req)
+        assert handler.response['text'] == 'Гитхаб: ошибка авторизации, проверьте данные и попробуйте ещё раз.\n' \
+                                           'Трекер: не найдено, проверьте настройки командой "запомни трекер"'
+
+    def test_bulk_add_and_import(self, monkeypatch):
+        class MembersTracker:
+            def __init__(self, username, repo, installation):
+                pass
+
+            def team_members(self):
+                return ['Иван Петров', 'Олег Сидоров', 'Олег Сидоров', 'anna']
+
+        monkeypatch.setattr(dialog, 'GithubTracker', MembersTracker)
+        factory = MockStorageConnectionFactory()
+        factory.storage.create_user('user')
+        factory.storage.register_github('user', 'login', 'members-repo', '1')
+
+        req = create_request('user', 'добавь в команду иван петров мария иванова')
+        req._req['request']['original_utterance'] = 'Добавь в команду Иван Петров, Мария Иванова'
+        handler = DialogHandler(factory)
+        handler.handle_dialog(req)
+        assert handler.response['text'] == 'Запомнила людей: Петров Иван, Иванова Мария'
+
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('user', 'импортируй команду гитхаб'))
+        assert handler.response['text'] == 'Добавила в команду: Сидоров Олег, Anna'
+
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('user', 'импортируй команду из гитхаба'))
+        assert handler.response['text'] == 'Все участники уже есть в команде'
+        assert [p['first_name'] for p in factory.storage.get_team('user')] == ['иван', 'мария', 'олег', 'anna']
+
+    def test_closed_issue_is_reported_on_next_turn(self):
+        factory = MockStorageConnectionFactory()
+        factory.storage.create_user('user')
+        factory.storage.register_github('user', 'login', 'repo', '1')
+
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('user', 'закрой тикет 3 гитхаб'))
+        assert handler.response['text'] == 'Закрываю тикет, о результате сообщу в следующем ответе'
+        job = factory.storage.storage['user']['jobs'][0]
+        assert job['args'] == {'tracker': 'github', 'username': 'login', 'repo': 'repo', 'installation': '1',
+                               'issue': 3}
+
+        job['result'] = 'Тикет 3 в гитхабе закрыт.'
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('user', 'напомни команду'))
+        assert handler.response['text'] == 'Тикет 3 в гитхабе закрыт.\nТвоя команда: '
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('user', 'напомни команду'))
+        assert handler.response['text'] == 'Твоя команда: '
+
+    def test_tracker_token_is_not_stored_in_plaintext(self, monkeypatch):
+        factory = MockStorageConnectionFactory()
+        factory.storage.create_user('user')
+        factory.storage.register_tracker('user', 'org', 'QUEUE')
+        req = create_request('user', 'закрой тикет 3 трекер')
+        req._req['session']['user']['access_token'] = 'oauth-token'
+
+        monkeypatch.setattr(dialog, 'seal_token', lambda token: None)
+        handler = DialogHandler(factory)
+        handler.handle_dialog(req)
+        assert 'jobs' not in factory.storage.storage['user']
+        assert handler.response['text'] == 'Закрытие тикетов трекера сейчас не настроено, закройте тикет в самом трекере'
+
+        monkeypatch.setattr(dialog, 'seal_token', lambda token: f'sealed:{token[::-1]}')
+        handler = DialogHandler(factory)
+        handler.handle_dialog(req)
+        job = factory.storage.storage['user']['jobs'][0]
+        assert job['args'] == {'tracker': 'tracker', 'sealed_token': 'sealed:nekot-htuao', 'org': 'org',
+                               'queue': 'QUEUE', 'issue': 3}
+
+    def test_all_issues_fan_out_names_slow_source(self, monkeypatch):
+        released = threading.Event()
+
+        class FastGithub:
+            def __init__(self, username, repo, installation):
+                pass
+
+            def list_issues(self):
+                return ['1. Быстрый тикет']
+
+        class SlowTracker:
+            def __init__(self, token, org, queue):
+                pass
+
+            def list_issues(self):
+                released.wait(5)
+                return ['Q-1: Медленный тикет']
+
+        monkeypatch.setattr(dialog, 'GithubTracker', FastGithub)
+        monkeypatch.setattr(dialog, 'YandexTracker', SlowTracker)
+        factory = MockStorageConnectionFactory()
+        factory.storage.create_user('user')
+        factory.storage.register_github('user', 'login', 'fan-out-repo', '1')
+        factory.storage.register_tracker('user', 'org', 'FANOUT')
+
+        req = create_request('user', 'покажи все тикеты')
+        req._req['session']['user']['access_token'] = 'token'
+        handler = DialogHandler(factory, Deadline(0.1))
+        handler.handle_dialog(req)
+        assert handler.response['text'] == 'Гитхаб: 1. Быстрый тикет.\n' \
+                                           'Трекер сейчас недоступен, спросите ещё раз через пару секунд'
+
+        released.set()
+        handler = DialogHandler(factory, Deadline(1))
+        handler.handle_dialog(req)
+        assert handler.response['text'] == 'Гитхаб: 1. Быстрый тикет.\nТрекер: Q-1: Медленный тикет'
+
+    def test_standup_history_report(self):
+        factory = MockStorageConnectionFactory()
+        factory.storage.create_user('history-user')
+        for first_name, last_name in [('иван', 'петров'), ('мария', None)]:
+            factory.storage.add_team_member('history-user', {'first_name': first_name, 'last_name': last_name})
+
+        for command, intent in [('начни стендап', None), ('запомни тему релиз', None),
+                                ('у меня всё', 'end.report'), ('её нет', 'skip.person')]:
+            req = create_request('history-user', command)
+            if intent:
+                req._req['request']['nlu']['intents'][intent] = {}
+            DialogHandler(factory).handle_dialog(req)
+
+        assert [event.kind for event in factory.storage.history] == ['start', 'theme', 'speak', 'skip', 'end']
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('history-user', 'статистика стендапов'))
+        assert handler.response['text'] == 'Проведено стендапов: 1, в среднем 0 с.\n' \
+                                           'Петров Иван: в среднем 0 с, пропусков 0 из 1.\n' \
+                                           'Мария: выступлений не было, пропусков 1 из 1'
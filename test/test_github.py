@@ -0,0 +1,75 @@
+import datetime
+import time
+
+import github
+from github import GithubTracker, InstallationTokenCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, etag=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = {'ETag': etag} if etag else {}
+        self.content = b'x' * 100
+        self.links = {}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+class TestGithubTracker:
+    def test_unchanged_issues_are_revalidated_with_etag(self, monkeypatch):
+        requests_made = []
+
+        class FakeSession:
+            @staticmethod
+            def get(url, headers, params):
+                return fake_get(url, headers, params)
+
+        def fake_get(url, headers, params):
+            requests_made.append((headers.get('If-None-Match'), params))
+            if headers.get('If-None-Match') == '"v1"':
+                return FakeResponse(304)
+            return FakeResponse(200, [{'number': 1, 'title': 'Баг'},
+                                      {'number': 2, 'title': 'PR', 'pull_request': {}}], etag='"v1"')
+
+        monkeypatch.setattr(github, 'session', lambda: FakeSession)
+        monkeypatch.setattr(github, 'get_installation_token', lambda installation: 'token')
+        monkeypatch.setattr(github, 'etag_cache', {})
+        tracker = GithubTracker('user', 'repo', '1')
+
+        assert tracker.list_issues() == ['1. Баг']
+        not_modified = github.stats['not_modified']
+        assert tracker.list_issues() == ['1. Баг']
+        assert github.stats['not_modified'] == not_modified + 1
+        assert requests_made == [(None, {'state': 'open', 'per_page': 20}),
+                                 ('"v1"', {'state': 'open', 'per_page': 20})]
+
+
+class TestInstallationTokenCache:
+    def test_tokens_are_reused_until_close_to_expiry(self):
+        minted = []
+        lifetime = [datetime.timedelta(hours=1)]
+
+        def mint(installation):
+            minted.append(installation)
+            return f'token-{len(minted)}', datetime.datetime.now(datetime.timezone.utc) + lifetime[0]
+
+        cache = InstallationTokenCache(maxsize=10, refresh_margin=datetime.timedelta(minutes=5),
+                                       min_validity=datetime.timedelta(minutes=1), mint=mint)
+        assert cache.get('1') == 'token-1'
+        assert cache.get('1') == 'token-1'
+        assert minted == ['1']
+
+        # До истечения меньше refresh_margin: отдаём старый токен и обновляем его в фоне
+        lifetime[0] = datetime.timedelta(minutes=3)
+        cache.refresh('1')
+        assert cache.get('1') == 'token-2'
+        for _ in range(100):
+            if len(minted) == 3 and not cache.refreshing:
+                break
+            time.sleep(0.01)
+        assert cache.tokens['1'][0] == 'token-3'
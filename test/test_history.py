@@ -0,0 +1,72 @@
+import datetime
+
+import psycopg2
+
+import history
+from history import Event, HistoryWriter, aggregate, month_bounds
+
+MOSCOW = datetime.timezone(datetime.timedelta(hours=3))
+
+
+def at(minute: int) -> datetime.datetime:
+    return datetime.datetime(2026, 10, 1, 9, minute, tzinfo=datetime.timezone.utc)
+
+
+class TestHistory:
+    def test_batch_is_folded_into_aggregate_increments(self):
+        events = [Event('user', 'start', None, at(0), None, None),
+                  Event('user', 'theme', 1, at(1), None, 'релиз'),
+                  Event('user', 'speak', 1, at(2), 90.0, None),
+                  Event('user', 'skip', 2, at(3), 5.0, None),
+                  Event('user', 'end', None, at(4), 240.0, None),
+                  Event('user', 'speak', 1, at(10), 30.0, None)]
+        persons, standups = aggregate(events)
+        assert persons == {('user', 1): [2, 0, 120.0, 1, at(10)], ('user', 2): [1, 1, 0.0, 0, at(3)]}
+        assert standups == {'user': [1, 240.0, at(4)]}
+
+    def test_month_bounds_are_taken_in_utc(self):
+        # 1 ноября 01:00 по Москве - ещё октябрь по UTC
+        moment = datetime.datetime(2026, 11, 1, 1, 0, tzinfo=MOSCOW)
+        assert month_bounds(moment) == (datetime.date(2026, 10, 1), datetime.date(2026, 11, 1))
+        assert month_bounds(datetime.datetime(2026, 12, 31, 23, 0, tzinfo=datetime.timezone.utc)) == \
+            (datetime.date(2026, 12, 1), datetime.date(2027, 1, 1))
+
+
+class FlakyWriter(HistoryWriter):
+    def __init__(self, errors):
+        super().__init__(batch_size=10, flush_interval=1, max_pending=10, max_attempts=3, retry_delay=0.5)
+        self.errors = errors
+        self.written = []
+
+    def write_once(self, batch):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.written.extend(batch)
+
+
+class TestHistoryWriter:
+    def test_transient_errors_are_retried(self, monkeypatch):
+        outcomes = []
+        delays = []
+        monkeypatch.setattr(history.history_events, 'inc', lambda outcome, amount=1: outcomes.append((outcome, amount)))
+        monkeypatch.setattr(history.time, 'sleep', delays.append)
+        batch = [Event('user', 'speak', 1, at(2), 90.0, None)]
+
+        writer = FlakyWriter([psycopg2.OperationalError('server closed the connection'),
+                              psycopg2.OperationalError('could not connect')])
+        writer.write(batch)
+        assert writer.written == batch
+        assert outcomes == [('retried', 1), ('retried', 1), ('written', 1)]
+        assert delays == [0.5, 1.0]
+
+        # Попытки закончились - пачка отбрасывается
+        outcomes.clear()
+        writer = FlakyWriter([psycopg2.OperationalError('down')] * 3)
+        writer.write(batch)
+        assert writer.written == [] and outcomes == [('retried', 1), ('retried', 1), ('dropped', 1)]
+
+        # Ошибку в данных повтор не исправит
+        outcomes.clear()
+        writer = FlakyWriter([psycopg2.DataError('bad value')])
+        writer.write(batch)
+        assert writer.written == [] and outcomes == [('dropped', 1)]
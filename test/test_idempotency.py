@@ -0,0 +1,39 @@
+from dialog import DialogHandler
+from idempotency import ResponseCache
+from mock_connection import MockStorageConnectionFactory
+from test_dialog import create_request
+
+
+def message(user_id: str, message_id: int, command: str, intent: str = None):
+    req = create_request(user_id, command)
+    req._req['session'].update({'session_id': 'dedup-session', 'message_id': message_id})
+    if intent:
+        req._req['request']['nlu']['intents'][intent] = {}
+    return req
+
+
+class TestIdempotency:
+    def test_retried_turn_does_not_skip_speaker(self):
+        factory = MockStorageConnectionFactory()
+        factory.storage.create_user('dedup-user')
+        for first_name in ['иван', 'мария', 'олег']:
+            factory.storage.add_team_member('dedup-user', {'first_name': first_name})
+        DialogHandler(factory).handle_dialog(message('dedup-user', 1, 'начни стендап'))
+
+        first, retry = DialogHandler(factory), DialogHandler(factory)
+        first.handle_dialog(message('dedup-user', 2, 'у меня всё', 'end.report'))
+        retry.handle_dialog(message('dedup-user', 2, 'у меня всё', 'end.report'))
+        assert retry.replayed and not first.replayed
+        assert retry.response == first.response
+        assert first.response['text'] == 'Мария, расскажи о прошедшем дне'
+        assert factory.storage.storage['dedup-user']['cur_speaker'] == 2
+
+    def test_response_cache_keeps_its_own_copy(self):
+        cache = ResponseCache(maxsize=10, ttl=60)
+        response = {'text': 'Мария, расскажи о прошедшем дне', 'end_session': False}
+        cache.put(('session', 2), response)
+        response['text'] = 'изменено'
+        assert cache.get(('session', 2))['text'] == 'Мария, расскажи о прошедшем дне'
+        assert cache.get(('session', 3)) is None
+        assert cache.get(None) is None
+        assert ResponseCache(maxsize=0, ttl=60).get(('session', 2)) is None
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from issue_cache import IssueListCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestIssueListCache:
+    def test_stale_entry_is_served_while_refreshing(self):
+        clock = FakeClock()
+        cache = IssueListCache(maxsize=10, ttl=60, max_age=3600, timer=clock)
+        assert cache.get('repo', lambda: ['1. Старый'], Deadline(1)) == ['1. Старый']
+
+        clock.now = 120
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch():
+            started.set()
+            release.wait(5)
+            return ['2. Новый']
+
+        assert cache.get('repo', slow_fetch, Deadline(1)) == ['1. Старый']
+        assert started.wait(1)
+        release.set()
+        cache.refresh('repo', slow_fetch).result(timeout=1)
+        assert cache.get('repo', slow_fetch, Deadline(1)) == ['2. Новый']
+
+    def test_miss_respects_deadline(self):
+        cache = IssueListCache(maxsize=10, ttl=60, max_age=3600)
+        release = threading.Event()
+        with pytest.raises(DeadlineExceeded):
+            cache.get('repo', lambda: release.wait(5) and ['1. Тикет'], Deadline(0.05))
+        release.set()
+
+    def test_closed_issue_is_removed(self):
+        cache = IssueListCache(maxsize=10, ttl=60, max_age=3600)
+        cache.get('repo', lambda: ['1. Первый', '12. Второй'], Deadline(1))
+        cache.discard_issue('repo', '1. ')
+        assert cache.get('repo', lambda: [], Deadline(1)) == ['12. Второй']
@@ -0,0 +1,96 @@
+import requests
+from cryptography.fernet import Fernet
+
+import jobs
+from jobs import JobRunner
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(str(status), response=response)
+
+
+class RecordingRunner(JobRunner):
+    def __init__(self, job, **kwargs):
+        super().__init__(workers=0, poll_interval=1, lease=60, max_attempts=3, backoff=5, max_backoff=300, **kwargs)
+        self.job = job
+        self.outcomes = []
+
+    def claim(self, conn):
+        return self.job
+
+    def retry(self, conn, job_id, delay):
+        self.outcomes.append(('retry', job_id, delay))
+
+    def finish(self, conn, job_id, state, result):
+        self.outcomes.append((state, job_id, result))
+
+
+class TestJobRunner:
+    def test_transient_errors_are_retried_with_backoff(self, monkeypatch):
+        def close_issue(args):
+            raise http_error(503)
+
+        monkeypatch.setitem(jobs.HANDLERS, 'close_issue', (close_issue, jobs.HANDLERS['close_issue'][1]))
+        args = {'tracker': 'github', 'issue': 3}
+        runner = RecordingRunner((1, 'close_issue', args, 2))
+        assert runner.run_next(None)
+        state, job_id, delay = runner.outcomes[0]
+        assert (state, job_id) == ('retry', 1) and 5 <= delay <= 10
+
+        # Попытки закончились - задача завершается с сообщением об ошибке
+        runner.job = (1, 'close_issue', args, 3)
+        runner.run_next(None)
+        assert runner.outcomes[1] == ('failed', 1, 'Не удалось закрыть тикет 3 в гитхабе.')
+
+    def test_permanent_errors_fail_at_once(self, monkeypatch):
+        def close_issue(args):
+            raise http_error(404)
+
+        monkeypatch.setitem(jobs.HANDLERS, 'close_issue', (close_issue, jobs.HANDLERS['close_issue'][1]))
+        runner = RecordingRunner((2, 'close_issue', {'tracker': 'tracker', 'issue': 7}, 1))
+        runner.run_next(None)
+        assert runner.outcomes == [('failed', 2, 'Не удалось закрыть тикет 7 в трекере.')]
+        assert jobs.retryable(requests.ConnectionError()) and jobs.retryable(http_error(429))
+
+    def test_abandoned_job_is_not_run_again(self, monkeypatch):
+        # Поток, выполнявший последнюю попытку, умер: после аренды задача завершается ошибкой
+        calls = []
+        monkeypatch.setitem(jobs.HANDLERS, 'close_issue', (calls.append, jobs.HANDLERS['close_issue'][1]))
+        runner = RecordingRunner((5, 'close_issue', {'tracker': 'github', 'issue': 8}, 4))
+        assert runner.run_next(None)
+        assert calls == []
+        assert runner.outcomes == [('failed', 5, 'Не удалось закрыть тикет 8 в гитхабе.')]
+
+    def test_unknown_kind_fails_the_job(self):
+        runner = RecordingRunner((3, 'reopen_issue', {'tracker': 'github', 'issue': 1}, 1))
+        assert runner.run_next(None)
+        assert runner.outcomes == [('failed', 3, 'Не удалось выполнить фоновую задачу.')]
+
+    def test_crash_outside_handler_fails_the_job(self, monkeypatch):
+        def observe(*args):
+            raise ValueError('broken metric')
+
+        monkeypatch.setitem(jobs.HANDLERS, 'close_issue', (lambda args: 'Закрыт.', jobs.HANDLERS['close_issue'][1]))
+        monkeypatch.setattr(jobs.job_seconds, 'observe', observe)
+        runner = RecordingRunner((4, 'close_issue', {'tracker': 'github', 'issue': 5}, 1))
+        assert runner.run_next(None)
+        assert runner.outcomes == [('failed', 4, 'Не удалось закрыть тикет 5 в гитхабе.')]
+
+
+class TestTokenSealing:
+    def test_tracker_token_is_encrypted(self, monkeypatch):
+        monkeypatch.setenv('TOKEN_SEAL_KEY', Fernet.generate_key().decode())
+        jobs.token_cipher.cache_clear()
+        try:
+            sealed = jobs.seal_token('secret-oauth-token')
+            assert 'secret-oauth-token' not in sealed
+            assert jobs.open_token(sealed) == 'secret-oauth-token'
+        finally:
+            jobs.token_cipher.cache_clear()
+
+    def test_no_key_no_token(self, monkeypatch):
+        monkeypatch.delenv('TOKEN_SEAL_KEY', raising=False)
+        jobs.token_cipher.cache_clear()
+        assert jobs.seal_token('secret-oauth-token') is None
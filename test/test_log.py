@@ -0,0 +1,28 @@
+import json
+import logging
+
+from log import JsonFormatter, SamplingFilter, truncate
+
+
+def make_record(name, level, **extra):
+    record = logging.LogRecord(name, level, __file__, 1, 'request %s', ('один',), None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestLog:
+    def test_sampling_keeps_warnings_and_unlisted_categories(self):
+        sampling = SamplingFilter({'webhook': 0.0})
+        assert not sampling.filter(make_record('webhook', logging.INFO))
+        assert sampling.filter(make_record('webhook', logging.WARNING))
+        assert sampling.filter(make_record('github', logging.INFO))
+
+    def test_json_record_contains_extra_fields(self):
+        data = json.loads(JsonFormatter().format(make_record('webhook', logging.INFO, command='помощь')))
+        assert data['message'] == 'request один'
+        assert data['command'] == 'помощь'
+        assert data['logger'] == 'webhook'
+
+    def test_truncate_long_values(self):
+        assert truncate('a' * 10, 4) == 'aaaa...(+6)'
+        assert truncate([1, 2], 10) == '[1, 2]'
@@ -0,0 +1,29 @@
+from metrics import Counter, Histogram, authorized, registry
+
+
+class TestMetrics:
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test histogram', ['handler'], buckets=(0.1, 1.0))
+        registry.remove(histogram)
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe(value, 'help')
+        lines = histogram.render().splitlines()
+        assert 'test_seconds_bucket{handler="help",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{handler="help",le="1.0"} 3' in lines
+        assert 'test_seconds_bucket{handler="help",le="+Inf"} 4' in lines
+        assert 'test_seconds_count{handler="help"} 4' in lines
+
+    def test_counter_per_label(self):
+        counter = Counter('test_total', 'Test counter', ['status'])
+        registry.remove(counter)
+        counter.inc('200')
+        counter.inc('304', amount=2)
+        assert counter.render().splitlines()[2:] == ['test_total{status="200"} 1', 'test_total{status="304"} 2']
+
+    def test_endpoint_needs_token(self, monkeypatch):
+        monkeypatch.delenv('METRICS_TOKEN', raising=False)
+        assert not authorized('Bearer ')
+        monkeypatch.setenv('METRICS_TOKEN', 'secret')
+        assert authorized('Bearer secret')
+        assert not authorized('Bearer other')
+        assert not authorized(None)
@@ -0,0 +1,13 @@
+from render import display_name, roster_text
+
+
+def person(person_id, first_name, last_name):
+    return {'person_id': person_id, 'first_name': first_name, 'last_name': last_name}
+
+
+class TestRender:
+    def test_roster_and_display_names(self):
+        team = [person(1, 'иван', 'петров'), person(2, 'мария', '')]
+        assert roster_text(team) == 'Твоя команда: Петров Иван,  Мария'
+        assert display_name('иван', 'петров') == 'Иван Петров'
+        assert display_name('мария', None) == 'Мария'
@@ -0,0 +1,38 @@
+from router import PrefixTrie, Router
+
+
+class TestRouter:
+    def test_longest_prefix_wins(self):
+        trie = PrefixTrie()
+        trie.add('запомни', 'short')
+        trie.add('запомни тему ', 'long')
+        assert trie.longest_prefix('запомни тему релиз и деплой') == ('long', 'релиз и деплой')
+        assert trie.longest_prefix('запомни тему') == ('short', 'тему')
+        assert trie.longest_prefix('запомни гитхаб') == ('short', 'гитхаб')
+        assert trie.longest_prefix('забудь') is None
+
+    def test_match_order_and_arguments(self):
+        router = Router()
+        router.exact('стоп')('exact')
+        router.prefix('запомни тему ')('prefix')
+        router.regex('закрой тикет (?P<number>[0-9]+)')('close')
+        router.regex('(?:начни|проведи) стендап')('start')
+        router.intent('end.report')('intent')
+
+        assert router.match('стоп', {'end.report': {}}) == ('exact', None)
+        assert router.match('запомни тему релиз', {}) == ('prefix', 'релиз')
+        handler, match = router.match('закрой тикет 42', {})
+        assert handler == 'close' and match.group('number') == '42'
+        assert router.match('проведи стендап', {})[0] == 'start'
+        assert router.match('у меня всё', {'end.report': {'slots': {}}}) == ('intent', {'slots': {}})
+        assert router.match('что-то ещё', {}) is None
+
+    def test_intents_first(self):
+        router = Router(intents_first=True)
+        router.prefix('запомни тему ')('prefix')
+        router.exact('продолжить')('exact')
+        router.intent('end.report')('intent')
+
+        assert router.match('запомни тему у меня всё', {'end.report': {}}) == ('intent', {})
+        assert router.match('запомни тему релиз', {}) == ('prefix', 'релиз')
+        assert router.match('продолжить', {}) == ('exact', None)
@@ -0,0 +1,164 @@
+from dialog import DialogHandler
+from standup_state import StandupStateCache
+from test_dialog import create_request
+from unit_of_work import UnitOfWork
+from user import User
+
+USER_ID = 'standup-state-user'
+
+
+class VersionedDatabase:
+    # Строка users и команда с standup_version, как в Postgres
+    def __init__(self):
+        self.standup_held = False
+        self.cur_speaker = 0
+        self.speaker_queue = []
+        self.version = 0
+        self.job_reports = []
+        self.team = [{'person_id': 1, 'first_name': 'иван', 'last_name': 'петров', 'theme': None},
+                     {'person_id': 2, 'first_name': 'мария', 'last_name': None, 'theme': None},
+                     {'person_id': 3, 'first_name': 'олег', 'last_name': None, 'theme': None}]
+
+
+class VersionedConnection:
+    def __init__(self, database: VersionedDatabase):
+        self.db = database
+        self.calls = []
+        self.query_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return None
+
+    def begin_batch(self):
+        pass
+
+    def load_user_state(self, user_id: str):
+        self.calls.append('load_user_state')
+        user = User(user_id, self.db.standup_held, self.db.cur_speaker, None, None, None, None, None, False,
+                    list(self.db.speaker_queue), job_reports=list(self.db.job_reports),
+                    standup_version=self.db.version)
+        return user, [dict(person) for person in self.db.team]
+
+    def start_standup(self, user_id: str, started_at):
+        self.calls.append('start_standup')
+        self.db.standup_held, self.db.cur_speaker = True, 0
+        self.db.speaker_queue = [p['person_id'] for p in self.db.team]
+        self.db.version += 1
+
+    def call_next_speaker(self, user_id: str, started_at):
+        self.calls.append('call_next_speaker')
+        self.db.cur_speaker += 1
+        self.db.version += 1
+        if self.db.cur_speaker > len(self.db.speaker_queue):
+            raise IndexError('speaker queue is exhausted')
+        person = self.db.team[self.db.cur_speaker - 1]
+        return dict(person, last_name=person['last_name'] or '', position=self.db.cur_speaker,
+                    version=self.db.version)
+
+    def advance_speaker(self, user_id: str, position: int, started_at, version: int) -> bool:
+        self.calls.append('advance_speaker')
+        if version != self.db.version:
+            return False
+        self.db.cur_speaker = position
+        self.db.version += 1
+        return True
+
+    def reset_user_checked(self, user_id: str, version: int) -> bool:
+        self.calls.append('reset_user_checked')
+        if version != self.db.version:
+            return False
+        self.db.standup_held, self.db.cur_speaker, self.db.speaker_queue = False, 0, []
+        self.db.version += 1
+        return True
+
+    def get_standup_version(self, user_id: str) -> int:
+        self.calls.append('get_standup_version')
+        return self.db.version
+
+    def mark_jobs_reported(self, user_id: str, job_ids):
+        self.calls.append('mark_jobs_reported')
+        self.db.job_reports = [r for r in self.db.job_reports if r['job_id'] not in job_ids]
+
+    def finish_job(self, job_id: int, result: str):
+        # Как JobRunner.finish: результат появляется вместе с новой версией стендапа
+        self.db.job_reports.append({'job_id': job_id, 'result': result})
+        self.db.version += 1
+
+
+class Worker:
+    # Один процесс навыка: своё соединение и своя копия стендапов в памяти
+    def __init__(self, database: VersionedDatabase):
+        self.connection = VersionedConnection(database)
+        self.states = StandupStateCache(maxsize=100)
+
+    def create_conn(self, cached: bool = True) -> UnitOfWork:
+        return UnitOfWork(self.connection, self.states if cached else StandupStateCache(0))
+
+    def record_history(self, events):
+        pass
+
+    def say(self, command: str, intent: str = None) -> str:
+        self.connection.calls = []
+        req = create_request(USER_ID, command)
+        if intent:
+            req._req['request']['nlu']['intents'][intent] = {}
+        handler = DialogHandler(self)
+        handler.handle_dialog(req)
+        return handler.response['text']
+
+
+class TestStandupState:
+    def test_turns_are_served_from_memory(self):
+        worker = Worker(VersionedDatabase())
+        assert worker.say('начни стендап') == 'Хорошо, начинаю.\nИван Петров, расскажи о прошедшем дне'
+        assert worker.say('у меня всё', 'end.report') == 'Мария, расскажи о прошедшем дне'
+        assert worker.connection.calls == ['advance_speaker']
+        assert worker.say('продолжить') == ' '
+        assert worker.connection.calls == ['get_standup_version']
+
+    def test_change_by_another_worker_is_detected(self):
+        database = VersionedDatabase()
+        first, second = Worker(database), Worker(database)
+        first.say('начни стендап')
+        second.say('у меня всё', 'end.report')
+        assert first.say('у меня всё', 'end.report') == 'Олег, расскажи о прошедшем дне'
+        assert first.connection.calls == ['advance_speaker', 'load_user_state', 'call_next_speaker']
+        assert database.cur_speaker == 3
+
+    def test_finished_standup_leaves_memory(self):
+        database = VersionedDatabase()
+        worker = Worker(database)
+        worker.say('начни стендап')
+        worker.say('закончи стендап')
+        assert worker.connection.calls == ['get_standup_version', 'reset_user_checked']
+        assert worker.states.get(USER_ID) is None
+        assert not database.standup_held
+
+    def test_retry_reads_the_database(self):
+        # Пока запрос откатывался, устаревшую копию снова положил в память другой запрос того же процесса
+        class StickyCache(StandupStateCache):
+            def discard(self, user_id: str, stale: bool = False):
+                pass
+
+        database = VersionedDatabase()
+        first, second = Worker(database), Worker(database)
+        first.states = StickyCache(maxsize=100)
+        first.say('начни стендап')
+        second.say('у меня всё', 'end.report')
+        assert first.say('у меня всё', 'end.report') == 'Олег, расскажи о прошедшем дне'
+        assert first.connection.calls == ['advance_speaker', 'load_user_state', 'call_next_speaker']
+
+    def test_job_finished_during_standup_is_reported(self):
+        database = VersionedDatabase()
+        worker = Worker(database)
+        worker.say('начни стендап')
+        worker.connection.finish_job(1, 'Тикет 7 закрыт.')
+        assert worker.say('у меня всё', 'end.report') == 'Тикет 7 закрыт.\nМария, расскажи о прошедшем дне'
+        assert worker.connection.calls == ['advance_speaker', 'load_user_state', 'call_next_speaker',
+                                           'mark_jobs_reported']
+        # Повтор шёл мимо памяти, поэтому стендап снова читается из базы, но результат уже показан
+        assert worker.say('у меня всё', 'end.report') == 'Олег, расскажи о прошедшем дне'
+        assert worker.connection.calls == ['load_user_state', 'call_next_speaker']
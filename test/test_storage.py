@@ -0,0 +1,217 @@
+import datetime
+import threading
+
+import psycopg2.errors
+import pytest
+from cryptography.fernet import Fernet
+
+import jobs
+import storage
+from idempotency import ResponsePending
+from storage import BoundedConnectionPool, PoolTimeout, StorageConnection, TokenStore
+
+
+class FakeConnection:
+    closed = 0
+
+
+class FakePool(BoundedConnectionPool):
+    def _connect(self, key=None):
+        conn = FakeConnection()
+        if key is not None:
+            self._used[key] = conn
+            self._rused[id(conn)] = key
+        else:
+            self._pool.append(conn)
+        return conn
+
+    def _putconn(self, conn, key=None, close=False):
+        key = self._rused.pop(id(conn))
+        del self._used[key]
+        if not close:
+            self._pool.append(conn)
+
+
+class TestBoundedConnectionPool:
+    def test_waits_for_released_connection(self):
+        pool = FakePool(1, 1, timeout=5)
+        conn = pool.getconn()
+        timer = threading.Timer(0.05, pool.putconn, (conn,))
+        timer.start()
+        assert pool.getconn() is conn
+        assert pool.stats()['acquired'] == 2
+        assert pool.stats()['max_wait_time'] > 0
+
+    def test_times_out_when_exhausted(self):
+        pool = FakePool(1, 1, timeout=0.05)
+        pool.getconn()
+        with pytest.raises(PoolTimeout):
+            pool.getconn()
+        assert pool.stats() == {'checked_out': 1, 'idle': 0, 'waiting': 0, 'acquired': 1, 'timeouts': 1,
+                                'wait_time': pool.wait_time, 'max_wait_time': pool.max_wait_time}
+
+
+class RecordingCursor:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return None
+
+    def mogrify(self, query, params):
+        return (query % params).encode()
+
+    def execute(self, query, params=None):
+        self.executed.append(query.decode() if isinstance(query, bytes) else query % params)
+
+    def fetchone(self):
+        return True,
+
+
+class BatchingConnection:
+    # Логика отложенных записей StorageConnection без соединения с базой, запросы без PREPARE
+    _statement = StorageConnection._statement
+    _send = StorageConnection._send
+    _execute = StorageConnection._execute
+    _write = StorageConnection._write
+    begin_batch = StorageConnection.begin_batch
+    flush = StorageConnection.flush
+    modify_silence = StorageConnection.modify_silence
+    check_standup = StorageConnection.check_standup
+    claim_response = StorageConnection.claim_response
+
+    def __init__(self):
+        self.batch = None
+        self.prepare_statements = False
+        self.share_responses = True
+        self.executed = []
+
+    def cursor(self):
+        return RecordingCursor(self.executed)
+
+
+class TestBatching:
+    def test_pending_writes_ride_along_with_read(self):
+        conn = BatchingConnection()
+        conn.begin_batch()
+        conn.modify_silence('user', True)
+        conn.modify_silence('user', False)
+        assert conn.executed == []
+        assert conn.check_standup('user')
+        assert len(conn.executed) == 1
+        statements = conn.executed[0].split(';')
+        assert [s.split()[0] for s in statements] == ['UPDATE', 'UPDATE', 'SELECT']
+        assert conn.batch == []
+
+    def test_flush_sends_remaining_writes_once(self):
+        conn = BatchingConnection()
+        conn.begin_batch()
+        conn.modify_silence('user', True)
+        conn.flush()
+        conn.flush()
+        assert len(conn.executed) == 1 and conn.executed[0].startswith('UPDATE users SET silence_enabled')
+
+    def test_writes_without_batch_go_immediately(self):
+        conn = BatchingConnection()
+        conn.modify_silence('user', True)
+        conn.modify_silence('user', False)
+        assert len(conn.executed) == 2
+        assert conn.batch is None
+
+
+    def test_claim_waits_no_longer_than_the_deadline(self):
+        conn = BatchingConnection()
+        conn.begin_batch()
+        conn.claim_response('session', 3, 0.25)
+        assert conn.check_standup('user')
+        statements = conn.executed[0].split(';')
+        assert "set_config('lock_timeout', 250ms, true)" in statements[0]
+        assert statements[1].startswith('INSERT INTO webhook_responses')
+        assert 'reset_val' in statements[2] and statements[3].startswith('SELECT standup_held')
+
+    def test_lock_timeout_on_claim_means_response_pending(self, monkeypatch):
+        def execute(cursor, query, params=None):
+            raise psycopg2.errors.LockNotAvailable('canceling statement due to lock timeout')
+
+        conn = BatchingConnection()
+        monkeypatch.setattr(RecordingCursor, 'execute', execute)
+        conn.begin_batch()
+        conn.claim_response('session', 3, 0.25)
+        with pytest.raises(ResponsePending):
+            conn.check_standup('user')
+        with pytest.raises(psycopg2.errors.LockNotAvailable):
+            conn.check_standup('user')
+
+
+class TokenConnection:
+    # Соединение без базы: токенов в таблице нет, каждый get_or_mint выпускает новый
+    closed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return None
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return None
+
+
+@pytest.fixture
+def seal_key(monkeypatch):
+    monkeypatch.setenv('TOKEN_SEAL_KEY', Fernet.generate_key().decode())
+    jobs.token_cipher.cache_clear()
+    yield
+    jobs.token_cipher.cache_clear()
+
+
+class TestTokenStore:
+    def test_slow_mint_does_not_block_other_installations(self, monkeypatch, seal_key):
+        monkeypatch.setattr(storage.psycopg2, 'connect', lambda **kwargs: TokenConnection())
+        store = TokenStore()
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        minting, released = threading.Event(), threading.Event()
+
+        def slow_mint(installation):
+            minting.set()
+            released.wait(5)
+            return 'slow', expires_at
+
+        slow = threading.Thread(target=store.get_or_mint, args=('1', slow_mint, datetime.timedelta(0)))
+        slow.start()
+        assert minting.wait(5)
+        assert store.get_or_mint('2', lambda installation: ('fast', expires_at), datetime.timedelta(0)) == \
+            ('fast', expires_at)
+        released.set()
+        slow.join(5)
+        assert len(store.idle) == 2
+
+    def test_tokens_are_stored_sealed(self, monkeypatch, seal_key):
+        stored = {}
+
+        class SealedConnection(TokenConnection):
+            def execute(self, query, params=None):
+                if query.lstrip().startswith('INSERT'):
+                    stored['token'] = params[1]
+
+            def fetchone(self):
+                return (stored['token'], expires_at) if stored else None
+
+        monkeypatch.setattr(storage.psycopg2, 'connect', lambda **kwargs: SealedConnection())
+        store = TokenStore()
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        assert store.get_or_mint('1', lambda installation: ('ghs_secret', expires_at), datetime.timedelta(0)) == \
+            ('ghs_secret', expires_at)
+        assert 'ghs_secret' not in stored['token']
+        # Второй вызов читает и расшифровывает сохранённый токен, не выпуская новый
+        assert store.get_or_mint('1', lambda installation: ('ghs_other', expires_at), datetime.timedelta(0)) == \
+            ('ghs_secret', expires_at)
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import http_client
+import tracker
+from tracker import YandexTracker
+
+
+class TestYandexTracker:
+    def test_list_issues_stops_at_display_limit(self, monkeypatch):
+        consumed = []
+        searches = []
+
+        def find(**kwargs):
+            searches.append(kwargs)
+            for number in range(1, 10000):
+                consumed.append(number)
+                yield SimpleNamespace(key=f'TEST-{number}', summary=f'Тикет {number}')
+
+        client = SimpleNamespace(issues=SimpleNamespace(find=find))
+        monkeypatch.setattr(tracker, 'get_ytc', lambda token, org_id: client)
+
+        issues = YandexTracker('token', 'org', 'TEST').list_issues()
+
+        assert issues == [f'TEST-{number}: Тикет {number}' for number in range(1, tracker.ISSUES_LIMIT + 1)]
+        assert len(consumed) == tracker.ISSUES_LIMIT
+        assert searches[0]['per_page'] == tracker.ISSUES_LIMIT
+        assert 'Resolution: empty()' in searches[0]['query']
+        assert searches[0]['query'].startswith('Queue: "TEST" ')
+
+    def test_queue_is_quoted_in_query(self, monkeypatch):
+        searches = []
+        client = SimpleNamespace(issues=SimpleNamespace(find=lambda **kwargs: searches.append(kwargs) or []))
+        monkeypatch.setattr(tracker, 'get_ytc', lambda token, org_id: client)
+
+        YandexTracker('token', 'org', 'TEST" OR Queue: OTHER \\').list_issues()
+        assert searches[0]['query'].startswith('Queue: "TEST\\" OR Queue: OTHER \\\\" Resolution: empty()')
+
+    def test_team_members_come_with_queue(self, monkeypatch):
+        requests = []
+
+        def get(key, **params):
+            requests.append((key, params))
+            return SimpleNamespace(teamUsers=[SimpleNamespace(display='Иван Петров')])
+
+        client = SimpleNamespace(queues=SimpleNamespace(get=get))
+        monkeypatch.setattr(tracker, 'get_ytc', lambda token, org_id: client)
+
+        assert YandexTracker('token', 'org', 'TEST').team_members() == ['Иван Петров']
+        assert requests == [('TEST', {'expand': 'team'})]
+
+    def test_client_is_reused_and_pooled(self):
+        client = tracker.get_ytc('pooled-token', 'org')
+        assert tracker.get_ytc('pooled-token', 'org') is client
+        assert tracker.get_ytc('other-token', 'org') is not client
+        assert client._connection.session.get_adapter('https://api.tracker.yandex.net') is http_client.adapter()
@@ -0,0 +1,65 @@
+from dialog import DialogHandler
+from test_dialog import create_request
+from unit_of_work import UnitOfWork
+from user import User
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.calls = []
+        self.query_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return None
+
+    def begin_batch(self):
+        pass
+
+    def load_user_state(self, user_id: str):
+        self.calls.append('load_user_state')
+        self.query_count += 1
+        user = User(user_id, False, 0, 'login', 'repo', '1', None, None, False)
+        team = [{'person_id': 1, 'first_name': 'иван', 'last_name': 'петров', 'theme': None},
+                {'person_id': 2, 'first_name': 'мария', 'last_name': 'сидорова', 'theme': None}]
+        return user, team
+
+    def __getattr__(self, item):
+        def call(*args):
+            self.calls.append(item)
+        return call
+
+
+class RecordingConnectionFactory:
+    def __init__(self):
+        self.connection = RecordingConnection()
+
+    def create_conn(self, cached: bool = True) -> UnitOfWork:
+        return UnitOfWork(self.connection)
+
+
+class TestUnitOfWork:
+    def test_reads_are_served_from_snapshot(self):
+        factory = RecordingConnectionFactory()
+        handler = DialogHandler(factory)
+        handler.handle_dialog(create_request('user', 'напомни команду'))
+        assert handler.response['text'] == 'Твоя команда: Петров Иван, Сидорова Мария'
+        assert factory.connection.calls == ['load_user_state']
+
+    def test_unknown_member_is_not_deleted(self):
+        factory = RecordingConnectionFactory()
+        with factory.create_conn() as uow:
+            uow.get_user('user')
+            assert not uow.del_team_member('user', {'first_name': 'олег'})
+            uow.modify_silence('user', True)
+            assert uow.get_user('user').silence_enabled
+        assert factory.connection.calls == ['load_user_state', 'modify_silence']
+
+    def test_import_skips_known_members_without_query(self):
+        factory = RecordingConnectionFactory()
+        with factory.create_conn() as uow:
+            uow.get_user('user')
+            assert uow.import_team_members('user', [{'first_name': 'иван', 'last_name': 'петров'}]) == []
+        assert factory.connection.calls == ['load_user_state']